@@ -3,6 +3,8 @@ from time import sleep
 import inquirer
 import cma
 import config
+import httpClient
+import ledger
 import exportStructure
 import importStructure
 import exportContent
@@ -95,9 +97,10 @@ def findStack(orgs, authToken, region, action='EXPORT'):
     except TypeError:
         exitProgram()
 
-def initiateExportStackStructure(organizations, token, region):
+def initiateExportStackStructure(organizations, token, region, withContent=False):
     '''
     Exporting stack structure initation
+    withContent: Content export follows. The export is not done (in the export ledger) until that is finished
     '''
     exportedStackName, exportedStack = findStack(organizations, token, region, 'EXPORT') # Choosing the org and stack to export from
     if not exportedStackName:
@@ -112,8 +115,6 @@ def initiateExportStackStructure(organizations, token, region):
         'fullPath': config.dataRootFolder + config.stackRootFolder + folder
     }
 
-    config.logging.info('Stack structure will be exported to ' + folder['fullPath'])
-    exportStructure.exportStack(exportedStack['uid'], token, region, folder) # Exporting the stack
     info = {
         'stack': exportedStack,
         'stackName': exportedStackName,
@@ -122,27 +123,72 @@ def initiateExportStackStructure(organizations, token, region):
         'masterLocale': masterLocale,
         'region': region,
     }
+    config.addToExportReport('stackStructureExportInfo', info, folder['fullPath']) # Written first - needed to resume an interrupted export
+    config.flushExportReport(folder['fullPath'])
+    if withContent:
+        ledger.mark(folder['fullPath'], 'content', ledger.PENDING)
+    config.logging.info('Stack structure will be exported to ' + folder['fullPath'])
+    exportStructure.exportStack(exportedStack['uid'], token, region, folder) # Exporting the stack
+    if not withContent:
+        ledger.mark(folder['fullPath'], 'export', ledger.DONE)
     return info
 
+def exportContentAndReport(stackStructureExportInfo, contentExportInfo, token):
+    '''
+    Exporting content and generating the export report. Used both by new and resumed exports
+    '''
+    folder = stackStructureExportInfo['folder']['fullPath']
+    config.addToExportReport('contentExportInfo', contentExportInfo, folder)
+    config.flushExportReport(folder)
+    exportContent.iniateExportContent(stackStructureExportInfo, contentExportInfo, token)
+    ledger.mark(folder, 'content', ledger.DONE)
+
+    config.logging.info('Generating Export Report.')
+    config.structureReport(folder)
+    config.logging.info('Finished Report: {}'.format(folder + config.exportReportFile))
+    ledger.mark(folder, 'export', ledger.DONE)
+    return True
+
 def initiateExportAll(organizations, token, region):
     '''
     Export All initation
     '''
 
-    stackStructureExportInfo = initiateExportStackStructure(organizations, token, region) # Begin stack structure export
+    stackStructureExportInfo = initiateExportStackStructure(organizations, token, region, True) # Begin stack structure export
     if not stackStructureExportInfo:
         return None
     contentExportInfo = exportContent.whatContentToExport(stackStructureExportInfo) # Choose what entries and assets to export
     if not contentExportInfo:
         return None
-    exportContent.iniateExportContent(stackStructureExportInfo, contentExportInfo, token)
-    config.addToExportReport('stackStructureExportInfo', stackStructureExportInfo, stackStructureExportInfo['folder']['fullPath'])
-    config.addToExportReport('contentExportInfo', contentExportInfo, stackStructureExportInfo['folder']['fullPath'])
+    return exportContentAndReport(stackStructureExportInfo, contentExportInfo, token)
 
-    config.logging.info('Generating Export Report.')
-    config.structureReport(stackStructureExportInfo['folder']['fullPath'])
-    config.logging.info('Finished Report: {}'.format(stackStructureExportInfo['folder']['fullPath'] + config.exportReportFile))
-    return True
+def initiateResumeExport(token, region):
+    '''
+    Resuming an interrupted export. Only the units of work not done according to the export ledger are exported again
+    '''
+    folderName = exportStructure.chooseResumableFolder()
+    if not folderName:
+        return None
+    fullPath = config.dataRootFolder + config.stackRootFolder + folderName
+    report = config.exportReport(fullPath)
+    stackStructureExportInfo = report.get('stackStructureExportInfo')
+    if not stackStructureExportInfo:
+        config.logging.error('{}Unable to resume export. Stack information is missing from the export report: {}{}'.format(config.RED, fullPath + config.exportReportFile, config.END))
+        return None
+    if stackStructureExportInfo['region'] != region:
+        config.logging.error('{}Unable to resume export. It was exported from a different region ({}){}'.format(config.RED, stackStructureExportInfo['region'], config.END))
+        return None
+    config.logging.info('{}Resuming export of stack {} to {}{}'.format(config.BOLD, stackStructureExportInfo['stackName'], fullPath, config.END))
+    exportStructure.exportStack(stackStructureExportInfo['apiKey'], token, region, stackStructureExportInfo['folder'])
+    if not ledger.state(fullPath, 'content'): # Only the structure was being exported
+        ledger.mark(fullPath, 'export', ledger.DONE)
+        return True
+    contentExportInfo = report.get('contentExportInfo')
+    if not contentExportInfo: # Interrupted before the content questions were answered
+        contentExportInfo = exportContent.whatContentToExport(stackStructureExportInfo)
+        if not contentExportInfo:
+            return None
+    return exportContentAndReport(stackStructureExportInfo, contentExportInfo, token)
 
 def initiateImportStackStructure(organizations, t, r):
     '''
@@ -176,7 +222,7 @@ def whatToExport(organizations, token, region):
         chooseAction = [
             inquirer.List('chosenAction',
                           message="{}Choose Action to perform{}".format(config.BOLD, config.END),
-                          choices=['Export Stack Structure and Content', 'Export Stack Structure', 'Go Back'],
+                          choices=['Export Stack Structure and Content', 'Export Stack Structure', 'Resume an Interrupted Export', 'Go Back'],
                           ),
         ]
         exportAnswer = inquirer.prompt(chooseAction)['chosenAction']
@@ -184,6 +230,8 @@ def whatToExport(organizations, token, region):
             initiateExportAll(organizations, token, region)
         elif exportAnswer == 'Export Stack Structure':
             initiateExportStackStructure(organizations, token, region)
+        elif exportAnswer == 'Resume an Interrupted Export':
+            initiateResumeExport(token, region)
     return None
 
 def whatToImport(organizations, token, region):
@@ -215,6 +263,7 @@ def whatToImport(organizations, token, region):
         exitProgram()
 
 def exitProgram():
+    httpClient.logConnectionStats()
     sleep(0.3)
     config.logging.info('Exiting...')
     sleep(0.3)
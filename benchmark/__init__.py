@@ -0,0 +1,283 @@
+'''
+End-to-end benchmark of export and import against the local mock Contentstack (mockStack).
+A synthetic stack of configurable size is seeded, exported (structure and content) and imported to a new stack.
+Every phase is measured: wall time, requests (and bytes) through the API, peak RSS, bytes written to disk.
+Results are written to a JSON file - and can be compared to an earlier run to catch regressions.
+
+    python -m benchmark --entries 500 --assets 100 --output results.json --compare baseline.json
+'''
+import os
+import random
+import shutil
+import platform
+import tempfile
+import threading
+import tracemalloc
+from time import time, sleep
+import config
+import jsonBackend
+import mockStack
+import exportStructure
+import exportContent
+import importStructure
+import importContent
+
+defaultScale = {
+    'contentTypes': 5,
+    'locales': 3, # Including the master locale
+    'entries': 200, # Per content type (in the master locale)
+    'localized': 0.3, # Share of entries localized in each of the other locales
+    'references': 2, # Average number of entry references per entry
+    'assets': 50,
+    'assetSize': 20000, # Bytes per asset file
+    'folderDepth': 3,
+    'foldersPerLevel': 2,
+    'environments': 2
+}
+
+def seedStack(store, name, scale, seed=None):
+    '''
+    Seeding a synthetic stack in the mock store. Returns the api key
+    Entries reference random entries of random content types (including cycles), and random assets
+    '''
+    rand = random.Random(seed)
+    masterLocale = 'en-us'
+    apiKey = store.createStack(name, masterLocale)['api_key']
+    locales = [masterLocale]
+    for i in range(1, scale['locales']):
+        code = 'l{}-xx'.format(i)
+        store.addItem(apiKey, 'locales', {'code': code, 'name': code, 'fallback_locale': locales[-1]})
+        locales.append(code)
+    environments = []
+    for i in range(scale['environments']):
+        environment = store.addItem(apiKey, 'environments', {'name': 'env{}'.format(i), 'urls': [{'locale': masterLocale, 'url': 'https://localhost/'}]})
+        environments.append(environment)
+    store.addItem(apiKey, 'stacks/delivery_tokens', {'name': 'token', 'description': '', 'scope': [{'module': 'environment', 'environments': [environments[0]], 'acl': {'read': True}}]})
+    for i in range(3):
+        store.addItem(apiKey, 'labels', {'name': 'label{}'.format(i), 'parent': []})
+    store.addItem(apiKey, 'roles', {'name': 'Editor', 'permissions': {}, 'rules': [{'module': 'environment', 'environments': [environments[0]['uid']], 'acl': {'read': True}}]})
+    contentTypes = ['ct{}'.format(i) for i in range(scale['contentTypes'])]
+    for uid in contentTypes:
+        store.addItem(apiKey, 'content_types', {'uid': uid, 'title': uid, 'schema': [
+            {'uid': 'title', 'data_type': 'text', 'display_name': 'Title', 'mandatory': True},
+            {'uid': 'body', 'data_type': 'text', 'display_name': 'Body', 'field_metadata': {'multiline': True}},
+            {'uid': 'related', 'data_type': 'reference', 'display_name': 'Related', 'reference_to': contentTypes, 'multiple': True},
+            {'uid': 'image', 'data_type': 'file', 'display_name': 'Image'}
+        ]})
+    folders = [None]
+    parents = [None]
+    for _ in range(scale['folderDepth']):
+        level = []
+        for parent in parents:
+            for i in range(scale['foldersPerLevel']):
+                level.append(store.addFolder(apiKey, 'folder{}'.format(i), parent)['uid'])
+        folders.extend(level)
+        parents = level
+    publish = lambda locale: [{'environment': environment['uid'], 'locale': locale} for environment in environments]
+    assets = []
+    for i in range(scale['assets']):
+        data = bytes(rand.getrandbits(8) for _ in range(min(scale['assetSize'], 256))) * (scale['assetSize'] // 256 + 1)
+        asset = store.addAsset(apiKey, 'asset{}.bin'.format(i), data[:scale['assetSize']], fields={'parent_uid': rand.choice(folders), 'publish_details': publish(masterLocale)})
+        assets.append(asset['uid'])
+    uids = {contentType: [mockStack.newUid() for _ in range(scale['entries'])] for contentType in contentTypes}
+    for contentType in contentTypes:
+        for number, uid in enumerate(uids[contentType]):
+            related = []
+            for _ in range(int(rand.random() * 2 * scale['references'] + 0.5)):
+                target = rand.choice(contentTypes)
+                related.append({'uid': rand.choice(uids[target]), '_content_type_uid': target})
+            entry = {
+                'title': '{} {}'.format(contentType, number),
+                'body': 'Lorem ipsum dolor sit amet ' * 10,
+                'related': related,
+                'image': rand.choice(assets) if assets else None,
+                'publish_details': publish(masterLocale)
+            }
+            store.addEntry(apiKey, contentType, masterLocale, entry, uid)
+            for locale in locales[1:]:
+                if rand.random() < scale['localized']:
+                    store.addEntry(apiKey, contentType, locale, dict(entry, title=entry['title'] + ' ' + locale, publish_details=publish(locale)), uid)
+    return apiKey
+
+def readRss():
+    '''
+    Resident set size of this process in bytes. Linux only (None elsewhere)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def readBytesWritten():
+    '''
+    Bytes this process has written (to files, sockets...). Linux only (None elsewhere)
+    '''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def folderSize(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size
+
+class RssSampler:
+    '''
+    Sampling the RSS in a background thread - The peak of a phase
+    '''
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = readRss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, name='rssSampler', daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while self.running:
+            rss = readRss()
+            if rss and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+def runPhase(name, server, folder, function, *args):
+    '''
+    Running a single phase and measuring it. Returns the measurements and what the function returned
+    '''
+    config.logging.info('{}Benchmark phase: {}{}'.format(config.BOLD, name, config.END))
+    mockStack.takeStats(server)
+    sizeBefore = folderSize(folder)
+    writtenBefore = readBytesWritten()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    sampler = RssSampler()
+    startTime = time()
+    result = function(*args)
+    seconds = time() - startTime
+    peakRss = sampler.stop()
+    writtenAfter = readBytesWritten()
+    stats = mockStack.takeStats(server)
+    phase = {
+        'name': name,
+        'seconds': round(seconds, 3),
+        'requests': stats['requests'],
+        'statuses': stats['statuses'],
+        'bytesUploaded': stats['bytesReceived'],
+        'bytesDownloaded': stats['bytesSent'],
+        'peakRss': peakRss,
+        'tracemallocPeak': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+        'bytesWritten': writtenAfter - writtenBefore if writtenBefore is not None and writtenAfter is not None else None,
+        'diskGrowth': folderSize(folder) - sizeBefore
+    }
+    config.logging.info('{}{name}: {seconds} seconds, {requests} requests{end}'.format(config.BOLD, end=config.END, **phase))
+    return phase, result
+
+def runBenchmark(scale=None, faults=None, workDir=None, seed=1, keep=False, traceMemory=False):
+    '''
+    Seeding a stack, exporting it and importing it to a new stack - measuring every phase
+    faults are the mockStack server settings (latency, jitter, rateLimit, errorRate)
+    '''
+    scale = dict(defaultScale, **(scale or {}))
+    workDir = workDir or tempfile.mkdtemp(prefix='benchmark-')
+    oldRoot = config.dataRootFolder
+    config.dataRootFolder = workDir.rstrip('/') + '/'
+    server = mockStack.startServer(**(faults or {}))
+    region = mockStack.pointRegions(server.url)
+    token = 'benchmark'
+    if traceMemory:
+        tracemalloc.start()
+    phases = []
+    try:
+        root = config.dataRootFolder + config.stackRootFolder
+        config.checkDir(root)
+        startTime = time()
+        apiKey = seedStack(server.store, 'Benchmark Export', scale, seed)
+        config.logging.info('Seeded stack in {:.1f} seconds'.format(time() - startTime))
+        folderName = 'benchmark/'
+        folder = {'name': folderName, 'fullPath': root + folderName}
+        config.checkDir(folder['fullPath'])
+        stack = {'org': server.store.organization['uid'], 'uid': apiKey, 'masterLocale': 'en-us'}
+        info = {'stack': stack, 'stackName': 'Benchmark Export', 'apiKey': apiKey, 'folder': folder, 'masterLocale': 'en-us', 'region': region}
+        config.addToExportReport('stackStructureExportInfo', info, folder['fullPath'])
+        config.flushExportReport(folder['fullPath'])
+        phase, _ = runPhase('exportStructure', server, workDir, exportStructure.exportStack, apiKey, token, region, folder)
+        phases.append(phase)
+        contentInfo = {
+            'environments': 'all',
+            'assets': 'all',
+            'downloadAssets': True,
+            'languages': [item['code'] for item in server.store.stacks[apiKey]['modules']['locales'].values()],
+            'contentTypes': exportStructure.getContentTypeUids(folder),
+            'incrementalFrom': None
+        }
+        config.addToExportReport('contentExportInfo', contentInfo, folder['fullPath'])
+        phase, _ = runPhase('exportContent', server, workDir, exportContent.iniateExportContent, info, contentInfo, token)
+        phases.append(phase)
+        phase, _ = runPhase('exportReport', server, workDir, config.structureReport, folder['fullPath'])
+        phases.append(phase)
+
+        importedStack = server.store.createStack('Benchmark Import', 'en-us')
+        importedStack = {'org': importedStack['org_uid'], 'uid': importedStack['api_key'], 'masterLocale': 'en-us'}
+        phase, _ = runPhase('importStructure', server, workDir, importStructure.importStack, importedStack, token, region, folderName)
+        phases.append(phase)
+        exportReport = importContent.readExportReport(folderName)
+        mappers = {name: {} for name in importContent.importJournals}
+        phase, assetMapper = runPhase('importAssets', server, workDir, importContent.importAssets, token, importedStack, folder['fullPath'], exportReport, True, region, mappers)
+        phases.append(phase)
+        languages = importContent.sortLanguages(contentInfo['languages'], 'en-us')
+        phase, _ = runPhase('importEntries', server, workDir, importContent.importEntries, contentInfo['contentTypes'], languages, folder['fullPath'], region, token, importedStack['uid'], assetMapper, mappers)
+        phases.append(phase)
+    finally:
+        if traceMemory:
+            tracemalloc.stop()
+        mockStack.stopServer(server)
+        for reportFolder in [f for f in config.exportReports if f.startswith(config.dataRootFolder)]:
+            config.closeExportReport(reportFolder)
+        config.dataRootFolder = oldRoot
+        if not keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+    return {
+        'createdAt': config.getTimestamp(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'faults': faults or {},
+        'settings': {key: getattr(config, key) for key in ('pageWorkers', 'entryExportWorkers', 'downloadWorkers', 'uploadWorkers', 'folderWorkers', 'structureImportWorkers', 'structureExportWorkers', 'compressEntries')},
+        'jsonBackend': jsonBackend.name,
+        'totalSeconds': round(sum(phase['seconds'] for phase in phases), 3),
+        'phases': phases
+    }
+
+def compareResults(result, baseline, tolerance=0.2, minSeconds=0.1):
+    '''
+    Phases that got slower (or use more requests) than in the baseline by more than the tolerance (0.2 = 20%)
+    Phases are not slower unless it is by at least minSeconds as well - Short phases are noisy
+    Returns a list of messages - empty when there is no regression
+    '''
+    regressions = []
+    previous = {phase['name']: phase for phase in baseline.get('phases', [])}
+    for phase in result['phases']:
+        old = previous.get(phase['name'])
+        if not old:
+            continue
+        for key in ('seconds', 'requests'):
+            if key == 'seconds' and phase[key] - old[key] < minSeconds:
+                continue
+            if old[key] and phase[key] > old[key] * (1 + tolerance):
+                regressions.append('{}: {} went from {} to {}'.format(phase['name'], key, old[key], phase[key]))
+    return regressions
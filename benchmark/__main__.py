@@ -0,0 +1,43 @@
+'''
+Running the benchmark from the command line:
+    python -m benchmark --entries 500 --assets 100 --latency 0.01 --output results.json
+    python -m benchmark --compare results.json (exits with 1 if a phase got slower than the tolerance)
+'''
+import sys
+import json
+import argparse
+import config
+import benchmark
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Export and import a synthetic stack against the mock Contentstack')
+    for key, value in benchmark.defaultScale.items():
+        parser.add_argument('--' + key, type=type(value), default=value)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds the mock API adds to every response')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='Mock API requests per second before 429 responses')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests the mock API answers with a 5xx error')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None, help='Folder for the export and import data (a temporary folder by default)')
+    parser.add_argument('--keep', action='store_true', help='Keep the export and import data')
+    parser.add_argument('--tracemalloc', action='store_true', help='Measure the peak of Python memory allocations as well (slower)')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', default=None, help='Results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    scale = {key: getattr(args, key) for key in benchmark.defaultScale}
+    faults = {'latency': args.latency, 'jitter': args.jitter, 'rateLimit': args.rate_limit, 'errorRate': args.error_rate, 'seed': args.seed}
+    baseline = config.readFromJsonFile(args.compare) if args.compare else None # Read first - it might be the output file as well
+    result = benchmark.runBenchmark(scale, faults, args.workdir, args.seed, args.keep, args.tracemalloc)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    config.logging.info('{}Benchmark finished in {} seconds. Results written to {}{}'.format(config.BOLD, result['totalSeconds'], args.output, config.END))
+    if baseline:
+        regressions = benchmark.compareResults(result, baseline, args.tolerance)
+        for regression in regressions:
+            config.logging.error('{}Regression: {}{}'.format(config.RED, regression, config.END))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Optional content-addressed store for asset files, shared across exports.
+Files are stored once under config.dataRootFolder + config.blobFolder, keyed by their sha256 checksum.
+Export folders get a hard link to the blob instead of a copy (symlink or copy if hard links are not possible).
+An index maps asset uid and _version to the checksum, so unchanged assets are not downloaded again.
+Enabled with config.useBlobStore.
+'''
+import os
+import shutil
+import hashlib
+import threading
+import config
+import jsonBackend
+
+indexFile = 'index.json'
+index = None # assetUid_vVersion -> checksum. Loaded on first use
+indexLock = threading.Lock()
+
+def blobRoot():
+    return config.dataRootFolder + config.blobFolder
+
+def blobPath(checksum):
+    '''
+    Blobs are spread in sub folders by the first two characters of the checksum
+    '''
+    return blobRoot() + checksum[:2] + '/' + checksum
+
+def indexKey(uid, version):
+    return '{}_v{}'.format(uid, version)
+
+def loadIndex():
+    global index
+    with indexLock:
+        if index is None:
+            index = {}
+            if os.path.isfile(blobRoot() + indexFile):
+                index = config.readFromJsonFile(blobRoot() + indexFile) or {}
+        return index
+
+def saveIndex():
+    '''
+    Writing the index to disk. Done once after the assets have been processed, not once per asset
+    '''
+    if index is None:
+        return False
+    config.checkDir(blobRoot())
+    with indexLock:
+        tmpPath = blobRoot() + indexFile + '.tmp'
+        jsonBackend.writeFile(index, tmpPath)
+        os.replace(tmpPath, blobRoot() + indexFile)
+    return True
+
+def fileChecksum(filePath):
+    sha = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(config.downloadChunkSize), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def linkBlob(checksum, filePath):
+    '''
+    Makes filePath reference the blob. Hard link, falling back to a symlink and lastly a copy
+    '''
+    source = blobPath(checksum)
+    if os.path.isfile(filePath):
+        os.remove(filePath)
+    try:
+        os.link(source, filePath)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(source), filePath)
+        except OSError:
+            shutil.copyfile(source, filePath)
+    return True
+
+def findAsset(uid, version):
+    '''
+    Returns the checksum of an asset version already in the store, or None
+    '''
+    checksum = loadIndex().get(indexKey(uid, version))
+    if checksum and os.path.isfile(blobPath(checksum)):
+        return checksum
+    return None
+
+def linkAsset(uid, version, filePath):
+    '''
+    Linking an already stored asset version into an export folder
+    Returns False if it is not in the store
+    '''
+    checksum = findAsset(uid, version)
+    if not checksum:
+        return False
+    linkBlob(checksum, filePath)
+    config.logging.info('Asset unchanged. Linked from blob store: {}'.format(filePath))
+    return True
+
+def storeAsset(uid, version, filePath):
+    '''
+    Moving a downloaded asset file into the store (if the same content is not there already)
+    and putting a link to it back in the export folder
+    '''
+    checksum = fileChecksum(filePath)
+    config.checkDir(blobRoot() + checksum[:2])
+    if os.path.isfile(blobPath(checksum)):
+        os.remove(filePath)
+    else:
+        os.replace(filePath, blobPath(checksum))
+    linkBlob(checksum, filePath)
+    loadIndex()
+    with indexLock:
+        index[indexKey(uid, version)] = checksum
+    return checksum
@@ -5,9 +5,10 @@ oskar.eiriksson@contentstack.com
 2020-09-28
 '''
 import os
-import requests
 import config
-from cma import iterateURL
+import httpClient
+import cma
+from cma import iteratePages, streamPages, typicalGetCount, getPage
 
 regionMap = {
     'US': 'https://cdn.contentstack.io/',
@@ -15,6 +16,8 @@ regionMap = {
     'EU': 'https://eu-cdn.contentstack.com/',
     'eu': 'https://eu-cdn.contentstack.com/'
 }
+if cma.regionUrl: # The mock Contentstack serves both APIs
+    regionMap = {key: cma.regionUrl for key in regionMap}
 
 def logUrl(url):
     config.logging.debug('-------')
@@ -38,28 +41,11 @@ def typicalGetIterate(url, apiKey, deliveryToken, dictKey):
     Re-usable function to GET objects that might have more than 100 items in it
     '''
     header = constructDeliveryTokenHeader(deliveryToken, apiKey)
-    result = []
-    skip = 0
-    count = 1 # Just making sure we check at least once. Setting the real count value in while loop
-    originalURL = url
-    while skip <= count:
-        url = iterateURL(originalURL, skip)
-        logUrl(url)
-        res = requests.get(url, headers=header)
-        if res.status_code in (200, 201):
-            count = res.json()['count'] # Setting the real value of count here
-            result = result + res.json()[dictKey]
-            skip += 100
-            config.logging.debug('Result as of now: {}'.format(result))
-        else:
-            config.logging.error('{red}All {key} Export: Failed getting {key}{end}'.format(red=config.RED, key=dictKey, end=config.END))
-            config.logging.error('{}URL: {}{}'.format(config.RED, url, config.END))
-            config.logging.error('{}HTTP Status Code: {}{}'.format(config.RED, res.status_code, config.END))
-            config.logging.error('{red}Error Message: {txt}{end}'.format(red=config.RED, txt=res.text, end=config.END))
-            return None
+    result = iteratePages(url, header, dictKey, logUrl)
     if result:
         return {dictKey: result}
-    config.logging.info('No {} results'.format(dictKey))
+    if result is not None:
+        config.logging.info('No {} results'.format(dictKey))
     return None
 
 def getAllEntries(stackInfo, contentType, language, environment, token):
@@ -70,6 +56,22 @@ def getAllEntries(stackInfo, contentType, language, environment, token):
     url = '{region}v3/content_types/{contentType}/entries?locale={language}&environment={environment}&include_workflow=true&include_publish_details=true&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language, environment=environment)
     return typicalGetIterate(url, stackInfo['apiKey'], token, 'entries')
 
+def streamAllEntries(stackInfo, contentType, language, environment, token, state):
+    '''
+    Generator version of getAllEntries - Yields the published entries one at a time, as the pages arrive.
+    state['failed'] is set if a page failed
+    '''
+    url = '{region}v3/content_types/{contentType}/entries?locale={language}&environment={environment}&include_workflow=true&include_publish_details=true&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language, environment=environment)
+    return streamPages(url, constructDeliveryTokenHeader(token, stackInfo['apiKey']), 'entries', state, logUrl)
+
+def getEntryCount(stackInfo, contentType, language, environment, token):
+    '''
+    Get the number of published entries on environment in a specific language
+    sample url: https://cdn.contentstack.io/v3/content_types/{content_type_uid}/entries?environment={environment_name}&locale={locale_code}&include_count=true&limit=1
+    '''
+    url = '{region}v3/content_types/{contentType}/entries?locale={language}&environment={environment}&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language, environment=environment)
+    return typicalGetCount(url, constructDeliveryTokenHeader(token, stackInfo['apiKey']), 'entries', logUrl)
+
 def getAllAssets(stackInfo, deliveryToken, environment):
     '''
     Get all assets published on environment
@@ -77,3 +79,41 @@ def getAllAssets(stackInfo, deliveryToken, environment):
     '''
     url = '{region}v3/assets?environment={environment}&relative_urls=false&include_dimension=true&include_count=true'.format(region=stackInfo['region'], environment=environment)
     return typicalGetIterate(url, stackInfo['apiKey'], deliveryToken, 'assets')
+
+def deliveryRegion(region):
+    '''
+    The Sync API is only on the delivery host. Finding the delivery URL from the management URL of the same region.
+    Any other URL (e.g. a local test server) is used as is.
+    '''
+    for key, value in cma.regionMap.items():
+        if value == region and key in regionMap:
+            return regionMap[key]
+    return region
+
+def sync(stackInfo, deliveryToken, state, environment=None, syncToken=None):
+    '''
+    Content Delivery Sync API. Generator yielding every item of the sync feed, page by page.
+    Without a syncToken it is an initial sync: Every published entry and asset on the environment.
+    With a syncToken from an earlier sync, only what has changed since then (published, unpublished and deleted items).
+    When the feed is finished, the sync token for the next run is put in state['syncToken']. state['failed'] is set if a page failed.
+    sample url: https://cdn.contentstack.io/v3/stacks/sync?init=true&environment={environment_name}
+    sample url: https://cdn.contentstack.io/v3/stacks/sync?sync_token={sync_token}
+    '''
+    region = deliveryRegion(stackInfo['region'])
+    header = constructDeliveryTokenHeader(deliveryToken, stackInfo['apiKey'])
+    if syncToken:
+        url = '{region}v3/stacks/sync?sync_token={token}'.format(region=region, token=syncToken)
+    else:
+        url = '{region}v3/stacks/sync?init=true&environment={environment}'.format(region=region, environment=environment)
+    while url:
+        page = getPage(url, header, 'items', logUrl)
+        if not page: # Failed, or the Sync API is not part of the plan
+            state['failed'] = True
+            return
+        for item in page.get('items', []):
+            yield item
+        if page.get('pagination_token'):
+            url = '{region}v3/stacks/sync?pagination_token={token}'.format(region=region, token=page['pagination_token'])
+        else:
+            state['syncToken'] = page.get('sync_token')
+            url = None
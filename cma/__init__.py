@@ -5,9 +5,13 @@ oskar.eiriksson@contentstack.com
 2020-09-28
 '''
 import os
-from time import sleep
-import requests
+import json
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 import config
+import httpClient
+import jsonBackend
 
 regionMap = {
     'US': 'https://api.contentstack.io/',
@@ -15,6 +19,9 @@ regionMap = {
     'EU': 'https://eu-api.contentstack.com/',
     'eu': 'https://eu-api.contentstack.com/'
 }
+regionUrl = os.environ.get('CS_REGION_URL') # Points every region at this base URL instead, e.g. a local mock Contentstack (python -m mockStack)
+if regionUrl:
+    regionMap = {key: regionUrl for key in regionMap}
 
 def login(username, password, mfa, region):
     url = '{region}v3/user-session'.format(region=region)
@@ -26,9 +33,10 @@ def login(username, password, mfa, region):
         }
     if mfa:
         body['user']['tfa_token'] = mfa
-    res = requests.post(url, json=body)
-    config.logging.debug(res.json())
-    return res.status_code, res.json()
+    res = httpClient.post(url, json=body)
+    body = jsonBackend.decodeResponse(res)
+    config.logging.debug(body)
+    return res.status_code, body
 
 def constructAuthTokenHeader(token, apiKey=None):
     '''
@@ -59,9 +67,9 @@ def getUserInfo(authToken, region):
     url = '{}v3/user'.format(region)
     logUrl(url)
     header = constructAuthTokenHeader(authToken)
-    res = requests.get(url, headers=header)
+    res = httpClient.get(url, headers=header)
     if res.status_code in (200, 201):
-        return res.json()
+        return jsonBackend.decodeResponse(res)
     config.logging.error('{}Unable to get user info. Eror Message: {}{}'.format(config.RED, res.text, config.END))
     return None
 
@@ -72,81 +80,132 @@ def logError(endpointName, name, url, res):
     config.logging.error('{red}Error Message: {txt}{end}'.format(red=config.RED, txt=res.text, end=config.END))
     return None
 
+pageSize = 100 # Default (and maximum) number of items Contentstack returns per page
+
 def iterateURL(url, skip=0):
     return url + '&skip={}'.format(skip)
 
-def typicalGetSimple(url, apiKey, authToken, environment=None):
+def typicalGetSimple(url, apiKey, authToken, environment=None, state=None):
     '''
     Re-usable function to GET objects that never include more than 100 items
+    state['failed'] is set if the request failed (Not when the endpoint is not part of the plan)
     '''
     header = constructAuthTokenHeader(authToken, apiKey)
     if environment:
         url = url + '&environment={}'.format(environment)
     logUrl(url)
-    res = requests.get(url, headers=header)
+    res = httpClient.get(url, headers=header)
     if res.status_code in (200, 201):
-        config.logging.debug('Result: {}'.format(res.json()))
-        return res.json()
+        body = jsonBackend.decodeResponse(res)
+        config.logging.debug('Result: %s', body) # Only formatted when debug logging is on
+        return body
     if res.status_code == 412:
         config.logging.info('{yellow}412 reponse from Contentstack. Possibly not part of your plan. (URL: {url}){end}'.format(yellow=config.YELLOW, url=url, end=config.END))
         return None
+    if state is not None:
+        state['failed'] = True
     config.logging.error('{red}Export failed.{end}'.format(red=config.RED, end=config.END))
     config.logging.error('{}URL: {}{}'.format(config.RED, url, config.END))
     config.logging.error('{}HTTP Status Code: {}{}'.format(config.RED, res.status_code, config.END))
     config.logging.error('{red}Error Message: {txt}{end}'.format(red=config.RED, txt=res.text, end=config.END))
     return None
 
-def typicalGetIterate(url, apiKey, authToken, dictKey, environment=None):
+def getPage(url, header, dictKey, log=logUrl):
+    '''
+    GETs a single page of a listing. The response body is only parsed once.
+    Returns the parsed body, an empty one if the endpoint is not part of the plan (412), or None when it failed (failure is logged here)
+    '''
+    log(url)
+    res = httpClient.get(url, headers=header)
+    if res.status_code in (200, 201):
+        body = jsonBackend.decodeResponse(res)
+        config.logging.debug('%sResponse Now: %s %s', config.YELLOW, body, config.END)
+        return body
+    if res.status_code == 412:
+        config.logging.info('{yellow}412 reponse from Contentstack. Possibly not part of your plan. (URL: {url}){end}'.format(yellow=config.YELLOW, url=url, end=config.END))
+        return {} # Nothing to get - Not a failure
+    config.logging.error('{red}All {key} Export: Failed getting {key}{end}'.format(red=config.RED, key=dictKey, end=config.END))
+    config.logging.error('{}URL: {}{}'.format(config.RED, url, config.END))
+    config.logging.error('{}HTTP Status Code: {}{}'.format(config.RED, res.status_code, config.END))
+    config.logging.error('{red}Error Message: {txt}{end}'.format(red=config.RED, txt=res.text, end=config.END))
+    return None
+
+def streamPages(url, header, dictKey, state, log=logUrl):
+    '''
+    Generator yielding every item of a listing, page by page and in order.
+    The first page gives us the count, so the rest of the page offsets are known.
+    Those are fetched concurrently on a bounded pool, but never more than config.pageWorkers pages ahead of what has been yielded,
+    so only a few pages are in memory at a time. state['failed'] is set if a page failed (the items stop there).
+    '''
+    firstPage = getPage(iterateURL(url, 0), header, dictKey, log)
+    if firstPage is None:
+        state['failed'] = True
+        return
+    count = firstPage.get('count', 0) # Did get a KeyError once... when there was nothing there.
+    yield from firstPage.get(dictKey, [])
+    del firstPage
+    skips = iter(range(pageSize, count, pageSize))
+    executor = ThreadPoolExecutor(max_workers=config.pageWorkers)
+    try:
+        futures = deque(executor.submit(getPage, iterateURL(url, skip), header, dictKey, log) for skip in islice(skips, config.pageWorkers))
+        while futures:
+            page = futures.popleft().result()
+            if page is None:
+                state['failed'] = True
+                return
+            skip = next(skips, None)
+            if skip is not None:
+                futures.append(executor.submit(getPage, iterateURL(url, skip), header, dictKey, log))
+            yield from page.get(dictKey, [])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def iteratePages(url, header, dictKey, log=logUrl):
+    '''
+    Fetches every page of a listing and returns all the items in one list (None if any page failed).
+    '''
+    state = {}
+    result = list(streamPages(url, header, dictKey, state, log))
+    if state.get('failed'):
+        return None
+    config.logging.debug('%sResult as of Now: %s %s', config.YELLOW, result, config.END)
+    return result
+
+def typicalGetIterate(url, apiKey, authToken, dictKey, environment=None, state=None):
     '''
     Re-usable function to GET objects that might have more than 100 items in it
+    Returns None both when there are no items and when it failed - state['failed'] is set if it failed
     '''
     header = constructAuthTokenHeader(authToken, apiKey)
-    result = []
-    skip = 0
-    count = 1 # Just making sure we check at least once. Setting the real count value in while loop
     if environment:
         url = url + '&environment={}'.format(environment)
-    originalURL = url
-    while skip <= count:
-        url = iterateURL(originalURL, skip)
-        logUrl(url)
-        res = requests.get(url, headers=header)
-        if res.status_code in (200, 201):
-            if 'count' in res.json(): # Did get a KeyError once... when there was nothing there.
-                count = res.json()['count'] # Setting the real value of count here
-            else:
-                count = 0
-            config.logging.debug('{}Response Now: {} {}'.format(config.YELLOW, res.json(), config.END))
-            result = result + res.json()[dictKey]
-            config.logging.debug('{}Result as of Now: {} {}'.format(config.YELLOW, result, config.END))
-            skip += 100
-        elif res.status_code == 412:
-            config.logging.info('{yellow}412 reponse from Contentstack. Possibly not part of your plan. (URL: {url}){end}'.format(yellow=config.YELLOW, url=url, end=config.END))
-            return None
-        else:
-            config.logging.error('{red}All {key} Export: Failed getting {key}{end}'.format(red=config.RED, key=dictKey, end=config.END))
-            config.logging.error('{}URL: {}{}'.format(config.RED, url, config.END))
-            config.logging.error('{}HTTP Status Code: {}{}'.format(config.RED, res.status_code, config.END))
-            config.logging.error('{red}Error Message: {txt}{end}'.format(red=config.RED, txt=res.text, end=config.END))
-            return None
+    result = iteratePages(url, header, dictKey)
     if result:
         return {dictKey: result}
-    config.logging.info('No {} results'.format(dictKey))
+    if result is not None:
+        config.logging.info('No {} results'.format(dictKey))
+    elif state is not None:
+        state['failed'] = True
     return None
 
-def typicalCreate(apiKey, authToken, body, url, endpointName='', retry=False):
+def typicalGetCount(url, header, dictKey, log=logUrl):
+    '''
+    Cheap count probe for a listing - Only asks for a single item and the count
+    '''
+    page = getPage(url + '&limit=1', header, dictKey, log)
+    if page is None:
+        return None
+    return page.get('count', 0)
+
+def typicalCreate(apiKey, authToken, body, url, endpointName=''):
     '''
     Combining identical POST methods into one
     '''
     logUrl(url)
     header = constructAuthTokenHeader(authToken, apiKey)
-    res = requests.post(url, headers=header, json=body)
+    res = httpClient.post(url, headers=header, json=body)
     if res.status_code in (200, 201):
-        return res.json()
-    elif (res.status_code == 429) and not retry:
-        config.logging.warning('{}We are getting rate limited. Retrying in 2 seconds.{}'.format(config.YELLOW, config.END))
-        sleep(2) # We'll retry once in a second if we're getting rate limited.
-        return typicalCreate(apiKey, authToken, body, url, endpointName, True)
+        return jsonBackend.decodeResponse(res)
     if 'name' in body[endpointName]:
         name = body[endpointName]['name']
     elif 'title' in body[endpointName]:
@@ -155,53 +214,80 @@ def typicalCreate(apiKey, authToken, body, url, endpointName='', retry=False):
         name = 'noName'
     return logError(endpointName, name, url, res)
 
-def typicalUpdate(apiKey, authToken, body, url, endpointName='', retry=False):
+def typicalUpdate(apiKey, authToken, body, url, endpointName=''):
     '''
     Combining identical PUT methods into one
     '''
     logUrl(url)
     header = constructAuthTokenHeader(authToken, apiKey)
-    res = requests.put(url, headers=header, json=body)
+    res = httpClient.put(url, headers=header, json=body)
     if res.status_code in (200, 201):
-        return res.json()
-    elif (res.status_code == 429) and not retry:
-        config.logging.warning('{}We are getting rate limited. Retrying in 2 seconds.{}'.format(config.YELLOW, config.END))
-        sleep(2) # We'll retry once in a second if we're getting rate limited.
-        return typicalUpdate(apiKey, authToken, body, url, endpointName, True)
+        return jsonBackend.decodeResponse(res)
     config.logging.error('{}Failed updating {} - {}{}'.format(config.RED, endpointName, str(res.text), config.END))
     return logError(endpointName, '', url, res) # Empty string was name variable
 
-def typicalDelete(apiKey, authToken, url, endpointName='', retry=False):
+def typicalDelete(apiKey, authToken, url, endpointName=''):
     '''
     Combining identical DELETE methods into one
     '''
     logUrl(url)
     header = constructAuthTokenHeader(authToken, apiKey)
-    res = requests.delete(url, headers=header)
+    res = httpClient.delete(url, headers=header)
     if res.status_code in (200, 201):
-        return res.json()
-    elif (res.status_code == 429) and not retry:
-        config.logging.warning('{}We are getting rate limited. Retrying in 2 seconds.{}'.format(config.YELLOW, config.END))
-        sleep(2) # We'll retry once in a second if we're getting rate limited.
-        return typicalDelete(apiKey, authToken, url, endpointName, True)
+        return jsonBackend.decodeResponse(res)
     config.logging.error('{}Failed deleting {} - {}{}'.format(config.RED, endpointName, str(res.text), config.END))
     return logError(endpointName, '', url, res) # Empty string was name variable
 
-def getAllContentTypes(apiKey, token, region):
+def getAllContentTypes(apiKey, token, region, state=None):
     '''
     Gets all content types, includes the count of content types and global field schema
     sample url: https://api.contentstack.io/v3/content_types?include_count={boolean_value}&include_global_field_schema={boolean_value}
     '''
     url = '{region}v3/content_types?include_count=true&include_global_field_schema=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'content_types')
+    return typicalGetIterate(url, apiKey, token, 'content_types', state=state)
 
-def getAllEntries(stackInfo, contentType, language, token, environment=None):
+def getAllEntries(stackInfo, contentType, language, token, environment=None, query=None, state=None):
     '''
     Get All Entries (Content Management API).
     sample url: https://api.contentstack.io/v3/content_types/{content_type_uid}/entries?locale={language_code}&include_workflow=true&include_publish_details=true&include_count=true
+    Optional query, e.g. {"updated_at": {"$gt": "2020-10-05T00:40:25.511Z"}} for entries changed since a previous export
+    None if there are no entries - state['failed'] is set if it failed
     '''
     url = '{region}v3/content_types/{contentType}/entries?locale={language}&include_workflow=true&include_publish_details=true&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language)
-    return typicalGetIterate(url, stackInfo['apiKey'], token, 'entries', environment)
+    if query:
+        url = url + '&query={}'.format(json.dumps(query))
+    return typicalGetIterate(url, stackInfo['apiKey'], token, 'entries', environment, state)
+
+def streamAllEntries(stackInfo, contentType, language, token, state, environment=None, query=None):
+    '''
+    Generator version of getAllEntries - Yields the entries one at a time, as the pages arrive (see streamPages).
+    state['failed'] is set if a page failed
+    '''
+    url = '{region}v3/content_types/{contentType}/entries?locale={language}&include_workflow=true&include_publish_details=true&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language)
+    if query:
+        url = url + '&query={}'.format(json.dumps(query))
+    if environment:
+        url = url + '&environment={}'.format(environment)
+    return streamPages(url, constructAuthTokenHeader(token, stackInfo['apiKey']), 'entries', state)
+
+def getEntryUids(stackInfo, contentType, language, token, environment=None, state=None):
+    '''
+    Cheap listing of All Entries - Only the uid and locale of each entry (Content Management API).
+    Used to find deleted entries in incremental exports.
+    sample url: https://api.contentstack.io/v3/content_types/{content_type_uid}/entries?locale={language_code}&only[BASE][]=uid&only[BASE][]=locale&include_count=true
+    '''
+    url = '{region}v3/content_types/{contentType}/entries?locale={language}&only[BASE][]=uid&only[BASE][]=locale&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language)
+    return typicalGetIterate(url, stackInfo['apiKey'], token, 'entries', environment, state)
+
+def getEntryCount(stackInfo, contentType, language, token, environment=None):
+    '''
+    Get the number of entries of a content type in a language (Content Management API).
+    sample url: https://api.contentstack.io/v3/content_types/{content_type_uid}/entries?locale={language_code}&include_count=true&limit=1
+    '''
+    url = '{region}v3/content_types/{contentType}/entries?locale={language}&include_count=true'.format(region=stackInfo['region'], contentType=contentType, language=language)
+    if environment:
+        url = url + '&environment={}'.format(environment)
+    return typicalGetCount(url, constructAuthTokenHeader(token, stackInfo['apiKey']), 'entries')
 
 def getSingleEntry(stackInfo, contentType, language, token, uid, environment=None):
     '''
@@ -221,24 +307,37 @@ def getEntryLocales(stackInfo, contentType, uid, token):
     # Returns: {'locales': [{'code': 'nl-nl'}, {'code': 'nl-be'}, {'code': 'mr-in'}, {'code': 'en-si'}, {'code': 'en-ch'}, {'code': 'ar-iq'}, {'code': 'ar'}, {'code': 'af-za'}, {'code': 'ms-sg'}, {'code': 'is-is', 'localized': True}, {'code': 'en-us'}]}
     return typicalGetSimple(url, stackInfo['apiKey'], token)
 
-def getAllAssets(stackInfo, token, environment):
+def getAllAssets(stackInfo, token, environment, query=None, state=None):
     '''
     Get All Assets (Content Management API)
     sample url: https://api.contentstack.io/v3/assets?include_folders=true&include_publish_details=true&include_count=true&relative_urls=false&environment={environment}&query={"is_dir": False}
+    Optional query is added to the is_dir query, e.g. {"updated_at": {"$gt": "2020-10-05T00:40:25.511Z"}}
+    None if there are no assets - state['failed'] is set if it failed
     '''
-    url = '{region}v3/assets?include_folders=true&include_publish_details=true&include_count=true&relative_urls=false&query={{"is_dir": false}}'.format(region=stackInfo['region'])
-    return typicalGetIterate(url, stackInfo['apiKey'], token, 'assets', environment)
+    assetQuery = {'is_dir': False}
+    if query:
+        assetQuery.update(query)
+    url = '{region}v3/assets?include_folders=true&include_publish_details=true&include_count=true&relative_urls=false&query={query}'.format(region=stackInfo['region'], query=json.dumps(assetQuery))
+    return typicalGetIterate(url, stackInfo['apiKey'], token, 'assets', environment, state)
 
+def getAssetUids(stackInfo, token, environment, state=None):
+    '''
+    Cheap listing of All Assets - Only the uid of each asset (Content Management API)
+    sample url: https://api.contentstack.io/v3/assets?only[BASE][]=uid&include_count=true&query={"is_dir": false}
+    None if there are no assets - state['failed'] is set if it failed
+    '''
+    url = '{region}v3/assets?only[BASE][]=uid&include_count=true&query={{"is_dir": false}}'.format(region=stackInfo['region'])
+    return typicalGetIterate(url, stackInfo['apiKey'], token, 'assets', environment, state)
 
-def getAllFolders(stackInfo, token):
+def getAllFolders(stackInfo, token, state=None):
     '''
     Get all Folders
     sample url: https://api.contentstack.io/v3/assets?query={"is_dir": true}&include_count=true
     '''
     url = '{}v3/assets?query={{"is_dir": true}}&include_count=true'.format(stackInfo['region'])
-    return typicalGetIterate(url, stackInfo['apiKey'], token, 'assets') #(url, apiKey, authToken, dictKey, environment=None):
+    return typicalGetIterate(url, stackInfo['apiKey'], token, 'assets', state=state) #(url, apiKey, authToken, dictKey, environment=None):
 
-def getAllGlobalFields(apiKey, token, region):
+def getAllGlobalFields(apiKey, token, region, state=None):
     '''
     Gets all Global Fields
     sample url: https://api.contentstack.io/v3/global_fields
@@ -246,27 +345,27 @@ def getAllGlobalFields(apiKey, token, region):
     Limitation: This has not been tested on stack with over 100 global fields.
     '''
     url = '{}v3/global_fields?include_count=true'.format(region)
-    return typicalGetIterate(url, apiKey, token, 'global_fields') #(url, apiKey, authToken, dictKey, environment=None):
+    return typicalGetIterate(url, apiKey, token, 'global_fields', state=state) #(url, apiKey, authToken, dictKey, environment=None):
 
-def getAllExtensions(apiKey, token, region):
+def getAllExtensions(apiKey, token, region, state=None):
     '''
     Gets all extensions
     sample url: https://api.contentstack.io/v3/extensions
     '''
     url = '{region}v3/extensions?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'extensions')
+    return typicalGetIterate(url, apiKey, token, 'extensions', state=state)
 
-def getAllWorkflows(apiKey, token, region):
+def getAllWorkflows(apiKey, token, region, state=None):
     '''
     Gets all workflows
     sample url: https://api.contentstack.io/v3/workflows/
     Limitation: Using simple get without iteration because it sometimes fails using the iterate one where there are no workflows. I do not know why.
     '''
     url = '{region}v3/workflows?include_count=true'.format(region=region)
-    return typicalGetSimple(url, apiKey, token)
+    return typicalGetSimple(url, apiKey, token, state=state)
     # return typicalGetIterate(url, apiKey, token, 'workflows')
 
-def getAllPublishingRules(contentTypeUids, apiKey, token, region):
+def getAllPublishingRules(contentTypeUids, apiKey, token, region, state=None):
     '''
     Gets all publishing rules
     sample url: https://api.contentstack.io/v3/workflows/publishing_rules?content_types=[{content_type_uid}]&limit={rule_limit}&include_count={boolean_value}
@@ -276,9 +375,9 @@ def getAllPublishingRules(contentTypeUids, apiKey, token, region):
     '''
     uids = ','.join(map(str, contentTypeUids))
     url = '{region}v3/workflows/publishing_rules?{uids}&include_count=true'.format(region=region, uids=uids)
-    return typicalGetIterate(url, apiKey, token, 'publishing_rules')
+    return typicalGetIterate(url, apiKey, token, 'publishing_rules', state=state)
 
-def getAllLabels(apiKey, token, region):
+def getAllLabels(apiKey, token, region, state=None):
     '''
     Gets all labels
     sample url: https://api.contentstack.io/v3/labels?include_count={boolean_value}
@@ -286,48 +385,48 @@ def getAllLabels(apiKey, token, region):
     Limitation: This has not been tested on stack with over 100 labels
     '''
     url = '{region}v3/labels?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'labels')
+    return typicalGetIterate(url, apiKey, token, 'labels', state=state)
 
-def getAllLanguages(apiKey, token, region):
+def getAllLanguages(apiKey, token, region, state=None):
     '''
     Gets all languages
     sample url: https://api.contentstack.io/v3/locales?include_count={boolean_value}
     '''
     url = '{region}v3/locales?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'locales')
+    return typicalGetIterate(url, apiKey, token, 'locales', state=state)
 
-def getAllEnvironments(apiKey, token, region):
+def getAllEnvironments(apiKey, token, region, state=None):
     '''
     Gets all environments
     sample url: https://api.contentstack.io/v3/environments?include_count={boolean_value}&asc={field_uid}&desc={field_uid}
     '''
     url = '{region}v3/environments?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'environments')
+    return typicalGetIterate(url, apiKey, token, 'environments', state=state)
 
-def getAllDeliveryTokens(apiKey, token, region):
+def getAllDeliveryTokens(apiKey, token, region, state=None):
     '''
     Gets all delivery tokens
     sample url: https://api.contentstack.io/v3/stacks/delivery_tokens
     Needs auth token instead of management token
     '''
     url = '{region}v3/stacks/delivery_tokens?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'tokens')
+    return typicalGetIterate(url, apiKey, token, 'tokens', state=state)
 
-def getAllRoles(apiKey, token, region):
+def getAllRoles(apiKey, token, region, state=None):
     '''
     Gets all roles
     sample url: https://api.contentstack.io/v3/roles?include_permissions={boolean_value}&include_rules={boolean_value}
     '''
     url = '{region}v3/roles?include_permissions=true&include_rules=true&include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'roles')
+    return typicalGetIterate(url, apiKey, token, 'roles', state=state)
 
-def getAllWebhooks(apiKey, token, region):
+def getAllWebhooks(apiKey, token, region, state=None):
     '''
     Gets all webhooks
     sample url: https://api.contentstack.io/v3/webhooks
     '''
     url = '{region}v3/webhooks?include_count=true'.format(region=region)
-    return typicalGetIterate(url, apiKey, token, 'webhooks')
+    return typicalGetIterate(url, apiKey, token, 'webhooks', state=state)
 
 def getAllStacks(header, orgUid, region):
     '''
@@ -336,9 +435,10 @@ def getAllStacks(header, orgUid, region):
     '''
     header['organization_uid'] = orgUid
     url = '{}v3/stacks'.format(region)
-    res = requests.get(url, headers=header)
-    config.logging.debug(res.json())
-    return res.json()
+    res = httpClient.get(url, headers=header)
+    stacks = jsonBackend.decodeResponse(res)
+    config.logging.debug(stacks)
+    return stacks
 
 def createStack(token, orgUid, region, body):
     '''
@@ -351,12 +451,13 @@ def createStack(token, orgUid, region, body):
         'Content-Type': 'application/json'
     }
     url = '{}v3/stacks'.format(region)
-    res = requests.post(url, headers=header, json=body)
+    res = httpClient.post(url, headers=header, json=body)
     if res.status_code in (200, 201):
-        url = '{}#!/stack/{}/dashboard'.format(region.replace('-api.','-app.'), res.json()['stack']['api_key']) ### Direct LINK to it on this format: https://eu-app.contentstack.com/#!/stack/blt95fffae23f35168a/dashboard
+        stack = jsonBackend.decodeResponse(res)
+        url = '{}#!/stack/{}/dashboard'.format(region.replace('-api.','-app.'), stack['stack']['api_key']) ### Direct LINK to it on this format: https://eu-app.contentstack.com/#!/stack/blt95fffae23f35168a/dashboard
         config.logging.info('Stack (Name: {}) successfully created'.format(body['stack']['name']))
         config.logging.info('{}Direct Link to Stack: {}{}'.format(config.GREEN, url, config.END))
-        return res.json()
+        return stack
     config.logging.error('{}Error creating stack.{}'.format(config.RED, config.END))
     config.logging.error('{}HTTP Status: {}{}'.format(config.RED, res.status_code, config.END))
     config.logging.error('{}Error Message: {}{}'.format(config.RED, res.text, config.END))
@@ -505,31 +606,31 @@ def createFolder(apiKey, token, region, folderName, parentFolder=None):
         body['asset']['parent_uid'] = parentFolder
     return typicalCreate(apiKey, token, body, url, 'asset')
 
-def createAsset(region, authToken, apiKey, filePath, metaData, filename):
+def createAsset(region, authToken, apiKey, filePath, metaData, filename, length=None):
     '''
     Upload Image/Asset
     sample url: https://cdn.contentstack.io/v3/assets?relative_urls=false
+    filePath is the path to the asset file, or a readable stream (e.g. a download) - then the length (bytes) is needed
+    The multipart body is streamed, the file is never read into memory.
     '''
     url = '{}v3/assets?relative_urls=false'.format(region)
     contentTypeMeta = metaData['asset']['content_type']
     header = constructAuthTokenHeader(authToken, apiKey)
-    del header['Content-Type']
-    with open(filePath, 'rb') as f:
-        fileData = f.read()
-    files = {"asset[upload]": (filename, fileData, contentTypeMeta)}
-    payload = {}
-    if 'parent_uid' in metaData['asset']:
-        payload["asset[parent_uid]"] = (metaData['asset']['parent_uid'])
-    if 'description' in metaData['asset']:
-        payload["asset[description]"] = (metaData['asset']['description'])
-    if 'title' in metaData['asset']:
-        payload["asset[title]"] = (metaData['asset']['title'])
-    if 'tags' in metaData['asset']:
-        payload["asset[tags]"] = (metaData['asset']['tags'])
-    res = requests.post(url, files=files, data=payload, headers=header)
+    fields = []
+    for key in ['parent_uid', 'description', 'title', 'tags']:
+        if key in metaData['asset']:
+            values = metaData['asset'][key]
+            for value in (values if isinstance(values, list) else [values]):
+                fields.append(('asset[{}]'.format(key), value))
+    body = httpClient.MultipartBody(fields, 'asset[upload]', filename, contentTypeMeta, filePath, length)
+    header['Content-Type'] = body.contentType
+    try:
+        res = httpClient.post(url, data=body, headers=header)
+    finally:
+        body.close()
     if res.status_code in (200, 201):
         config.logging.info('Asset Uploaded. ({})'.format(filename))
-        return res.json()
+        return jsonBackend.decodeResponse(res)
     return logError('asset', filename, url, res)
 
 def createEntry(apiKey, token, body, region, contentType, language):
@@ -5,13 +5,17 @@ oskar.eiriksson@contentstack.com
 Various config functions and variables user in both export and import scripts
 '''
 import os
+import shutil
+import atexit
+import threading
 from time import sleep
-from datetime import datetime
-import json
+from datetime import datetime, timezone
 import logging
 import inquirer
-import requests
 import cma
+import httpClient
+import entryStore
+import jsonBackend
 
 def readDirIfExists(folder):
     '''
@@ -27,7 +31,7 @@ def checkDir(folder):
     '''
     if not os.path.exists(folder):
         logging.info('Creating folder: ' + folder)
-        os.makedirs(folder)
+        os.makedirs(folder, exist_ok=True) # Export workers can create the same folder at the same time
         return True
     return False
 
@@ -35,6 +39,12 @@ def getTime():
     now = datetime.now()
     return now.strftime("%d-%m-%Y-%H-%M-%S")
 
+def getTimestamp():
+    '''
+    UTC timestamp on the same format as Contentstack's created_at/updated_at, e.g. 2020-10-05T00:40:25.511Z
+    '''
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 
@@ -42,9 +52,36 @@ disableWebhooks = True # All enabled webhooks are disabled on import if TRUE. Mi
 dataRootFolder = 'data/' # Relative path to the export root folder - Remember the slash at the end if you change this.
 stackRootFolder = 'stacks/' # Relative path under the dataRootFolder for stack exports
 mapperFolder = 'importJobs_UidMappers/' # The folder where mappers-jobs folders are stored - under the stackRootFolder
+useBlobStore = False # If TRUE, asset files are stored once by checksum and linked into the export folders. Unchanged assets are not downloaded again
+blobFolder = 'blobs/' # Relative path under the dataRootFolder for the shared asset blob store
 # exportLoginFile = 'exportLogin.json' # Placed in the project root folder
 authTokenFile = 'authtoken.json'
 exportReportFile = 'report.json' # Placed in the stack export root folder
+ledgerFsync = False # If TRUE, the export ledger is synced to disk on every write. Survives power loss, but slower
+journalFsync = False # If TRUE, import mapper journals are synced to disk on every write. Survives power loss, but slower
+httpPoolConnections = 10 # Number of hosts each pooled HTTP session keeps connection pools for
+httpPoolSize = 20 # Maximum keep-alive connections per host. Should not be lower than the number of concurrent workers
+rateLimits = { # Requests per second per host (documented Contentstack rate limits). Hosts not listed, e.g. asset files, are not throttled
+    'api.contentstack.io': 10,
+    'eu-api.contentstack.com': 10,
+    'cdn.contentstack.io': 100,
+    'eu-cdn.contentstack.com': 100
+}
+minRateLimit = 0.5 # The rate never adapts below this (requests per second)
+maxRetries = 5 # Retries on 429 (rate limited), temporary server errors and dropped connections
+backoffBase = 1 # Seconds. Doubled on every retry (with jitter)
+backoffMax = 30 # Seconds. Upper limit of a single backoff
+pageWorkers = 4 # Number of pages of a single listing (e.g. entries of a content type) fetched concurrently
+entryExportWorkers = 4 # Number of (content type, language) entry exports running concurrently
+downloadWorkers = 8 # Number of asset files downloaded concurrently
+uploadWorkers = 4 # Number of assets uploaded concurrently on import. Uploads share the rate limit of the host
+folderWorkers = 4 # Number of asset folders created concurrently on import (folders of the same depth)
+structureImportWorkers = 4 # Number of structure modules (and items within a module) imported concurrently - Dependent ones wait for each other
+structureExportWorkers = 4 # Number of structure modules (content types, roles, labels...) exported concurrently
+pipeAssetUploads = True # If TRUE, asset files not in the export are piped from the export stack straight into the upload (no tmp file)
+downloadChunkSize = 1024 * 1024 # Asset files are streamed to disk in chunks of this many bytes
+compressEntries = False # If TRUE, exported entry files are gzip compressed (<language>.ndjson.gz). Slower, but a fraction of the disk space
+probeEntryCounts = True # Probe entry counts before the entry export to start with the largest content type/language first
 logLevel = logging.INFO # Possible levels e.g.: DEBUG, ERROR, INFO
 logFolder = 'log/'
 logFile = getTime()
@@ -113,7 +150,8 @@ fileNames = {
     'workflows': 'workflows.json',
     'entries': 'entries.json',
     'assets': 'assets.json',
-    'folders': 'folders.json'
+    'folders': 'folders.json',
+    'entryLocalizations': 'entry_localizations.json'
 }
 
 # Text formatting for terminal logs.
@@ -160,18 +198,35 @@ def defineFullFilePath(folder, key):
 def writeToJsonFile(payload, filePath, overwrite=False):
     '''
     Takes dictionary and writes to .json file in the relevant folder
+    Written to a temporary .part file first that replaces the file in one go, so readers never see a half written file.
+    Replacing also means a file hard linked from a previous export is never changed in place
     '''
     if os.path.isfile(filePath) and not overwrite: # Not writing over file
         logging.info('File exists. Not overwriting ({})'.format(filePath))
         return False
+    partPath = filePath + '.part'
     try:
-        with open(filePath, 'w') as fp:
-            json.dump(payload, fp)
+        with open(partPath, 'wb') as fp:
+            fp.write(jsonBackend.dumps(payload))
+        os.replace(partPath, filePath)
         return True
     except Exception as e:
         logging.critical('{}Failed writing dictionary to file: {} - Error Message: {}{}'.format(RED, filePath, e, END))
+        if os.path.isfile(partPath):
+            os.remove(partPath)
         return False
 
+def writeJsonFiles(files, overwrite=True):
+    '''
+    Batched write of JSON files built in memory, e.g. all the metadata files of an asset: {filePath: payload}
+    Every file is written once, atomically (see writeToJsonFile). Returns the number of files written
+    '''
+    written = 0
+    for filePath, payload in files.items():
+        if writeToJsonFile(payload, filePath, overwrite):
+            written += 1
+    return written
+
 def addToJsonFile(payload, filePath):
     '''
     Adding to JSON file
@@ -180,49 +235,171 @@ def addToJsonFile(payload, filePath):
     '''
     if not os.path.isfile(filePath): # If file does not exist, we just create it.
         return writeToJsonFile(payload, filePath)
-    try: # If it exists, we update it
-        with open(filePath, "r+") as file:
-            data = json.load(file)
-            data.update(payload)
-            file.seek(0)
-            json.dump(data, file)
-        return True
+    try: # If it exists, we update it - and replace it, so a shorter payload does not leave the end of the old one behind
+        data = jsonBackend.readFile(filePath)
+        data.update(payload)
+        return writeToJsonFile(data, filePath, True)
     except Exception as e:
         logging.error('{}Unable to update {}{}'.format(RED, filePath, END))
         logging.error('{}Error: {}{}'.format(RED, e, END))
         return False
 
+class ExportReport:
+    '''
+    The export report (report.json) of an export folder, kept in memory while exporting.
+    Loaded from disk on first use (resumed exports), changed in memory and written in one go (atomically) when flushed:
+    At phase boundaries (flushExportReport) and when the application exits.
+    '''
+    def __init__(self, folder):
+        self.filePath = folder + exportReportFile
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.isfile(self.filePath):
+            self.data = readFromJsonFile(self.filePath) or {}
+        self.changed = False
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.changed = True
+
+    def setOnce(self, key, value):
+        with self.lock:
+            if key in self.data:
+                return False
+            self.data[key] = value
+            self.changed = True
+            return True
+
+    def setIn(self, keys, value):
+        '''
+        Setting a value in nested dictionaries, e.g. (['exportCounts', 'entries', contentType, language], 100)
+        '''
+        with self.lock:
+            node = self.data
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = value
+            self.changed = True
+
+    def addTiming(self, name, seconds):
+        with self.lock:
+            self.data.setdefault('timings', {})[name] = round(seconds, 3)
+            self.changed = True
+
+    def flush(self):
+        with self.lock:
+            if not self.changed:
+                return True
+            if not writeToJsonFile(self.data, self.filePath, True):
+                return False
+            self.changed = False
+            return True
+
+exportReports = {} # export folder -> ExportReport
+exportReportLock = threading.Lock()
+
+def exportReport(folder):
+    '''
+    The in memory export report of an export folder - Loaded on first use
+    '''
+    with exportReportLock:
+        if folder not in exportReports:
+            exportReports[folder] = ExportReport(folder)
+        return exportReports[folder]
+
 def addToExportReport(key, value, folder):
     '''
     Used in many places to enrich the export report
     '''
-    addToJsonFile({key:value}, folder + exportReportFile)
+    exportReport(folder).set(key, value)
+
+def addToExportReportOnce(key, value, folder):
+    '''
+    Only adding to the export report if the key is not there already, e.g. when resuming an export
+    '''
+    return exportReport(folder).setOnce(key, value)
+
+def addExportTiming(name, seconds, folder):
+    '''
+    Duration of an export phase in seconds. All in the 'timings' of the export report
+    '''
+    exportReport(folder).addTiming(name, seconds)
+
+def addExportCount(keys, count, folder):
+    '''
+    Number of items written by the export, captured when they are written, e.g. (['entries', contentType, language], 100)
+    Used by structureReport, so it does not need to read the exported files again
+    '''
+    exportReport(folder).setIn(['exportCounts'] + list(keys), count)
+
+def flushExportReport(folder):
+    '''
+    Writing the export report to disk - At the end of each export phase
+    '''
+    return exportReport(folder).flush()
+
+def closeExportReport(folder):
+    '''
+    Writing the export report to disk and forgetting it, e.g. before the export folder is removed
+    '''
+    with exportReportLock:
+        report = exportReports.pop(folder, None)
+    return report.flush() if report else True
+
+def flushExportReports():
+    '''
+    Nothing is lost if the application exits (or crashes with an exception) between phases
+    '''
+    with exportReportLock:
+        reports = list(exportReports.values())
+    for report in reports:
+        report.flush()
+
+atexit.register(flushExportReports)
 
 def readFromJsonFile(filePath):
     try:
-        with open(filePath) as json_file:
-            return json.load(json_file)
+        return jsonBackend.readFile(filePath)
     except Exception as e:
         logging.critical('Failed reading from json file: '  + filePath + ' - ' + str(e))
         return False
 
-def downloadFileToDisk(url, folder, fileName):
+def downloadFileToDisk(url, folder, fileName, restarted=False):
     '''
     Downloading asset file to local disk
+    The body is streamed to a temporary .part file in chunks, and renamed when the download is complete.
+    A .part file left behind by an interrupted download is resumed with a HTTP Range request.
     '''
-    if os.path.isfile(folder + fileName): # Not writing over file
-        logging.info('File exists. Not overwriting ({})'.format(folder + fileName))
+    filePath = folder + fileName
+    if os.path.isfile(filePath): # Not writing over file
+        logging.info('File exists. Not overwriting ({})'.format(filePath))
         return True
+    partPath = filePath + '.part'
     try:
-        res = requests.get(url, allow_redirects=True)
-        if res.status_code not in (200, 201):
-            logging.error('{}Unable to download asset: {} from URL: {}{}'.format(RED, fileName, url, END))
-            logging.error('{}Error Message: {} {}'.format(RED, res.text, END))
-            return False
-        write = open(folder + fileName, 'wb').write(res.content)
-        if not write:
-            logging.error('{}Unable write asset to disk: {}/{}{}'.format(RED, folder, fileName, END))
-            return False
+        offset = 0
+        header = {}
+        if os.path.isfile(partPath):
+            offset = os.path.getsize(partPath)
+            header['Range'] = 'bytes={}-'.format(offset)
+            logging.info('Resuming download of asset: {} from byte {}'.format(fileName, offset))
+        with httpClient.get(url, headers=header, stream=True, allow_redirects=True) as res:
+            resumed = res.status_code == 206 and res.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset))
+            if offset and not resumed and not restarted and res.status_code in (206, 416): # Partial file can not be resumed. Starting over
+                os.remove(partPath)
+                return downloadFileToDisk(url, folder, fileName, True)
+            if res.status_code not in (200, 201) and not resumed:
+                logging.error('{}Unable to download asset: {} from URL: {}{}'.format(RED, fileName, url, END))
+                logging.error('{}Error Message: {} {}'.format(RED, res.text, END))
+                return False
+            with open(partPath, 'ab' if resumed else 'wb') as f:
+                for chunk in res.iter_content(chunk_size=downloadChunkSize):
+                    f.write(chunk)
+        os.replace(partPath, filePath)
         logging.info('Asset downloaded: {}'.format(fileName))
         return True
     except Exception as e:
@@ -230,6 +407,37 @@ def downloadFileToDisk(url, folder, fileName):
         logging.error('{}Error Message: {} {}'.format(RED, e, END))
         return False
 
+def clearFolder(folder):
+    '''
+    Deleting all files in a folder (not sub folders)
+    '''
+    for f in readDirIfExists(folder):
+        if os.path.isfile(folder + f):
+            os.remove(folder + f)
+    return True
+
+def linkFile(source, target):
+    '''
+    Carrying a file over from another export - Hard link if possible, copy if not
+    '''
+    if os.path.isfile(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return True
+
+def linkFolder(source, target):
+    '''
+    Carrying all files in a folder over from another export (not sub folders)
+    '''
+    checkDir(target)
+    for f in readDirIfExists(source):
+        if os.path.isfile(source + f) and not f.endswith('.part'):
+            linkFile(source + f, target + f)
+    return True
+
 def countFilesInFolder(folder):
     count = 0
     for path in readDirIfExists(folder):
@@ -249,6 +457,7 @@ def structureReport(folder):
     Iterates all folders and generates 'crude' analytics to be pumped in report
     '''
     d = {}
+    counts = exportReport(folder).get('exportCounts') or {} # Captured while exporting. Files without a count are counted by streaming them
     for key, _ in folderNames.items():
         if key not in ['assets', 'entries', 'folders']: # Those types are exported to more folders and/or files
             label = 'Number of {} Exported'.format(key)
@@ -257,7 +466,9 @@ def structureReport(folder):
     try:
         d['Number of Assets Exported'] = countFoldersInFolder(folder + folderNames['assets'])
         if os.path.isfile(folder + folderNames['folders'] + fileNames['folders']):
-            d['Number of Asset Folders Exported'] = len(readFromJsonFile(folder + folderNames['folders'] + fileNames['folders'])['assets'])
+            d['Number of Asset Folders Exported'] = counts.get('assetFolders')
+            if d['Number of Asset Folders Exported'] is None:
+                d['Number of Asset Folders Exported'] = jsonBackend.countItems(folder + folderNames['folders'] + fileNames['folders'])
         else:
             d['Number of Asset Folders Exported'] = 0
     except Exception:
@@ -268,8 +479,11 @@ def structureReport(folder):
     for contentType in readDirIfExists(folder + folderNames['entries']):
         d['Number of Entries Per Content Type and Language'][contentType] = {}
         ctFolder = folder + folderNames['entries'] + contentType + '/'
-        for f in readDirIfExists(ctFolder):
-            lang = f.replace('.json', '')
-            r = readFromJsonFile(ctFolder + f)
-            d['Number of Entries Per Content Type and Language'][contentType][lang] = len(r['entries'])
-    addToJsonFile({'Numbers':d}, folder + exportReportFile) # Adding our findings to the report
+        captured = counts.get('entries', {}).get(contentType, {})
+        for lang, filePath in entryStore.listEntryFiles(ctFolder).items():
+            count = captured.get(lang)
+            if count is None:
+                count = entryStore.countEntries(filePath)
+            d['Number of Entries Per Content Type and Language'][contentType][lang] = count
+    addToExportReport('Numbers', d, folder) # Adding our findings to the report
+    flushExportReport(folder)
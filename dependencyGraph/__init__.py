@@ -0,0 +1,165 @@
+'''
+Small dependency graph helpers used to order imports (entries, asset folders) and structure exports.
+A graph is a dict: {node: iterable of nodes it depends on}. Dependencies that are not nodes in the graph are ignored.
+
+Strongly connected components are found with Tarjan's algorithm (iterative - no recursion limit on deep graphs).
+'''
+from time import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def stronglyConnectedComponents(graph):
+    '''
+    Returns the strongly connected components (lists of nodes) of the graph.
+    Dependencies come before the nodes depending on them.
+    '''
+    index = {}
+    lowLink = {}
+    onStack = set()
+    stack = []
+    components = []
+    counter = 0
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowLink[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack.add(root)
+        while work:
+            node, dependencies = work[-1]
+            pushed = False
+            for dependency in dependencies:
+                if dependency not in graph:
+                    continue
+                if dependency not in index:
+                    index[dependency] = lowLink[dependency] = counter
+                    counter += 1
+                    stack.append(dependency)
+                    onStack.add(dependency)
+                    work.append((dependency, iter(graph[dependency])))
+                    pushed = True
+                    break
+                if dependency in onStack:
+                    lowLink[node] = min(lowLink[node], index[dependency])
+            if pushed:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowLink[parent] = min(lowLink[parent], lowLink[node])
+            if lowLink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onStack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+def isCycle(component, graph):
+    '''
+    A component is a cycle if it has more than one node, or a node depending on itself
+    '''
+    return len(component) > 1 or component[0] in graph[component[0]]
+
+def topologicalOrder(graph):
+    '''
+    All nodes, dependencies first. Nodes of a cycle are next to each other, in no particular order
+    Returns the order and a list of cycles (components)
+    '''
+    order = []
+    cycles = []
+    for component in stronglyConnectedComponents(graph):
+        order.extend(component)
+        if isCycle(component, graph):
+            cycles.append(component)
+    return order, cycles
+
+def levels(graph):
+    '''
+    Grouping the nodes into levels. Nodes only depend on nodes in earlier levels (or in their own cycle),
+    so all nodes of a level can be worked on at the same time.
+    Nodes of a cycle are in the same level. Returns the levels (lists of nodes) and a list of cycles (components)
+    '''
+    componentOf = {}
+    levelOf = {}
+    result = []
+    cycles = []
+    for number, component in enumerate(stronglyConnectedComponents(graph)):
+        level = 0
+        for node in component:
+            componentOf[node] = number
+        for node in component:
+            for dependency in graph[node]:
+                if dependency in graph and componentOf.get(dependency) != number:
+                    level = max(level, levelOf[componentOf[dependency]] + 1)
+        levelOf[number] = level
+        if level == len(result):
+            result.append([])
+        result[level].extend(component)
+        if isCycle(component, graph):
+            cycles.append(component)
+    return result, cycles
+
+def runGraph(graph, function, workers, threadName='graph'):
+    '''
+    Running function(node) for every node of an acyclic graph on a bounded pool.
+    A node is started as soon as everything it depends on is finished, so independent nodes run concurrently.
+    An exception in a node is raised when it finishes (nodes already running are finished first).
+    Returns the results {node: result} and how long each node took {node: seconds}
+    '''
+    _, cycles = topologicalOrder(graph)
+    if cycles:
+        raise ValueError('Unable to run a graph with cycles: {}'.format(cycles))
+    results = {}
+    durations = {}
+
+    def run(node):
+        startTime = time()
+        try:
+            results[node] = function(node)
+        finally:
+            durations[node] = time() - startTime
+
+    pending = {node: set(d for d in graph[node] if d in graph) for node in graph}
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=threadName) as executor:
+        while pending or running:
+            for node in [n for n, dependencies in pending.items() if not dependencies]:
+                del pending[node]
+                running[executor.submit(run, node)] = node
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                future.result()
+                for dependencies in pending.values():
+                    dependencies.discard(node)
+    return results, durations
+
+def criticalPath(graph, durations):
+    '''
+    The chain of dependent nodes that took the longest in total - The lower limit of the run time, no matter how many workers.
+    Returns the path (dependencies first) and its total duration in seconds
+    '''
+    finish = {}
+    previous = {}
+    order, _ = topologicalOrder(graph)
+    for node in order:
+        start = 0
+        for dependency in graph[node]:
+            if dependency in finish and finish[dependency] > start:
+                start = finish[dependency]
+                previous[node] = dependency
+        finish[node] = start + durations.get(node, 0)
+    if not finish:
+        return [], 0
+    node = max(finish, key=finish.get)
+    total = finish[node]
+    path = [node]
+    while node in previous:
+        node = previous[node]
+        path.append(node)
+    return list(reversed(path)), total
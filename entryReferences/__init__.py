@@ -0,0 +1,219 @@
+'''
+Schema driven rewriting of asset and entry references in entries.
+Each content type schema (from the export) is compiled once into a tree of only the fields that can hold references:
+file fields, reference fields, JSON RTE fields - and the groups, modular blocks and global fields containing them.
+An entry is then remapped in a single traversal, with dict lookups in the uid mappers.
+
+Compiled field: (uid, kind, multiple, children)
+    kind is one of 'file', 'reference', 'jsonRte', 'group' (also global fields) and 'blocks'
+    children is a list of compiled fields (group), or a dict of block uid -> list of compiled fields (blocks)
+'''
+import config
+import entryStore
+
+def readGlobalFields(folder):
+    '''
+    Global field schemas from the export, by uid. Used when a content type does not include the global field schema
+    '''
+    globalFields = {}
+    gfFolder = folder + config.folderNames['globalFields']
+    for f in config.readDirIfExists(gfFolder):
+        globalField = config.readFromJsonFile(gfFolder + f)
+        if globalField:
+            globalFields[globalField['uid']] = globalField.get('schema', [])
+    return globalFields
+
+def compileSchema(schema, globalFields, seen=()):
+    '''
+    Compiling a schema (list of fields) into the fields that can hold references. Fields that can not are left out
+    '''
+    compiled = []
+    for field in schema or []:
+        dataType = field.get('data_type')
+        multiple = field.get('multiple', False)
+        if dataType == 'file':
+            compiled.append((field['uid'], 'file', multiple, None))
+        elif dataType == 'reference':
+            compiled.append((field['uid'], 'reference', multiple, None))
+        elif dataType == 'json' and field.get('field_metadata', {}).get('allow_json_rte'):
+            compiled.append((field['uid'], 'jsonRte', multiple, None))
+        elif dataType in ('group', 'global_field'):
+            subSchema = field.get('schema')
+            if subSchema is None and dataType == 'global_field' and field.get('reference_to') not in seen:
+                subSchema = globalFields.get(field.get('reference_to'), [])
+            children = compileSchema(subSchema, globalFields, seen + (field.get('reference_to'),))
+            if children:
+                compiled.append((field['uid'], 'group', multiple, children))
+        elif dataType == 'blocks':
+            blocks = {}
+            for block in field.get('blocks', []):
+                children = compileSchema(block.get('schema'), globalFields, seen)
+                if children:
+                    blocks[block['uid']] = children
+            if blocks:
+                compiled.append((field['uid'], 'blocks', True, blocks))
+    return compiled
+
+def compileContentTypes(folder):
+    '''
+    Compiling the schema of every content type in the export
+    Returns a dict of content type uid -> compiled fields
+    '''
+    globalFields = readGlobalFields(folder)
+    compiled = {}
+    ctFolder = folder + config.folderNames['contentTypes']
+    for f in config.readDirIfExists(ctFolder):
+        contentType = config.readFromJsonFile(ctFolder + f)
+        if contentType:
+            compiled[contentType['uid']] = compileSchema(contentType.get('schema'), globalFields)
+    config.logging.debug('Compiled reference fields of {} content types'.format(len(compiled)))
+    return compiled
+
+def rewriteAsset(value, assetMapper):
+    '''
+    File fields end up as (mapped) asset uids. Exports can have the whole asset object in them
+    '''
+    if isinstance(value, dict):
+        value = value.get('uid')
+    if assetMapper and value in assetMapper:
+        return assetMapper[value]
+    return value
+
+def rewriteReference(value, entryMapper, state):
+    if isinstance(value, dict) and 'uid' in value:
+        uid = value['uid']
+        if entryMapper and uid in entryMapper:
+            uid = entryMapper[uid]
+            state['references'] += 1
+        return {'uid': uid, '_content_type_uid': value.get('_content_type_uid')}
+    return value
+
+def rewriteRteNode(node, assetMapper, entryMapper, state):
+    '''
+    Embedded assets and entries in JSON RTE are nodes with uids in their attributes
+    '''
+    if not isinstance(node, dict):
+        return
+    attrs = node.get('attrs')
+    if isinstance(attrs, dict):
+        if assetMapper and attrs.get('asset-uid') in assetMapper:
+            attrs['asset-uid'] = assetMapper[attrs['asset-uid']]
+        if entryMapper and attrs.get('entry-uid') in entryMapper:
+            attrs['entry-uid'] = entryMapper[attrs['entry-uid']]
+            state['references'] += 1
+    for child in node.get('children', []) or []:
+        rewriteRteNode(child, assetMapper, entryMapper, state)
+
+def rewriteFields(data, fields, assetMapper, entryMapper, state):
+    '''
+    Rewriting the compiled fields of a dict (entry, group or block) in place
+    '''
+    if not isinstance(data, dict):
+        return
+    for uid, kind, multiple, children in fields:
+        value = data.get(uid)
+        if value is None:
+            continue
+        if kind == 'file':
+            if isinstance(value, list):
+                data[uid] = [rewriteAsset(v, assetMapper) for v in value]
+            else:
+                data[uid] = rewriteAsset(value, assetMapper)
+        elif kind == 'reference':
+            if isinstance(value, list):
+                data[uid] = [rewriteReference(v, entryMapper, state) for v in value]
+            else:
+                data[uid] = rewriteReference(value, entryMapper, state)
+        elif kind == 'jsonRte':
+            for node in (value if isinstance(value, list) else [value]):
+                rewriteRteNode(node, assetMapper, entryMapper, state)
+        elif kind == 'group':
+            for item in (value if isinstance(value, list) else [value]):
+                rewriteFields(item, children, assetMapper, entryMapper, state)
+        elif kind == 'blocks':
+            for item in (value if isinstance(value, list) else []):
+                if not isinstance(item, dict):
+                    continue
+                for blockUid, blockData in item.items():
+                    if blockUid in children:
+                        rewriteFields(blockData, children[blockUid], assetMapper, entryMapper, state)
+
+def rewriteEntry(entry, fields, assetMapper=None, entryMapper=None):
+    '''
+    Rewriting asset and entry references of an entry in place, in a single traversal
+    Returns the entry and the number of entry references that were remapped
+    '''
+    state = {'references': 0}
+    rewriteFields(entry, fields, assetMapper, entryMapper, state)
+    return entry, state['references']
+
+def collectRteReferences(node, found):
+    if not isinstance(node, dict):
+        return
+    attrs = node.get('attrs')
+    if isinstance(attrs, dict) and attrs.get('entry-uid'):
+        found.add(attrs['entry-uid'])
+    for child in node.get('children', []) or []:
+        collectRteReferences(child, found)
+
+def collectFields(data, fields, found):
+    '''
+    Collecting the entry uids referenced in the compiled fields of a dict (entry, group or block)
+    '''
+    if not isinstance(data, dict):
+        return
+    for uid, kind, _, children in fields:
+        value = data.get(uid)
+        if value is None or kind == 'file':
+            continue
+        items = value if isinstance(value, list) else [value]
+        if kind == 'reference':
+            for item in items:
+                if isinstance(item, dict) and 'uid' in item:
+                    found.add(item['uid'])
+        elif kind == 'jsonRte':
+            for node in items:
+                collectRteReferences(node, found)
+        elif kind == 'group':
+            for item in items:
+                collectFields(item, children, found)
+        elif kind == 'blocks':
+            for item in items:
+                if isinstance(item, dict):
+                    for blockUid, blockData in item.items():
+                        if blockUid in children:
+                            collectFields(blockData, children[blockUid], found)
+
+def collectReferences(entry, fields):
+    '''
+    The set of entry uids an entry references (without changing the entry)
+    '''
+    found = set()
+    collectFields(entry, fields, found)
+    return found
+
+def addToIndex(index, contentType, language, entry, fields):
+    '''
+    Adding the outgoing references of an entry to a reference index: {(contentType, language): {entry uid: set of referenced uids}}
+    Entries without references are not in the index
+    '''
+    references = collectReferences(entry, fields)
+    if references:
+        index.setdefault((contentType, language), {})[entry['uid']] = references
+    return index
+
+def buildIndex(folder, contentTypes, languages, rewriters):
+    '''
+    Building the reference index of all exported entries in a single pass over the entry files
+    '''
+    index = {}
+    entryFolder = folder + config.folderNames['entries']
+    for contentType in contentTypes:
+        fields = rewriters.get(contentType, [])
+        if not fields:
+            continue
+        for language in languages:
+            for entry in entryStore.readEntriesOf(entryFolder, contentType, language):
+                if entry['locale'] == language:
+                    addToIndex(index, contentType, language, entry, fields)
+    return index
@@ -0,0 +1,187 @@
+'''
+Storage of exported entries. One file per content type and language: entries/<content type>/<language>.<extension>
+
+Format version 2 (ndjson): One entry per line, written as the entries arrive, optionally gzip compressed (config.compressEntries).
+Read back one entry at a time. Full exports and the entry import stream the files (the import plan only keeps uids and references).
+Incremental exports hold the previous entries of one content type and language while merging the changes. Legacy files are parsed whole.
+Format version 1 (legacy): A single JSON document, {"entries": [...]}. Still readable - Written by older exports.
+
+The format of an export is recorded in its report.json (entryStorage).
+'''
+import os
+import gzip
+import config
+import jsonBackend
+
+formatName = 'ndjson'
+formatVersion = 2
+legacyVersion = 1
+extensions = ['.ndjson.gz', '.ndjson', '.json'] # In the order they are looked for when reading
+
+def newExtension():
+    return '.ndjson.gz' if config.compressEntries else '.ndjson'
+
+def languageOfFile(fileName):
+    '''
+    The language code from an entry file name, e.g. en-us.ndjson.gz -> en-us. None if it is not an entry file
+    '''
+    for extension in extensions:
+        if fileName.endswith(extension):
+            return fileName[:-len(extension)]
+    return None
+
+def findEntryFile(entryFolder, contentType, language):
+    '''
+    Path to the entry file of a content type and language, in whatever format it was written. None if there is none
+    '''
+    for extension in extensions:
+        filePath = entryFolder + contentType + '/' + language + extension
+        if os.path.isfile(filePath):
+            return filePath
+    return None
+
+def listEntryFiles(contentTypeFolder):
+    '''
+    All entry files of a content type folder: {language: file path}
+    '''
+    files = {}
+    for f in sorted(config.readDirIfExists(contentTypeFolder)):
+        language = languageOfFile(f)
+        if language and language not in files:
+            files[language] = contentTypeFolder + f
+    return files
+
+def openFile(filePath, mode, compressed):
+    if compressed:
+        return gzip.open(filePath, mode + 'b')
+    return open(filePath, mode + 'b')
+
+def readEntries(filePath):
+    '''
+    Generator yielding the entries of an entry file, one at a time.
+    Legacy files are a single JSON document, so those are parsed in one go.
+    A half written last line (crash while writing) is ignored.
+    '''
+    if filePath.endswith('.json'):
+        document = config.readFromJsonFile(filePath) or {}
+        yield from document.get('entries', [])
+        return
+    with openFile(filePath, 'r', filePath.endswith('.gz')) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = jsonBackend.loads(line)
+            except ValueError:
+                config.logging.warning('{}Ignoring broken line in entry file: {}{}'.format(config.YELLOW, filePath, config.END))
+                continue
+            yield entry
+
+def countEntries(filePath, chunkSize=1024 * 1024):
+    '''
+    Counting the entries of an entry file without parsing them - Lines of ndjson files are counted in chunks.
+    Legacy files are scanned for the items of the entries array (jsonBackend.countItems)
+    '''
+    if filePath.endswith('.json'):
+        return jsonBackend.countItems(filePath, chunkSize)
+    count = 0
+    last = b'\n'
+    with openFile(filePath, 'r', filePath.endswith('.gz')) as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n': # Last line not finished
+        count += 1
+    return count
+
+def readEntriesOf(entryFolder, contentType, language):
+    '''
+    Generator yielding the entries of a content type in a language. Nothing if there is no entry file
+    '''
+    filePath = findEntryFile(entryFolder, contentType, language)
+    if filePath:
+        yield from readEntries(filePath)
+
+class EntryWriter:
+    '''
+    Writing the entries of a content type in a language, one line per entry, as they arrive.
+    Written to a temporary .part file that replaces the entry file when closed (commit), so a failed or interrupted
+    write never leaves a half written entry file behind. Entry files of the same language in other formats are removed.
+    Nothing is left behind if no entries were written.
+        with EntryWriter(entryFolder, contentType, language) as writer:
+            for entry in entries:
+                writer.write(entry)
+        writer.count
+    '''
+    def __init__(self, entryFolder, contentType, language):
+        self.filePath = entryFolder + contentType + '/' + language + newExtension()
+        self.partPath = self.filePath + '.part'
+        self.count = 0
+        self.file = None
+
+    def write(self, entry):
+        if self.file is None:
+            self.file = openFile(self.partPath, 'w', self.filePath.endswith('.gz'))
+        self.file.write(jsonBackend.dumps(entry) + b'\n')
+        self.count += 1
+
+    def commit(self):
+        '''
+        Returns the path of the entry file, None if there were no entries
+        '''
+        if self.file is None:
+            return None
+        self.file.close()
+        self.file = None
+        folder, fileName = os.path.split(self.filePath)
+        language = languageOfFile(fileName)
+        for extension in extensions:
+            other = os.path.join(folder, language + extension)
+            if other != self.filePath and os.path.isfile(other):
+                os.remove(other)
+        os.replace(self.partPath, self.filePath)
+        return self.filePath
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.isfile(self.partPath):
+            os.remove(self.partPath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+def writeEntries(entryFolder, contentType, language, entries):
+    '''
+    Writing entries (any iterable) to the entry file of a content type and language
+    Returns the number of entries written, None if writing failed
+    '''
+    try:
+        with EntryWriter(entryFolder, contentType, language) as writer:
+            for entry in entries:
+                writer.write(entry)
+        return writer.count
+    except Exception as e:
+        config.logging.critical('{}Failed writing entries to file: {} - Error Message: {}{}'.format(config.RED, writer.filePath, e, config.END))
+        return None
+
+def storageInfo():
+    return {
+        'format': formatName,
+        'version': formatVersion,
+        'compression': 'gzip' if config.compressEntries else None
+    }
+
+def recordFormat(folder):
+    '''
+    Adding the entry storage format to the export report. Exports without it are in the legacy format
+    '''
+    config.addToExportReport('entryStorage', storageInfo(), folder)
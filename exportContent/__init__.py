@@ -6,12 +6,22 @@ Exports content to a local folder
 
 '''
 import os
+import shutil
+import threading
 from time import sleep, time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import inquirer
 import requests
 import config
 import cma
 import cda
+import blobStore
+import ledger
+import entryStore
+import jsonBackend
+
+deltaLock = threading.Lock()
 
 def getEnvironmentsFromExport(folder):
     '''
@@ -218,12 +228,319 @@ def whatContentToExport(info):
     downloadAssets = False
     if assetsToExport:
         downloadAssets = defineAssetDownload()
-    report = {'environments': entriesToExport, 'assets': assetsToExport, 'downloadAssets': downloadAssets, 'languages': languagesToExport, 'contentTypes': contentTypesToExport}
+    incrementalFrom = defineIncrementalExport(info)
+    report = {'environments': entriesToExport, 'assets': assetsToExport, 'downloadAssets': downloadAssets, 'languages': languagesToExport, 'contentTypes': contentTypesToExport, 'incrementalFrom': incrementalFrom}
     return report
 
-def exportEntriesUsingDeliveryToken(stackInfo, token, environment, folder, contentInfo):
+def findPreviousExports(info):
+    '''
+    Finding finished content exports of the same stack, newest first.
+    Returns a list of (exportStartedAt, folder name, full path)
+    '''
+    root = config.dataRootFolder + config.stackRootFolder
+    previousExports = []
+    for f in config.readDirIfExists(root):
+        fullPath = root + f + '/'
+        if (f + '/' == config.mapperFolder) or (fullPath == info['folder']['fullPath']):
+            continue
+        if not os.path.isfile(fullPath + config.exportReportFile):
+            continue
+        report = config.readFromJsonFile(fullPath + config.exportReportFile)
+        try:
+            if report['stackStructureExportInfo']['apiKey'] == info['apiKey'] and 'Numbers' in report:
+                previousExports.append((report['exportStartedAt'], f, fullPath))
+        except (KeyError, TypeError): # Not a finished content export, or exported before incremental exports were possible
+            continue
+    return sorted(previousExports, reverse=True)
+
+def defineIncrementalExport(info):
+    '''
+    Asking the user whether to export everything, or only what has changed since a previous export of the same stack.
+    Returns the full path of the previous export, or None for a full export
+    '''
+    previousExports = findPreviousExports(info)
+    if not previousExports:
+        return None
+    choices = ['Full Export']
+    for startedAt, name, _ in previousExports:
+        choices.append('Incremental - Changes since: {} ({})'.format(name, startedAt))
+    answer = inquirer.list_input("{}Do you want to export everything, or only what has changed since a previous export of this stack?{}".format(config.BOLD, config.END), choices=choices)
+    if answer == 'Full Export':
+        return None
+    return previousExports[choices.index(answer) - 1][2]
+
+def readIncrementalBase(contentInfo):
+    '''
+    Reading the watermark and settings of the previous export we are exporting changes since.
+    Returns None if there is none, or it can not be used (a full export is done in that case)
+    '''
+    if not contentInfo.get('incrementalFrom'):
+        return None
+    previousFolder = contentInfo['incrementalFrom']
+    report = config.readFromJsonFile(previousFolder + config.exportReportFile)
+    try:
+        previousInfo = report['contentExportInfo']
+        previous = {
+            'folder': previousFolder,
+            'watermark': report['exportStartedAt'],
+            'downloadAssets': previousInfo['downloadAssets'],
+            'syncToken': report.get('syncToken') # Only when the previous export used the Sync API
+        }
+    except (KeyError, TypeError):
+        config.logging.warning('{}Unable to read the export report of {}. Doing a full export.{}'.format(config.YELLOW, previousFolder, config.END))
+        return None
+    if previousInfo['environments'] != contentInfo['environments']:
+        config.logging.warning('{}Previous export was of different entries ({}). Doing a full export.{}'.format(config.YELLOW, previousInfo['environments'], config.END))
+        return None
+    for key in ('languages', 'contentTypes'): # Nothing to carry over for these - Every entry of them is exported (per content type and language)
+        notInPrevious = [item for item in contentInfo.get(key) or [] if item not in (previousInfo.get(key) or [])]
+        if notInPrevious:
+            config.logging.info('{}Not in the previous export, exporting all entries of {}: {}{}'.format(config.YELLOW, key, notInPrevious, config.END))
+    config.logging.info('{}Incremental Export: Exporting changes since {} ({}){}'.format(config.BOLD, previous['watermark'], previousFolder, config.END))
+    return previous
+
+def countDelta(deltaStats, key, number):
+    '''
+    Thread safe counting of changed/unchanged/deleted items in incremental exports
+    '''
+    with deltaLock:
+        deltaStats[key] = deltaStats.get(key, 0) + number
+
+def entryUnitName(unit):
+    return 'entries:{}:{}'.format(*unit)
+
+def scheduleEntryExport(units, exportUnit, countUnit, folder):
+    '''
+    Export scheduler. Runs independent (content type, language) export units on a bounded pool.
+    Units are ordered largest first, using the counts from a cheap include_count probe, so the long downloads do not end up last.
+    The shared rate limit is respected by the httpClient module. Throughput per worker is logged and added to the export report.
+    Every unit is recorded in the export ledger - units already done in an interrupted export are skipped.
+    '''
+    done = [unit for unit in units if ledger.isDone(folder, entryUnitName(unit))]
+    if done:
+        config.logging.info('Skipping {} Entry export units already done in a previous run'.format(len(done)))
+        units = [unit for unit in units if unit not in done]
+    if config.probeEntryCounts and len(units) > 1:
+        with ThreadPoolExecutor(max_workers=config.entryExportWorkers) as executor:
+            counts = list(executor.map(countUnit, units))
+        units = [unit for _, unit in sorted(zip(counts, units), key=lambda x: x[0] or 0, reverse=True)]
+    workers = {}
+    lock = threading.Lock()
+
+    def runUnit(unit):
+        startTime = time()
+        result = ledger.runUnit(folder, entryUnitName(unit), exportUnit, unit)
+        exported = result or 0
+        if result is not None: # Kept in the export report, so the entry files do not need to be read again for the report
+            config.addExportCount(['entries', unit[0], unit[1]], exported, folder)
+        worker = threading.current_thread().name
+        with lock:
+            if worker not in workers:
+                workers[worker] = {'units': 0, 'entries': 0, 'seconds': 0}
+            workers[worker]['units'] += 1
+            workers[worker]['entries'] += exported
+            workers[worker]['seconds'] += time() - startTime
+        return exported
+
+    with ThreadPoolExecutor(max_workers=config.entryExportWorkers, thread_name_prefix='entryExport') as executor:
+        total = sum(executor.map(runUnit, units))
+    for worker, stats in sorted(workers.items()):
+        stats['entriesPerSecond'] = round(stats['entries'] / stats['seconds'], 2) if stats['seconds'] else None
+        stats['seconds'] = round(stats['seconds'], 2)
+        config.logging.info('{}{}: {} units, {} entries in {} seconds ({} entries/second){}'.format(config.CYAN, worker, stats['units'], stats['entries'], stats['seconds'], stats['entriesPerSecond'], config.END))
+    config.addToExportReport('entryExportWorkers', workers, folder)
+    return total
+
+def writeEntryUnit(entryFolder, unit, entries, state):
+    '''
+    Writing entries of a single content type in a single language to file as they arrive from a streamed listing (see entryStore).
+    Returns the number of entries written to file, None if fetching or writing failed - Nothing is left behind then
+    '''
+    contentType, language = unit
+    writer = entryStore.EntryWriter(entryFolder, contentType, language)
+    try:
+        for entry in entries:
+            writer.write(entry)
+    except Exception as e:
+        writer.discard()
+        config.logging.error('{}Unable to write to file. {} - Error Message: {}{}'.format(config.RED, writer.filePath, e, config.END))
+        return None
+    if state.get('failed'):
+        writer.discard()
+        config.logging.error('{}Unable to export Entries. {} - {}{}'.format(config.RED, contentType, language, config.END))
+        return None
+    if not writer.commit():
+        config.logging.info('No Entries. {} - {}'.format(contentType, language))
+        return 0
+    config.logging.info('Entries Exported to File. {}'.format(writer.filePath))
+    return writer.count
+
+def exportEntryUnitUsingDeliveryToken(stackInfo, token, environment, entryFolder, unit):
+    '''
+    Exporting entries of a single content type in a single language using the delivery token
+    Returns the number of entries written to file, None if writing failed
+    '''
+    contentType, language = unit
+    config.logging.info('{}Exporting Entries of Content Type: {} - Language: {}{}'.format(config.GREEN, contentType, language, config.END))
+    # I wish I could see all entries, based on where the master locale is published.
+    # But I need to get all entries and see the publishing details in them
+    # e.g. to see whether en-us (master or fallback) is published on the is-is
+    state = {}
+    entries = cda.streamAllEntries(stackInfo, contentType, language, environment, token, state)
+    return writeEntryUnit(entryFolder, unit, entries, state)
+
+syncSpoolFolder = 'syncSpool/' # In the export folder, removed when the entries are written
+
+class SyncSpool:
+    '''
+    Entries from the Sync API feed, written to disk as they arrive - One ndjson file per content type and language.
+    Only the position of each entry in its file is kept in memory, so the sync does not hold the entries of the whole stack.
+        position = spool.write(unit, entry)
+        spool.close()
+        spool.entries(unit, {uid: position})
+        spool.remove()
+    '''
+    maxOpenFiles = 64 # Not running out of file handles on stacks with many content types and languages
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.files = {}
+        self.counts = {}
+        if os.path.isdir(folder): # Left behind by an interrupted export
+            shutil.rmtree(folder)
+
+    def filePath(self, unit):
+        return self.folder + '{}/{}.ndjson'.format(*unit)
+
+    def write(self, unit, entry):
+        '''
+        Returns the position of the entry in the file of its unit
+        '''
+        if unit not in self.files:
+            if len(self.files) >= self.maxOpenFiles:
+                self.close()
+            config.checkDir(self.folder + unit[0] + '/')
+            self.files[unit] = open(self.filePath(unit), 'ab')
+        self.files[unit].write(jsonBackend.dumps(entry) + b'\n')
+        position = self.counts.get(unit, 0)
+        self.counts[unit] = position + 1
+        return position
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def entries(self, unit, positions):
+        '''
+        Generator yielding the entries of a unit found at their position ({uid: position}) - The latest version of each entry in the feed
+        '''
+        filePath = self.filePath(unit)
+        if not os.path.isfile(filePath):
+            return
+        for position, entry in enumerate(entryStore.readEntries(filePath)):
+            if positions.get(entry['uid']) == position:
+                yield entry
+
+    def remove(self):
+        self.close()
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+
+def syncDeliveryContent(stackInfo, deliveryToken, environment, folder, previous=None):
+    '''
+    Reading everything published on the environment in a single Sync API feed, instead of fetching every content type in every language.
+    If the previous export we are exporting changes since has a sync token, only the changes since that export are in the feed.
+    Returns what was found in the feed, or None if the sync failed:
+    {
+        'entries': {(contentType, language): {uid: position in the spool, or None if unpublished/deleted}},
+        'spool': SyncSpool with the published entries,
+        'deletedEntries': {contentType: set of uids deleted in all languages},
+        'deletedContentTypes': set of content type uids,
+        'assets': {uid: asset, or None if unpublished/deleted},
+        'incremental': True if only changes are in the feed
+    }
+    '''
+    syncToken = None
+    if previous:
+        syncToken = previous.get('syncToken')
+        if not syncToken:
+            config.logging.info('No sync token in the previous export. Doing an initial sync.')
+    config.logging.info('{}Syncing Entries and Assets on Environment {} using the Sync API{}'.format(config.BOLD, environment, config.END))
+    state = {}
+    spool = SyncSpool(folder + syncSpoolFolder)
+    synced = {'entries': {}, 'spool': spool, 'deletedEntries': {}, 'deletedContentTypes': set(), 'assets': {}, 'incremental': bool(syncToken)}
+    items = 0
+    for item in cda.sync(stackInfo, deliveryToken, state, environment, syncToken):
+        items += 1
+        itemType = item.get('type', '')
+        data = item.get('data', {})
+        if itemType.startswith('entry_'):
+            contentType = item.get('content_type_uid')
+            if itemType == 'entry_published':
+                unit = (contentType, data['locale'])
+                synced['entries'].setdefault(unit, {})[data['uid']] = spool.write(unit, data)
+            elif data.get('locale'):
+                synced['entries'].setdefault((contentType, data['locale']), {})[data['uid']] = None
+            else: # Deleted in all languages
+                synced['deletedEntries'].setdefault(contentType, set()).add(data['uid'])
+                for key, value in synced['entries'].items():
+                    if key[0] == contentType:
+                        value.pop(data['uid'], None)
+        elif itemType.startswith('asset_'):
+            # Limitation: An asset unpublished from a single locale is treated as unpublished
+            synced['assets'][data['uid']] = data if itemType == 'asset_published' else None
+        elif itemType == 'content_type_deleted':
+            synced['deletedContentTypes'].add(data.get('uid'))
+    spool.close()
+    if state.get('failed'):
+        spool.remove()
+        config.logging.error('{}Sync failed. Falling back to exporting every Content Type and Language.{}'.format(config.RED, config.END))
+        return None
+    config.logging.info('{}Sync finished. {} items in the feed.{}'.format(config.BOLD, items, config.END))
+    config.addToExportReport('syncToken', state.get('syncToken'), folder)
+    return synced
+
+def writeSyncedEntryUnit(synced, entryFolder, previous, deltaStats, exportUnit, unit):
+    '''
+    Writing entries of a single content type in a single language from the sync feed (spooled to disk, see SyncSpool).
+    Incremental sync: Entries from the previous export are carried over and the changes applied on top of them - Both files are streamed.
+    Units without an entry file in the previous export are exported in full (exportUnit) - Only the changes are in the feed.
+    Returns the number of entries written to file, None if writing failed
+    '''
+    contentType, language = unit
+    changes = synced['entries'].get(unit, {})
+    deleted = synced['deletedEntries'].get(contentType, set())
+    previousFile = None
+    removed = 0
+    if synced['incremental'] and contentType not in synced['deletedContentTypes']:
+        previousFile = entryStore.findEntryFile(previous['folder'] + config.folderNames['entries'], contentType, language)
+        if not previousFile: # Nothing to carry over
+            exported = exportUnit(unit)
+            countDelta(deltaStats, 'changed', exported or 0)
+            return exported
+        previousUids = set(entry['uid'] for entry in entryStore.readEntries(previousFile))
+        if not changes and not deleted.intersection(previousUids):
+            config.linkFile(previousFile, entryFolder + contentType + '/' + os.path.basename(previousFile))
+            countDelta(deltaStats, 'unchanged', len(previousUids))
+            return len(previousUids)
+        removed = len([uid for uid in previousUids if uid in deleted or (uid in changes and changes[uid] is None)])
+    countDelta(deltaStats, 'changed', len([position for position in changes.values() if position is not None]))
+    countDelta(deltaStats, 'deleted', removed)
+
+    def syncedEntries():
+        if previousFile:
+            for entry in entryStore.readEntries(previousFile):
+                if entry['uid'] not in changes and entry['uid'] not in deleted:
+                    yield entry
+        yield from synced['spool'].entries(unit, changes)
+
+    return writeEntryUnit(entryFolder, unit, syncedEntries(), {})
+
+def exportEntriesUsingDeliveryToken(stackInfo, token, environment, folder, contentInfo, synced=None, previous=None):
     '''
     Using delivery token to export entries from a single environment
+    With a sync feed (synced), the entries are written from that. Otherwise every content type and language is fetched.
     '''
     languages = contentInfo['languages']
     contentTypes = contentInfo['contentTypes']
@@ -233,29 +550,113 @@ def exportEntriesUsingDeliveryToken(stackInfo, token, environment, folder, conte
     config.logging.debug('{}contentInfo: {}{}'.format(config.CYAN, contentInfo, config.END))
     config.logging.debug('{}entryFolder: {}{}'.format(config.CYAN, entryFolder, config.END))
     config.checkDir(entryFolder)
-    counter = 0
+    units = []
     for contentType in contentTypes:
-        entryFolderPerContentType = entryFolder + contentType + '/'
-        config.checkDir(entryFolderPerContentType)
-        config.logging.info('{}Exporting Entries of Content Type: {}{}'.format(config.GREEN, contentType, config.END))
+        config.checkDir(entryFolder + contentType + '/')
         for language in languages:
-            config.logging.info('{}Exporting Entries of Language: {}{}'.format(config.BOLD, language, config.END))
-            entries = cda.getAllEntries(stackInfo, contentType, language, environment, token)
-            if entries:
-                # I wish I could see all entries, based on where the master locale is published.
-                # But I need to get all entries and see the publishing details in them
-                # e.g. to see whether en-us (master or fallback) is published on the is-is
-                fileName = entryFolderPerContentType + language + '.json'
-                if config.writeToJsonFile(entries, fileName):
-                    config.logging.info('Entries Exported to File. {}'.format(fileName))
-                    counter = counter + len(entries['entries'])
-                else:
-                    config.logging.error('{}Unable to write to file. {}{}'.format(config.RED, fileName, config.END))
-            else:
-                config.logging.info('No Entries. {} - {}'.format(contentType, language))
+            units.append((contentType, language))
+    exportUnit = partial(exportEntryUnitUsingDeliveryToken, stackInfo, token, environment, entryFolder)
+    if synced is not None:
+        deltaStats = {}
+        counter = 0
+        for unit in units:
+            if not ledger.isDone(folder, entryUnitName(unit)):
+                counter += ledger.runUnit(folder, entryUnitName(unit), writeSyncedEntryUnit, synced, entryFolder, previous, deltaStats, exportUnit, unit) or 0
+        synced['spool'].remove()
+        config.logging.info('{}Exported {} Entries from the Sync API{}'.format(config.BOLD, counter, config.END))
+        if synced['incremental']:
+            config.logging.info('{}Incremental Entries Export: {}{}'.format(config.BOLD, deltaStats, config.END))
+            config.addToExportReport('incrementalEntries', deltaStats, folder)
+        return True
+    countUnit = lambda unit: cda.getEntryCount(stackInfo, unit[0], unit[1], environment, token)
+    counter = scheduleEntryExport(units, exportUnit, countUnit, folder)
+    config.logging.info('{}Exported {} Entries{}'.format(config.BOLD, counter, config.END))
     return True
 
-def exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, environment=None):
+def exportEntryUnitUsingAuthToken(stackInfo, authToken, environment, entryFolder, unit):
+    '''
+    Exporting entries of a single content type in a single language using the Content Management API
+    Returns the number of entries written to file, None if writing failed
+    '''
+    contentType, language = unit
+    if environment:
+        config.logging.info('{}{}Exporting Entries of Content Type: {} - Language: {} from Environment: {}{}'.format(config.BOLD, config.GREEN, contentType, language, environment, config.END))
+    else:
+        config.logging.info('{}{}Exporting Entries of Content Type: {} - Language: {}{}'.format(config.BOLD, config.GREEN, contentType, language, config.END))
+    state = {}
+    entries = cma.streamAllEntries(stackInfo, contentType, language, authToken, state, environment)
+    # if (language != masterLocale) and (fallbackLanguage is not None):
+    # We need to confirm that entry is not using the fallback_locale.
+    # If it's in a different language, we do not want to export it.
+    # I wish I could add an extra parameter to the request, e.g. ?include_fallback_locale=false and just get empty responses.
+    # We see in the master locale in what languages it is published in.
+    entries = (entry for entry in entries if entry['locale'] == language) # We know it's the right language
+    return writeEntryUnit(entryFolder, unit, entries, state)
+
+def exportEntryUnitIncremental(stackInfo, authToken, environment, entryFolder, previous, deltaStats, unit):
+    '''
+    Incremental export of a single content type in a single language.
+    Only entries updated after the watermark of the previous export are fetched, the rest are carried over from the previous export.
+    Deleted entries are found with a cheap uid-only listing. If nothing changed, the previous file is just hard linked.
+    Listed entries that did not change but are not in the previous file either are fetched by uid. Any failed query -> all entries are exported.
+    '''
+    contentType, language = unit
+    previousFile = entryStore.findEntryFile(previous['folder'] + config.folderNames['entries'], contentType, language)
+    if not previousFile: # Nothing to carry over
+        exported = exportEntryUnitUsingAuthToken(stackInfo, authToken, environment, entryFolder, unit)
+        countDelta(deltaStats, 'changed', exported or 0)
+        return exported
+    listingState = {}
+    changedState = {}
+    listing = cma.getEntryUids(stackInfo, contentType, language, authToken, environment, listingState)
+    changed = cma.getAllEntries(stackInfo, contentType, language, authToken, environment, {'updated_at': {'$gt': previous['watermark']}}, changedState)
+    previousEntries = {entry['uid']: entry for entry in entryStore.readEntries(previousFile)}
+    if listingState.get('failed') or changedState.get('failed') or not previousEntries: # None without a failure is just an empty listing
+        config.logging.warning('{}Unable to export changes of {} - {}. Exporting all entries.{}'.format(config.YELLOW, contentType, language, config.END))
+        return exportEntryUnitUsingAuthToken(stackInfo, authToken, environment, entryFolder, unit)
+    currentUids = [entry['uid'] for entry in (listing or {'entries': []})['entries'] if entry['locale'] == language]
+    changedEntries = {}
+    for entry in (changed or {'entries': []})['entries']:
+        if entry['locale'] == language:
+            changedEntries[entry['uid']] = entry
+    missingUids = [uid for uid in currentUids if uid not in changedEntries and uid not in previousEntries]
+    for i in range(0, len(missingUids), cma.pageSize): # Not changed, but not in the previous export either (e.g. published since), fetching them by uid
+        missingState = {}
+        missing = cma.getAllEntries(stackInfo, contentType, language, authToken, environment, {'uid': {'$in': missingUids[i:i + cma.pageSize]}}, missingState)
+        if missingState.get('failed'):
+            config.logging.warning('{}Unable to export changes of {} - {}. Exporting all entries.{}'.format(config.YELLOW, contentType, language, config.END))
+            return exportEntryUnitUsingAuthToken(stackInfo, authToken, environment, entryFolder, unit)
+        for entry in (missing or {'entries': []})['entries']:
+            if entry['locale'] == language:
+                changedEntries[entry['uid']] = entry
+    deleted = len(set(previousEntries) - set(currentUids))
+    countDelta(deltaStats, 'deleted', deleted)
+    fileName = entryFolder + contentType + '/' + os.path.basename(previousFile)
+    if not changedEntries and not deleted and len(currentUids) == len(previousEntries):
+        config.linkFile(previousFile, fileName)
+        config.logging.info('No changes. Entries carried over from previous export. {}'.format(fileName))
+        countDelta(deltaStats, 'unchanged', len(currentUids))
+        return len(currentUids)
+    def mergedEntries():
+        for uid in currentUids:
+            if uid in changedEntries:
+                yield changedEntries[uid]
+            elif uid in previousEntries:
+                yield previousEntries[uid]
+            else:
+                config.logging.warning('{}Entry {} ({} - {}) not found. Not exported.{}'.format(config.YELLOW, uid, contentType, language, config.END))
+
+    written = entryStore.writeEntries(entryFolder, contentType, language, mergedEntries())
+    if written is None:
+        config.logging.error('{}Unable to write to file. {} - {}{}'.format(config.RED, contentType, language, config.END))
+        return None
+    countDelta(deltaStats, 'changed', len(changedEntries))
+    countDelta(deltaStats, 'unchanged', written - len(changedEntries))
+    if written:
+        config.logging.info('Changed Entries merged with previous export. {} changed, {} deleted. {} - {}'.format(len(changedEntries), deleted, contentType, language))
+    return written
+
+def exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, environment=None, previous=None):
     '''
     Exporting entries using the Content Management API.
     Just ALL Entries on one hand, and based on published environment on the other hand.
@@ -268,102 +669,213 @@ def exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, envir
     config.logging.debug('Assets to export: {}'.format(assetsToExport))
     entryFolder = folder + config.folderNames['entries']
     config.checkDir(entryFolder)
-    counter = 0
+    units = []
     for contentType in contentTypes:
-        ctFolder = entryFolder + contentType + '/'
-        config.checkDir(ctFolder)
-        if environment:
-            config.logging.info('{}{}Exporting Entries of Content Type: {} from Environment: {}{}'.format(config.BOLD, config.GREEN, contentType, environment, config.END))
-        else:
-            config.logging.info('{}{}Exporting Entries of Content Type: {}{}'.format(config.BOLD, config.GREEN, contentType, config.END))
-
+        config.checkDir(entryFolder + contentType + '/')
         for language in languages:
-            config.logging.info('Exporting from Language: {}'.format(language))
-            entries = cma.getAllEntries(stackInfo, contentType, language, authToken, environment)
-            if entries:
-                fileName = ctFolder + language + '.json'
-                # if (language != masterLocale) and (fallbackLanguage is not None):
-                # We need to confirm that entry is not using the fallback_locale.
-                # If it's in a different language, we do not want to export it.
-                # I wish I could add an extra parameter to the request, e.g. ?include_fallback_locale=false and just get empty responses.
-                # We see in the master locale in what languages it is published in.
-                newEntries = {'entries': []}
-                for entry in entries['entries']:
-                    if entry['locale'] == language: # We know it's the right language
-                        newEntries['entries'].append(entry)
-                if newEntries['entries']:
-                    if config.writeToJsonFile(newEntries, fileName):
-                        config.logging.info('Entries Exported to File. {}'.format(fileName))
-                        counter = counter + len(entries['entries'])
-                else:
-                    config.logging.debug('No Entries. {} - {}'.format(contentType, language))
-            config.logging.info('No Entries. {} - {}'.format(contentType, language))
+            units.append((contentType, language))
+    if previous:
+        deltaStats = {}
+        exportUnit = partial(exportEntryUnitIncremental, stackInfo, authToken, environment, entryFolder, previous, deltaStats)
+    else:
+        exportUnit = partial(exportEntryUnitUsingAuthToken, stackInfo, authToken, environment, entryFolder)
+    countUnit = lambda unit: cma.getEntryCount(stackInfo, unit[0], unit[1], authToken, environment)
+    counter = scheduleEntryExport(units, exportUnit, countUnit, folder)
+    config.logging.info('{}Exported {} Entries{}'.format(config.BOLD, counter, config.END))
+    if previous:
+        config.logging.info('{}Incremental Entries Export: {}{}'.format(config.BOLD, deltaStats, config.END))
+        config.addToExportReport('incrementalEntries', deltaStats, folder)
     return True
 
-def processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets):
+def processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets, exportFolder=None):
     '''
     Re-usable function where exported entries (both via CMA and CDA) are worked on and written to export folders.
+    With exportFolder, every asset is a unit in the export ledger ('asset:<uid>'). Assets done in an interrupted export are skipped.
     '''
     if not assets:
         return False
+    downloads = []
+    skipped = 0
     for asset in assets['assets']:
         uid = asset['uid']
+        if exportFolder and ledger.isDone(exportFolder, 'asset:' + uid):
+            skipped += 1
+            continue
+        if exportFolder:
+            ledger.mark(exportFolder, 'asset:' + uid, ledger.PENDING)
         assetFolder = folder + uid + '/'
         config.checkDir(assetFolder)
         assetFileName = asset['filename']
         metadataFileName = uid + '_v{}.json'.format(asset['_version'])
-        if config.writeToJsonFile({'asset': asset}, assetFolder + metadataFileName):
-            config.logging.info('Image metadata written to {}'.format(metadataFileName))
+        metadata = {assetFolder + metadataFileName: {'asset': asset}}
+        if 'publish_details' in asset: # All publishing details of the asset, by '<locale>-<environment>'
+            publishDetails = asset['publish_details'] if isinstance(asset['publish_details'], list) else [asset['publish_details']]
+            metadata[assetFolder + 'publishDetails.json'] = {i['locale'] + '-' + i['environment']: i for i in publishDetails}
+        written = config.writeJsonFiles(metadata)
+        config.logging.info('Asset metadata written to {} files in {}'.format(written, assetFolder))
         if downloadAssets:
-            assetUrl = asset['url']
-            config.logging.info('Downloading Asset: {} To file path: {}'.format(assetUrl, assetFileName))
-            config.downloadFileToDisk(assetUrl, assetFolder, assetFileName)
-        if 'publish_details' in asset:
-
-            config.logging.info('Adding publishing details to export file: {}'.format(assetFolder + 'publishDetails.json'))
-            if isinstance(asset['publish_details'], list):
-                for i in asset['publish_details']:
-                    key = i['locale'] + '-' + i['environment']
-                    config.addToJsonFile({key: i}, assetFolder + 'publishDetails.json')
+            if config.useBlobStore and blobStore.linkAsset(uid, asset['_version'], assetFolder + assetFileName):
+                config.logging.debug('Skipping download of unchanged asset: {}'.format(uid))
+                downloaded = True
             else:
-                key = asset['publish_details']['locale'] + '-' + asset['publish_details']['environment']
-                config.addToJsonFile({key:asset['publish_details']}, assetFolder + 'publishDetails.json')
+                downloads.append((asset['url'], assetFolder, assetFileName, uid, asset['_version']))
+                downloaded = False
+        else:
+            downloaded = True
+        if exportFolder and downloaded: # Assets being downloaded are marked as done when their file is on disk
+            ledger.mark(exportFolder, 'asset:' + uid, ledger.DONE)
+    if skipped:
+        config.logging.info('Skipped {} Assets already exported in a previous run'.format(skipped))
+    downloaded = True
+    if downloads:
+        downloaded = downloadAssetFiles(downloads, exportFolder)
+    if config.useBlobStore and downloadAssets:
+        blobStore.saveIndex()
+    return downloaded
+
+def downloadAsset(exportFolder, download):
+    '''
+    Downloading a single asset file. Moving it to the blob store when that is enabled
+    Marking the asset as done (or failed) in the export ledger, if we have one
+    '''
+    url, assetFolder, assetFileName, uid, version = download
+    config.logging.info('Downloading Asset: {} To file path: {}'.format(url, assetFileName))
+    if not config.downloadFileToDisk(url, assetFolder, assetFileName):
+        if exportFolder:
+            ledger.mark(exportFolder, 'asset:' + uid, ledger.FAILED)
+        return False
+    if config.useBlobStore:
+        blobStore.storeAsset(uid, version, assetFolder + assetFileName)
+    if exportFolder:
+        ledger.mark(exportFolder, 'asset:' + uid, ledger.DONE)
     return True
 
-def exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo, environment=None):
+def downloadAssetFiles(downloads, exportFolder=None):
+    '''
+    Downloading asset files concurrently (config.downloadWorkers)
+    downloads is a list of (url, folder, fileName, uid, version)
+    '''
+    config.logging.info('Downloading {} Asset Files'.format(len(downloads)))
+    with ThreadPoolExecutor(max_workers=config.downloadWorkers, thread_name_prefix='assetDownload') as executor:
+        results = list(executor.map(partial(downloadAsset, exportFolder), downloads))
+    failed = results.count(False)
+    if failed:
+        config.logging.error('{}Unable to download {} of {} Asset Files{}'.format(config.RED, failed, len(downloads), config.END))
+        return False
+    return True
+
+def exportChangedAssets(stackInfo, authToken, folder, exportFolder, previous, environment=None):
+    '''
+    Incremental asset export. Fetching assets updated after the watermark of the previous export.
+    Unchanged asset folders are carried over (hard linked) from the previous export, deleted assets are found with a uid-only listing.
+    Returns the changed assets, to be processed like any other asset export - None if it failed.
+    '''
+    previousFolder = previous['folder'] + config.folderNames['assets']
+    listingState = {}
+    changedState = {}
+    listing = cma.getAssetUids(stackInfo, authToken, environment, listingState)
+    changed = cma.getAllAssets(stackInfo, authToken, environment, {'updated_at': {'$gt': previous['watermark']}}, changedState)
+    if listingState.get('failed') or changedState.get('failed'): # None without a failure is just an empty listing
+        return None
+    listing = listing or {'assets': []}
+    changed = (changed or {'assets': []})['assets']
+    changedUids = set(asset['uid'] for asset in changed)
+    missingUids = []
+    unchanged = 0
+    currentUids = set()
+    for asset in listing['assets']:
+        uid = asset['uid']
+        currentUids.add(uid)
+        if uid in changedUids:
+            continue
+        if os.path.isdir(previousFolder + uid):
+            config.linkFolder(previousFolder + uid + '/', folder + uid + '/')
+            unchanged += 1
+        else:
+            missingUids.append(uid)
+    for i in range(0, len(missingUids), cma.pageSize): # Not in the previous export for some reason, fetching them by uid
+        missingState = {}
+        missing = cma.getAllAssets(stackInfo, authToken, environment, {'uid': {'$in': missingUids[i:i + cma.pageSize]}}, missingState)
+        if missingState.get('failed'):
+            return None
+        if missing:
+            changed = changed + missing['assets']
+    deleted = len([f for f in config.readDirIfExists(previousFolder) if os.path.isdir(previousFolder + f) and f not in currentUids])
+    deltaStats = {'changed': len(changed), 'unchanged': unchanged, 'deleted': deleted}
+    config.logging.info('{}Incremental Assets Export: {}{}'.format(config.BOLD, deltaStats, config.END))
+    config.addToExportReport('incrementalAssets', deltaStats, exportFolder)
+    return {'assets': changed}
+
+def exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo, environment=None, previous=None):
     '''
     Exporting Assets using the Auth token
     Environment optional
+    Previous optional - Only exporting changes since that export
     '''
     config.addToExportReport('AssetExportMethod', 'AuthToken', folder)
     masterLocale = stackInfo['masterLocale']
     downloadAssets = contentInfo['downloadAssets']
+    exportFolder = folder
     folder = folder + config.folderNames['assets']
     config.checkDir(folder)
     if environment:
         config.logging.info('{}Exporting Assets on Environment {} using Auth Token{}'.format(config.BOLD, environment, config.END))
     else:
         config.logging.info('{}Exporting all Assets using Auth Token{}'.format(config.BOLD, config.END))
-    assets = cma.getAllAssets(stackInfo, authToken, environment)
-    if processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets):
+    assets = None
+    if previous and (previous['downloadAssets'] or not downloadAssets):
+        assets = exportChangedAssets(stackInfo, authToken, folder, exportFolder, previous, environment)
+        if assets is None:
+            config.logging.warning('{}Unable to export changed Assets. Exporting all Assets.{}'.format(config.YELLOW, config.END))
+        elif not assets['assets']:
+            config.logging.info('Finished Exporting Assets - No changes')
+            return True
+    elif previous:
+        config.logging.info('Asset files were not downloaded in the previous export. Exporting all Assets.')
+    if assets is None:
+        assets = cma.getAllAssets(stackInfo, authToken, environment)
+    if processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets, exportFolder):
         config.logging.info('Finished Exporting Assets')
         return True
     config.logging.error('{}Unable to export Assets!{}')
     return False
 
-
-def exportAssetsDeliveryToken(stackInfo, deliveryToken, environment, folder, contentInfo):
+def exportAssetsDeliveryToken(stackInfo, deliveryToken, environment, folder, contentInfo, synced=None, previous=None):
     '''
     Exporting Assets using the Delivery Token
+    With a sync feed (synced), the assets are taken from that. Unchanged assets are carried over from the previous export on incremental syncs.
     '''
     config.addToExportReport('AssetExportMethod', 'DeliveryToken', folder)
     masterLocale = stackInfo['masterLocale']
     downloadAssets = contentInfo['downloadAssets']
+    exportFolder = folder
     folder = folder + config.folderNames['assets']
     config.checkDir(folder)
     config.logging.info('{}Exporting Assets on Environment {} using the Delivery Token{}'.format(config.BOLD, environment, config.END))
-    assets = cda.getAllAssets(stackInfo, deliveryToken, environment)
-    if processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets):
+    if synced is not None and synced['incremental'] and downloadAssets and not previous['downloadAssets']:
+        config.logging.info('Asset files were not downloaded in the previous export. Exporting all Assets.')
+        synced = None
+    if synced is not None:
+        assets = {'assets': [asset for asset in synced['assets'].values() if asset]}
+        if synced['incremental']:
+            previousFolder = previous['folder'] + config.folderNames['assets']
+            deltaStats = {'changed': len(assets['assets']), 'unchanged': 0, 'deleted': 0}
+            for uid in config.readDirIfExists(previousFolder):
+                if not os.path.isdir(previousFolder + uid):
+                    continue
+                if uid not in synced['assets']:
+                    config.linkFolder(previousFolder + uid + '/', folder + uid + '/')
+                    deltaStats['unchanged'] += 1
+                elif not synced['assets'][uid]:
+                    deltaStats['deleted'] += 1
+            config.logging.info('{}Incremental Assets Export: {}{}'.format(config.BOLD, deltaStats, config.END))
+            config.addToExportReport('incrementalAssets', deltaStats, exportFolder)
+            if not assets['assets']:
+                config.logging.info('Finished Exporting Assets - No changes')
+                return True
+    else:
+        assets = cda.getAllAssets(stackInfo, deliveryToken, environment)
+    if processAssetExport(assets, stackInfo, folder, masterLocale, downloadAssets, exportFolder):
         config.logging.info('Finished Exporting Assets')
         return True
     config.logging.error('{}Unable to export Assets!{}')
@@ -374,19 +886,24 @@ def exportAssetsDeliveryToken(stackInfo, deliveryToken, environment, folder, con
 def exportAssetFolders(authToken, stackInfo, folder):
     '''
     Exporting All Folders to a single JSON file
+    Returns the number of folders, 0 if there are none, None if it failed
     '''
     foldersFolder = folder + config.folderNames['folders']
     fileName = foldersFolder + config.fileNames['folders']
     config.checkDir(folder)
-    folders = cma.getAllFolders(stackInfo, authToken)
+    state = {}
+    folders = cma.getAllFolders(stackInfo, authToken, state)
     if folders:
-        if config.writeToJsonFile(folders, fileName):
+        if config.writeToJsonFile(folders, fileName, True):
             config.logging.info('Folders Exported to file. ({})'.format(fileName))
-            return True
+            config.addExportCount(['assetFolders'], len(folders['assets']), folder)
+            return len(folders['assets'])
         config.logging.error('{}Unable to write Folders to file: {}{}'.format(config.RED, fileName, config.END))
         return None
+    if state.get('failed'):
+        return None
     config.logging.warning('{}No Asset Folders found on Stack.{}'.format(config.YELLOW, config.END))
-    return None
+    return 0
 
 
 def iniateExportContent(stackInfo, contentInfo, authToken):
@@ -396,6 +913,10 @@ def iniateExportContent(stackInfo, contentInfo, authToken):
     folder = stackInfo['folder']['fullPath'] # Where the export is stored on the local drive
     assetsToExport = contentInfo['assets']
     entriesToExport = contentInfo['environments'] # Entries to be exported are either 'all' or based on environment, e.g. 'development'
+    config.addToExportReportOnce('exportStartedAt', config.getTimestamp(), folder) # Watermark for later incremental exports. Kept when resuming
+    previous = readIncrementalBase(contentInfo) # None, unless only exporting changes since a previous export
+    entryStore.recordFormat(folder) # Files carried over from a previous export keep their format - Both are readable
+    config.flushExportReport(folder) # The watermark is on disk before anything is exported, even if the process is killed
 
     '''
     Starting Entries Export
@@ -412,16 +933,19 @@ def iniateExportContent(stackInfo, contentInfo, authToken):
         else: # We did not find a delivery token - so we need to use the content management API to export the entries
             config.addToExportReport('useDeliveryToken', False, folder)
             config.logging.info('We will use the Content Management API to Export Entries')
-            exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, entriesToExport)
+            exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, entriesToExport, previous)
     if useDeliveryToken:
         config.logging.info('Found a Delivery Token for chosen Environment ({}). Will use the Content Delivery API to Export Entries.'.format(entriesToExport))
-        exportEntriesUsingDeliveryToken(stackInfo, deliveryToken, entriesToExport, folder, contentInfo)
+        synced = syncDeliveryContent(stackInfo, deliveryToken, entriesToExport, folder, previous)
+        exportEntriesUsingDeliveryToken(stackInfo, deliveryToken, entriesToExport, folder, contentInfo, synced, previous)
     if contentInfo['environments'] == 'all':
         config.logging.info('Iniating Entries Export using the Content Management API on all Entries/Assets.')
-        exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo)
+        exportEntriesUsingAuthToken(stackInfo, authToken, folder, contentInfo, previous=previous)
     entriesEndTime = time()
     totalEntriesTime = entriesEndTime - entriesStartTime
     config.logging.info('{}Export Entries finished in {} seconds{}'.format(config.BOLD, totalEntriesTime, config.END))
+    config.addExportTiming('entries', totalEntriesTime, folder)
+    config.flushExportReport(folder)
 
 
     '''
@@ -433,17 +957,17 @@ def iniateExportContent(stackInfo, contentInfo, authToken):
         config.logging.info('{}No Assets Exported.{}'.format(config.BOLD, config.END))
     elif assetsToExport == 'all':
         config.logging.info('{}All Assets will be Exported.{}'.format(config.BOLD, config.END))
-        assetsExported = exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo)
+        assetsExported = exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo, previous=previous)
     else: # Exporting assets based on environment - Possibly with the delivery token found
         if useDeliveryToken: # delivery token found - can be used on assets
             config.logging.info('Assets from the {} Environment will now be Exported, using the Content Delivery API (Delivery Token).')
-            assetsExported = exportAssetsDeliveryToken(stackInfo, deliveryToken, assetsToExport, folder, contentInfo)
+            assetsExported = exportAssetsDeliveryToken(stackInfo, deliveryToken, assetsToExport, folder, contentInfo, synced, previous)
         else: # delivery token NOT found
             config.logging.info('Assets from the {} Environment will now be Exported, using the Content Management API (Auth Token).')
-            assetsExported = exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo, assetsToExport)
+            assetsExported = exportAssetsUsingAuthToken(stackInfo, authToken, folder, contentInfo, assetsToExport, previous)
     if assetsToExport: # The folder structure needs to be exported as well.
         config.logging.info('Exporting Asset Folders')
-        foldersExported = exportAssetFolders(authToken, stackInfo, folder)
+        foldersExported = ledger.runUnit(folder, 'assetFolders', exportAssetFolders, authToken, stackInfo, folder)
     if assetsExported:# and foldersExported:
         config.logging.info('{}Assets and Folders exported{}'.format(config.BOLD, config.END))
     else:
@@ -452,4 +976,6 @@ def iniateExportContent(stackInfo, contentInfo, authToken):
     totalAssetsTime = assetsEndTime - assetsStartTime
     totalTime = totalEntriesTime + totalAssetsTime
     config.logging.info('{}Export Assets finished in {} seconds{}'.format(config.BOLD, totalAssetsTime, config.END))
+    config.addExportTiming('assets', totalAssetsTime, folder)
+    config.flushExportReport(folder)
     config.logging.info('{}Total Export Content finished in {} seconds{}'.format(config.BOLD, totalTime, config.END))
@@ -10,6 +10,8 @@ import os
 import inquirer
 import cma
 import config
+import ledger
+import dependencyGraph
 
 def chooseFolder():
     '''
@@ -32,19 +34,54 @@ def chooseFolder():
     folder = inquirer.prompt(folder)['chosenFolder']
     return folder
 
+def chooseResumableFolder():
+    '''
+    Lists up exports that were interrupted (their ledger says they are not done).
+    The user picks one, or None if there are none.
+    '''
+    root = config.dataRootFolder + config.stackRootFolder
+    resumableFolders = []
+    for f in sorted(config.readDirIfExists(root)):
+        if f + '/' != config.mapperFolder and ledger.isResumable(root + f + '/'):
+            resumableFolders.append(f + '/')
+    if not resumableFolders:
+        config.logging.info('{}No interrupted exports found.{}'.format(config.YELLOW, config.END))
+        return None
+    folder = [
+        inquirer.List('chosenFolder',
+                      message="{}Choose interrupted export to resume{}".format(config.BOLD, config.END),
+                      choices=resumableFolders + ['Cancel'],
+                      ),
+    ]
+    folder = inquirer.prompt(folder)['chosenFolder']
+    if folder == 'Cancel':
+        return None
+    return folder
+
 def writeExport(exportItem, folderPath, keyToLabelFile):
     '''
     re-usable function where we attempt to write exports to file
     example for content types: (contentTypeBody, data/<exportedStackName + Datestamp>/contentTypes/, 'uid')
         --> 'uid' is just the key from the export to be used as file name... sometimes the uid, the name, the title... just has to be a unique field
+    Returns the number of items written, None if writing any of them failed (the module is then redone when resuming the export)
+    Exporters return None if the export failed (error logged in cma), and 0 if there is nothing to export
     '''
-
+    count = 0
+    written = set()
+    failed = False
     for item in exportItem:
         filePath = folderPath + item[keyToLabelFile].replace('/', '-') + '.json' # I personally put a "/" in a custom role name. It breaks everything here...
-        write = config.writeToJsonFile(item, filePath)
-        if not write:
-            config.logging.error('{}Not able to write to file: {}{}'.format(config.BOLD, filePath, config.END))
-    return True
+        if filePath in written:
+            config.logging.error('{}Not able to write to file: {} - Another item has the same {}{}'.format(config.BOLD, filePath, keyToLabelFile, config.END))
+            continue
+        if config.writeToJsonFile(item, filePath, True): # Overwriting what an interrupted export might have written
+            written.add(filePath)
+            count += 1
+        else:
+            failed = True
+    if failed:
+        return None
+    return count
 
 def exportContentTypes(apiKey, token, region, folder):
     '''
@@ -52,11 +89,14 @@ def exportContentTypes(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting content types')
     folderPath = config.defineFullFolderPath(folder, 'contentTypes')
-    contentTypesExport = cma.getAllContentTypes(apiKey, token, region)
+    state = {}
+    contentTypesExport = cma.getAllContentTypes(apiKey, token, region, state=state)
     if contentTypesExport:
         return writeExport(contentTypesExport['content_types'], folderPath, 'uid')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing content type response from Contentstack. Do you have content types in that stack?{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def getContentTypeUids(folder):
     '''
@@ -64,8 +104,8 @@ def getContentTypeUids(folder):
     '''
     path = config.defineFullFolderPath(folder, 'contentTypes')
     ctArr = []
-    for ct in path:
-        ctArr.append(ct.strip('json'))
+    for ct in config.readDirIfExists(path):
+        ctArr.append(ct.replace('.json', ''))
     return ctArr
 
 def exportGlobalFields(apiKey, token, region, folder):
@@ -74,11 +114,14 @@ def exportGlobalFields(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting global fields')
     folderPath = config.defineFullFolderPath(folder, 'globalFields')
-    globalFieldsExport = cma.getAllGlobalFields(apiKey, token, region)
+    state = {}
+    globalFieldsExport = cma.getAllGlobalFields(apiKey, token, region, state=state)
     if globalFieldsExport:
         return writeExport(globalFieldsExport['global_fields'], folderPath, 'uid')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing global field response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportExtensions(apiKey, token, region, folder):
     '''
@@ -86,11 +129,14 @@ def exportExtensions(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting extensions')
     folderPath = config.defineFullFolderPath(folder, 'extensions')
-    extensionsExport = cma.getAllExtensions(apiKey, token, region)
+    state = {}
+    extensionsExport = cma.getAllExtensions(apiKey, token, region, state=state)
     if extensionsExport:
         return writeExport(extensionsExport['extensions'], folderPath, 'title')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing extensions response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportWorkflows(apiKey, token, region, folder):
     '''
@@ -98,11 +144,14 @@ def exportWorkflows(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting workflows')
     folderPath = config.defineFullFolderPath(folder, 'workflows')
-    workflowsExport = cma.getAllWorkflows(apiKey, token, region)
+    state = {}
+    workflowsExport = cma.getAllWorkflows(apiKey, token, region, state=state)
     if workflowsExport:
         return writeExport(workflowsExport['workflows'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing workflow response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportPublishingRules(contentTypeUids, apiKey, token, region, folder):
     '''
@@ -110,11 +159,14 @@ def exportPublishingRules(contentTypeUids, apiKey, token, region, folder):
     '''
     config.logging.info('Exporting all publishing rules')
     folderPath = config.defineFullFolderPath(folder, 'publishingRules')
-    publishingRulesExport = cma.getAllPublishingRules(contentTypeUids, apiKey, token, region)
+    state = {}
+    publishingRulesExport = cma.getAllPublishingRules(contentTypeUids, apiKey, token, region, state=state)
     if publishingRulesExport:
         return writeExport(publishingRulesExport['publishing_rules'], folderPath, 'uid')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing publishing rule response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportLabels(apiKey, token, region, folder):
     '''
@@ -122,11 +174,14 @@ def exportLabels(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting all labels')
     folderPath = config.defineFullFolderPath(folder, 'labels')
-    labelsExport = cma.getAllLabels(apiKey, token, region)
+    state = {}
+    labelsExport = cma.getAllLabels(apiKey, token, region, state=state)
     if labelsExport:
         return writeExport(labelsExport['labels'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing label response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportLanguages(apiKey, token, region, folder):
     '''
@@ -134,11 +189,14 @@ def exportLanguages(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting all languages')
     folderPath = config.defineFullFolderPath(folder, 'languages')
-    languagesExport = cma.getAllLanguages(apiKey, token, region)
+    state = {}
+    languagesExport = cma.getAllLanguages(apiKey, token, region, state=state)
     if languagesExport:
         return writeExport(languagesExport['locales'], folderPath, 'code')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing language response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportEnvironments(apiKey, token, region, folder):
     '''
@@ -146,11 +204,14 @@ def exportEnvironments(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting All Environments')
     folderPath = config.defineFullFolderPath(folder, 'environments')
-    environmentsExport = cma.getAllEnvironments(apiKey, token, region)
+    state = {}
+    environmentsExport = cma.getAllEnvironments(apiKey, token, region, state=state)
     if environmentsExport:
         return writeExport(environmentsExport['environments'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing environment response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportDeliveryTokens(apiKey, token, region, folder):
     '''
@@ -158,11 +219,14 @@ def exportDeliveryTokens(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting All Delivery Tokens')
     folderPath = config.defineFullFolderPath(folder, 'deliveryTokens')
-    deliveryTokensExport = cma.getAllDeliveryTokens(apiKey, token, region)
+    state = {}
+    deliveryTokensExport = cma.getAllDeliveryTokens(apiKey, token, region, state=state)
     if deliveryTokensExport:
         return writeExport(deliveryTokensExport['tokens'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing delivery token response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportRoles(apiKey, token, region, folder):
     '''
@@ -170,11 +234,14 @@ def exportRoles(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting All Roles')
     folderPath = config.defineFullFolderPath(folder, 'roles')
-    rolesExport = cma.getAllRoles(apiKey, token, region)
+    state = {}
+    rolesExport = cma.getAllRoles(apiKey, token, region, state=state)
     if rolesExport:
         return writeExport(rolesExport['roles'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing role response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
 
 def exportWebhooks(apiKey, token, region, folder):
     '''
@@ -182,30 +249,69 @@ def exportWebhooks(apiKey, token, region, folder):
     '''
     config.logging.info('Exporting All Webhooks')
     folderPath = config.defineFullFolderPath(folder, 'webhooks')
-    webhooksExport = cma.getAllWebhooks(apiKey, token, region)
+    state = {}
+    webhooksExport = cma.getAllWebhooks(apiKey, token, region, state=state)
     if webhooksExport:
         return writeExport(webhooksExport['webhooks'], folderPath, 'name')
+    if state.get('failed'): # Redone when resuming the export
+        return None
     config.logging.info('{}Missing webhook response from Contentstack.{}'.format(config.YELLOW, config.END))
-    return False
+    return 0
+
+def exportPublishingRulesOfContentTypes(apiKey, token, region, folder):
+    '''
+    Publishing rules are fetched by content type uids - so content types need to be exported first
+    '''
+    contentTypeUids = getContentTypeUids(folder) # Need to get all content types to fetch publishing rules
+    return exportPublishingRules(contentTypeUids, apiKey, token, region, folder)
+
+structureModules = { # folderNames key: (modules it depends on, export function). Only publishing rules depend on another module (content type uids)
+    'contentTypes': ([], exportContentTypes),
+    'globalFields': ([], exportGlobalFields),
+    'extensions': ([], exportExtensions),
+    'workflows': ([], exportWorkflows),
+    'publishingRules': (['contentTypes'], exportPublishingRulesOfContentTypes),
+    'environments': ([], exportEnvironments),
+    'deliveryTokens': ([], exportDeliveryTokens),
+    'roles': ([], exportRoles),
+    'webhooks': ([], exportWebhooks),
+    'labels': ([], exportLabels),
+    'languages': ([], exportLanguages)
+}
 
 def exportStack(apiKey, token, region, folder):
     '''
     Export stack function
+    Modules are exported concurrently (config.structureExportWorkers), publishing rules after content types.
+    Every module is a unit in the export ledger. When resuming an export, modules already done are skipped.
+    Duration and number of exported items of each module are added to the export report
     '''
     config.logging.info('{}Starting structure export to folder: {}{}'.format(config.BOLD, folder['fullPath'], config.END))
     startTime = time()
-    exportContentTypes(apiKey, token, region, folder)
-    exportGlobalFields(apiKey, token, region, folder)
-    exportExtensions(apiKey, token, region, folder)
-    exportWorkflows(apiKey, token, region, folder)
-    contentTypeUids = getContentTypeUids(folder) # Need to get all content types to fetch publishing rules
-    exportPublishingRules(contentTypeUids, apiKey, token, region, folder)
-    exportEnvironments(apiKey, token, region, folder)
-    exportDeliveryTokens(apiKey, token, region, folder)
-    exportRoles(apiKey, token, region, folder)
-    exportWebhooks(apiKey, token, region, folder)
-    exportLabels(apiKey, token, region, folder)
-    exportLanguages(apiKey, token, region, folder)
+
+    def exportModule(key):
+        unit = 'structure:' + key
+        if ledger.isDone(folder['fullPath'], unit):
+            config.logging.info('Already done, skipping: {}'.format(unit))
+            return None
+        if ledger.wasStarted(folder['fullPath'], unit): # Interrupted last time - Cleaning up what it left behind
+            config.clearFolder(folder['fullPath'] + config.folderNames[key])
+        return ledger.runUnit(folder['fullPath'], unit, structureModules[key][1], apiKey, token, region, folder)
+
+    graph = {key: dependencies for key, (dependencies, _) in structureModules.items()}
+    counts, durations = dependencyGraph.runGraph(graph, exportModule, config.structureExportWorkers, 'structureExport')
+    report = dict(config.exportReport(folder['fullPath']).get('structureExportModules') or {}) # Keeping the numbers of modules done before a resume
+    for key in structureModules:
+        if ledger.isDone(folder['fullPath'], 'structure:' + key) and counts.get(key) is None and key in report:
+            continue
+        count = counts.get(key)
+        report[key] = {
+            'seconds': round(durations.get(key, 0), 3),
+            'count': count if isinstance(count, int) and not isinstance(count, bool) else 0
+        }
+    config.addToExportReport('structureExportModules', report, folder['fullPath'])
     endTime = time()
     totalTime = endTime - startTime
+    config.addExportTiming('structure', totalTime, folder['fullPath'])
+    config.flushExportReport(folder['fullPath'])
     config.logging.info('{}Export finished in {} seconds{}'.format(config.BOLD, totalTime, config.END))
@@ -0,0 +1,332 @@
+'''
+Shared HTTP layer used by the cma and cda wrappers (and asset downloads).
+One pooled keep-alive requests.Session per host, so TCP/TLS handshakes are reused across calls.
+Every call passes through a per host rate limit governor (token bucket) that adapts to 429s and rate limit headers.
+Pool sizes and rate limits are set in the config module.
+'''
+import os
+import threading
+import random
+from uuid import uuid4
+from time import sleep, monotonic
+from urllib.parse import urlsplit
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+import config
+import jsonBackend
+
+sessions = {} # host -> requests.Session
+sessionLock = threading.Lock()
+buckets = {} # host -> token bucket for rate limited hosts
+bucketLock = threading.Lock()
+retryStatusCodes = (429, 502, 503, 504) # Rate limited, or temporary errors on Contentstack's side
+idempotentMethods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE') # Safe to send again. A POST (create) that timed out might have been done already
+
+def hostOf(url):
+    '''
+    Returns the host (netloc) of a URL, e.g. 'eu-api.contentstack.com'
+    '''
+    return urlsplit(url).netloc
+
+def getSession(url):
+    '''
+    Returns the pooled session for the host of the url - Creates one if not
+    '''
+    host = hostOf(url)
+    with sessionLock:
+        if host not in sessions:
+            config.logging.debug('Creating pooled HTTP session for host: {}'.format(host))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=config.httpPoolConnections, pool_maxsize=config.httpPoolSize, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            sessions[host] = session
+        return sessions[host]
+
+def getBucket(host):
+    '''
+    Returns the token bucket of a host, or None if the host is not rate limited (config.rateLimits)
+    Bucket rate starts at the documented rate and adapts from 429 responses and rate limit headers.
+    '''
+    limit = config.rateLimits.get(host)
+    if not limit:
+        return None
+    with bucketLock:
+        if host not in buckets:
+            buckets[host] = {
+                'maxRate': float(limit),
+                'rate': float(limit),
+                'tokens': 1.0,
+                'updated': monotonic(),
+                'pausedUntil': 0.0
+            }
+        return buckets[host]
+
+def acquire(bucket):
+    '''
+    Waits until the bucket has a token for us
+    '''
+    while True:
+        with bucketLock:
+            now = monotonic()
+            if now < bucket['pausedUntil']:
+                wait = bucket['pausedUntil'] - now
+            else:
+                capacity = max(1.0, bucket['rate'])
+                bucket['tokens'] = min(capacity, bucket['tokens'] + max(0.0, now - bucket['updated']) * bucket['rate'])
+                bucket['updated'] = now
+                if bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return True
+                wait = (1 - bucket['tokens']) / bucket['rate']
+        sleep(wait)
+
+def headerNumber(res, name):
+    try:
+        return float(res.headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def adapt(bucket, res):
+    '''
+    Adapting the rate of the bucket from the response
+    429 halves the rate and pauses the bucket, successful calls creep the rate back up to the maximum (AIMD).
+    '''
+    limit = headerNumber(res, 'X-RateLimit-Limit')
+    remaining = headerNumber(res, 'X-RateLimit-Remaining')
+    retryAfter = headerNumber(res, 'Retry-After')
+    with bucketLock:
+        now = monotonic()
+        if limit:
+            bucket['maxRate'] = limit
+            bucket['rate'] = min(bucket['rate'], limit)
+        if res.status_code == 429:
+            bucket['rate'] = max(config.minRateLimit, bucket['rate'] / 2)
+            bucket['tokens'] = 0.0
+            bucket['pausedUntil'] = max(bucket['pausedUntil'], now + (retryAfter or 1))
+            bucket['updated'] = bucket['pausedUntil']
+        else:
+            bucket['rate'] = min(bucket['maxRate'], bucket['rate'] + bucket['maxRate'] * 0.05)
+            if remaining is not None and remaining <= 0: # Used up the current window
+                bucket['tokens'] = 0.0
+                bucket['pausedUntil'] = max(bucket['pausedUntil'], now + 1)
+                bucket['updated'] = bucket['pausedUntil']
+
+def backoff(attempt, res=None):
+    '''
+    Jittered exponential backoff. Honouring the Retry-After header when we get one.
+    '''
+    if res is not None:
+        retryAfter = headerNumber(res, 'Retry-After')
+        if retryAfter:
+            return retryAfter
+    wait = min(config.backoffMax, config.backoffBase * (2 ** attempt))
+    return wait / 2 + random.uniform(0, wait / 2)
+
+def rewindBody(kwargs):
+    '''
+    File-like request bodies have been read when we retry - putting them back to the start
+    Returns False if that is not possible
+    '''
+    body = kwargs.get('data')
+    if body is not None and hasattr(body, 'read'):
+        if not hasattr(body, 'seek') or (hasattr(body, 'seekable') and not body.seekable()):
+            return False
+        body.seek(0)
+    return True
+
+def notSent(error):
+    '''
+    True if a connection error happened before the request was sent (connecting failed), so the server never saw it
+    '''
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason) # requests wraps the urllib3 MaxRetryError
+    return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError))
+
+def shouldRetry(method, status=None, error=None):
+    '''
+    GET, PUT and DELETE are retried on 429, temporary server errors and dropped connections.
+    Other methods (POST) only on 429 and on connection errors before the request was sent - Never creating things twice
+    '''
+    if method.upper() in idempotentMethods:
+        return error is not None or status in retryStatusCodes
+    if error is not None:
+        return notSent(error)
+    return status == 429
+
+def request(method, url, **kwargs):
+    '''
+    Every HTTP call to Contentstack goes through here
+    Waits for the rate limit governor and retries on 429, temporary server errors and dropped connections (see shouldRetry).
+    '''
+    host = hostOf(url)
+    bucket = getBucket(host)
+    if 'json' in kwargs: # Encoded once with the JSON backend and sent as bytes (also on retries)
+        kwargs['data'] = jsonBackend.dumps(kwargs.pop('json'))
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Type': 'application/json'})
+    attempt = 0
+    while True:
+        if bucket:
+            acquire(bucket)
+        try:
+            res = getSession(url).request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if not shouldRetry(method, error=e) or attempt >= config.maxRetries or not rewindBody(kwargs):
+                raise
+            wait = backoff(attempt)
+            config.logging.warning('{}Connection error ({}). Retrying in {:.1f} seconds.{}'.format(config.YELLOW, e, wait, config.END))
+        else:
+            if bucket:
+                adapt(bucket, res)
+            if not shouldRetry(method, res.status_code) or attempt >= config.maxRetries or not rewindBody(kwargs):
+                return res
+            wait = backoff(attempt, res)
+            res.close()
+            if res.status_code == 429:
+                config.logging.warning('{}We are getting rate limited. Retrying in {:.1f} seconds.{}'.format(config.YELLOW, wait, config.END))
+            else:
+                config.logging.warning('{}HTTP Status Code {} from {}. Retrying in {:.1f} seconds.{}'.format(config.YELLOW, res.status_code, host, wait, config.END))
+        sleep(wait)
+        attempt += 1
+
+class MultipartBody:
+    '''
+    multipart/form-data request body streamed from disk (or from another stream), never fully held in memory.
+    Has a length, so it is sent with a Content-Length header and not chunked.
+    source is a file path (seekable - can be retried) or a readable stream with a known length, e.g. a download being piped through (not seekable).
+    Usage: httpClient.post(url, data=body, headers={'Content-Type': body.contentType, ...})
+    '''
+    def __init__(self, fields, fileField, fileName, fileContentType, source, length=None):
+        self.boundary = uuid4().hex
+        self.contentType = 'multipart/form-data; boundary=' + self.boundary
+        preamble = b''
+        for name, value in fields:
+            preamble += self.partHeader(name) + b'\r\n' + str(value).encode('utf-8') + b'\r\n'
+        preamble += self.partHeader(fileField, fileName, fileContentType)
+        self.path = None
+        self.stream = None
+        if isinstance(source, str):
+            self.path = source
+            length = os.path.getsize(source)
+        else:
+            self.stream = source
+        self.segments = [preamble, (length,), b'\r\n--' + self.boundary.encode() + b'--\r\n']
+        self.length = len(preamble) + length + len(self.segments[2])
+        self.position = 0
+        self.segment = 0
+        self.offset = 0
+
+    def partHeader(self, name, fileName=None, contentType=None):
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(self.boundary, name)
+        if fileName is not None:
+            header += '; filename="{}"\r\nContent-Type: {}'.format(fileName.replace('"', '%22'), contentType or 'application/octet-stream')
+        return (header + '\r\n').encode('utf-8')
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(config.downloadChunkSize)
+            if not chunk:
+                return
+            yield chunk
+
+    def openFile(self):
+        if self.stream is None:
+            self.stream = open(self.path, 'rb')
+        return self.stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        out = b''
+        while len(out) < size and self.segment < len(self.segments):
+            segment = self.segments[self.segment]
+            if isinstance(segment, bytes):
+                chunk = segment[self.offset:self.offset + size - len(out)]
+            else:
+                chunk = self.openFile().read(min(size - len(out), segment[0] - self.offset))
+                if not chunk and self.offset < segment[0]:
+                    raise IOError('Stream ended before the expected length ({} of {} bytes)'.format(self.offset, segment[0]))
+            out += chunk
+            self.offset += len(chunk)
+            if self.offset >= (len(segment) if isinstance(segment, bytes) else segment[0]):
+                self.segment += 1
+                self.offset = 0
+        self.position += len(out)
+        return out
+
+    def seekable(self):
+        return self.path is not None
+
+    def seek(self, offset, whence=0):
+        if (offset, whence) != (0, 0) or not self.seekable():
+            raise IOError('MultipartBody can only be rewound to the start, and only when streamed from a file')
+        if self.stream:
+            self.stream.seek(0)
+        self.position = self.segment = self.offset = 0
+        return 0
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self.path and self.stream:
+            self.stream.close()
+            self.stream = None
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+def connectionStats():
+    '''
+    Per host counters of connections opened versus requests sent on reused (keep-alive) connections
+    Read from the urllib3 connection pools behind each session.
+    '''
+    stats = {}
+    with sessionLock:
+        for host, session in sessions.items():
+            opened = sent = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool:
+                        opened += pool.num_connections
+                        sent += pool.num_requests
+            stats[host] = {
+                'requests': sent,
+                'connectionsOpened': opened,
+                'connectionsReused': max(sent - opened, 0)
+            }
+    return stats
+
+def logConnectionStats():
+    '''
+    Logging out the connection counters for every host we talked to
+    '''
+    for host, value in connectionStats().items():
+        config.logging.info('{}HTTP {}: {} requests, {} connections opened, {} reused{}'.format(config.CYAN, host, value['requests'], value['connectionsOpened'], value['connectionsReused'], config.END))
+    return True
+
+def closeSessions():
+    '''
+    Closing all pooled connections
+    '''
+    with sessionLock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
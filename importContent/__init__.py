@@ -5,15 +5,19 @@ oskar.eiriksson@contentstack.com
 Imports stack content from chosen local folder.
 '''
 import os
+import shutil
 from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor
 import re
-import ast
-from benedict import benedict
 import inquirer
 import cma
 import config
+import httpClient
 import exportStructure
 import importStructure
+import entryReferences
+import dependencyGraph
+import entryStore
 
 def readExportReport(folder):
     '''
@@ -25,6 +29,9 @@ def readExportReport(folder):
         config.logging.error('{}Unable to read Export Report ({}) Not possible to Import Content from this Export Folder.{}'.format(config.RED, exportReport, config.END))
         return None
     exportReport = config.readFromJsonFile(exportReport)
+    if exportReport:
+        storage = exportReport.get('entryStorage') or {'format': 'json', 'version': entryStore.legacyVersion}
+        config.logging.info('Entry storage format in export: {} (version {})'.format(storage['format'], storage['version']))
     return exportReport
 
 def findImportContent(organizations, token, region):
@@ -178,69 +185,106 @@ def importAllOrSomething():
         return 'HANDPICK'
     return None
 
+def pipeAsset(region, authToken, apiKey, metaData):
+    '''
+    Piping the asset file from the export stack straight into the upload, without writing it to disk first.
+    Only possible when the download has a known length and is not compressed.
+    Returns None if that is not possible, or it failed (the upload can not be retried - the download is not seekable)
+    '''
+    try:
+        res = httpClient.get(metaData['asset']['url'], stream=True)
+    except IOError as e:
+        config.logging.debug('Unable to pipe asset {}: {}'.format(metaData['asset']['url'], e))
+        return None
+    with res:
+        if res.status_code != 200 or 'Content-Length' not in res.headers or res.headers.get('Content-Encoding', 'identity') != 'identity':
+            return None
+        try:
+            return cma.createAsset(region, authToken, apiKey, res.raw, metaData, metaData['asset']['filename'], int(res.headers['Content-Length']))
+        except IOError as e:
+            config.logging.debug('Unable to pipe asset {}: {}'.format(metaData['asset']['url'], e))
+            return None
+
 def importAnAsset(region, authToken, apiKey, metaData, assetFile, folderMapper): #(region, apiKey, publishDetails, metaData, assetFile)
     '''
     Create Asset in Import Stack
     region is full URL
     publishDetails, metaData and assetFile are just the fullpath to the json file OR None
     folderMapper is a dict object
+    Without an asset file, it is piped from the export stack (config.pipeAssetUploads), or downloaded to a tmp folder first
     '''
-    tmpFolder = '.tmp/'
     if metaData:
         metaData = config.readFromJsonFile(metaData)
     if folderMapper and metaData:
         metaData = importStructure.replaceFromMapper(folderMapper, metaData, 'assets')
+    tmpFolder = None
     if not assetFile:
+        if config.pipeAssetUploads:
+            create = pipeAsset(region, authToken, apiKey, metaData)
+            if create:
+                return create
+        tmpFolder = '.tmp/' + metaData['asset']['uid'] + '/' # One folder per asset - Assets are imported concurrently
         config.checkDir(tmpFolder)
-        assetFile = config.downloadFileToDisk(metaData['asset']['url'], tmpFolder, metaData['asset']['filename'])
-        if assetFile:
-            assetFile = tmpFolder + metaData['asset']['filename']
+        if not config.downloadFileToDisk(metaData['asset']['url'], tmpFolder, metaData['asset']['filename']):
+            return None
+        assetFile = tmpFolder + metaData['asset']['filename']
     config.logging.debug('Region {}'.format(region))
-    config.logging.debug('authToken {}'.format(authToken))
     config.logging.debug('apiKey {}'.format(apiKey))
     config.logging.debug('assetFile {}'.format(assetFile))
     config.logging.debug('metaData {}'.format(metaData))
     config.logging.debug('Filename {}'.format(metaData['asset']['filename']))
     create = cma.createAsset(region, authToken, apiKey, assetFile, metaData, metaData['asset']['filename'])
-    if create and (tmpFolder in assetFile): # Cleaning from tmp folder
-        os.remove(assetFile)
+    if create and tmpFolder: # Cleaning from tmp folder
+        shutil.rmtree(tmpFolder, ignore_errors=True)
     return create
 
-def importFolders(folder, apiKey, token, region):
+def importFolders(folder, apiKey, token, region, mapDict=None):
     '''
     Creating folders
+    Level by level down the folder tree - All folders of one level are created concurrently (config.folderWorkers).
+    Folders whose parent is not in the export (orphans) are created at the root. Folders in parent cycles can not be created.
+    mapDict: Folders already imported (when resuming an import) - Those are skipped
     '''
     folderFile = folder + config.folderNames['assets'] + 'folders.json'
     if os.path.isfile(folderFile):
-        mapDict = {}
+        mapDict = dict(mapDict or {})
         folderData = config.readFromJsonFile(folderFile)
         config.logging.info('Found Folders in Export')
-        folderExport = folderData['assets']
-        maxTries = len(folderExport) * 5
-        tryNo = 0
-        while folderExport and tryNo <= maxTries:
-            tryNo += 1
-            if tryNo == maxTries:
-                config.logging.warning('{}Last possible try importing folders! (Try number: {}){}'.format(config.YELLOW, tryNo, config.END))
-            if 'parent_uid' in folderExport[0]:
-                parentUid = folderExport[0]['parent_uid']
+        folders = {f['uid']: f for f in folderData['assets']}
+        graph = {uid: [f['parent_uid']] if f.get('parent_uid') else [] for uid, f in folders.items()}
+        levels, cycles = dependencyGraph.levels(graph)
+        orphans = [uid for uid, f in folders.items() if f.get('parent_uid') and f['parent_uid'] not in folders and f['parent_uid'] not in mapDict]
+        if orphans:
+            config.logging.warning('{}{} Folders have a parent folder that is not in the export. They will be created at the root: {}{}'.format(config.YELLOW, len(orphans), [folders[uid]['name'] for uid in orphans], config.END))
+        skip = set(uid for cycle in cycles for uid in cycle)
+        if skip:
+            config.logging.error('{}{} Folders are in parent cycles and can not be imported: {}{}'.format(config.RED, len(skip), [folders[uid]['name'] for uid in skip], config.END))
+        journal = importStructure.openJournal(apiKey, folder.split('/')[-2], 'folders')
+
+        def createFolder(uid):
+            parentUid = folders[uid].get('parent_uid')
+            if parentUid in folders:
+                if parentUid not in mapDict:
+                    config.logging.error('{}Unable to import folder {} - Parent folder was not imported{}'.format(config.RED, folders[uid]['name'], config.END))
+                    return None
+                parentUid = mapDict[parentUid]
+            elif parentUid in mapDict:
+                parentUid = mapDict[parentUid]
             else:
                 parentUid = None
-            if parentUid:
-                if parentUid not in mapDict:
-                    folderExport.append(folderExport[0])
-                    folderExport.pop(0)
-                    continue
-                else:
-                    parentUid = mapDict[parentUid]
-            importedFolder = cma.createFolder(apiKey, token, region, folderExport[0]['name'], parentUid)
+            importedFolder = cma.createFolder(apiKey, token, region, folders[uid]['name'], parentUid)
             if importedFolder:
                 config.logging.info('Folder Imported: {}'.format(importedFolder['asset']['name']))
-                mapDict = importStructure.addToMapper(mapDict, folderExport[0]['uid'], importedFolder['asset']['uid'])
-                folderExport.pop(0)
-                continue
-            folderExport.append(folderExport[0])
-            folderExport.pop(0)
+                importStructure.addToMapper(mapDict, uid, importedFolder['asset']['uid'], journal)
+            return importedFolder
+
+        with ThreadPoolExecutor(max_workers=config.folderWorkers, thread_name_prefix='folderImport') as executor:
+            for number, level in enumerate(levels):
+                level = [uid for uid in level if uid not in mapDict and uid not in skip]
+                if level:
+                    config.logging.info('Importing {} Folders at depth {}'.format(len(level), number))
+                    list(executor.map(createFolder, level))
+        journal.close()
         return importStructure.createMapperFile(apiKey, folder.split('/')[-2], mapDict, 'folders')
     config.logging.info('No Folders Found in Export')
     return None
@@ -251,6 +295,8 @@ def findAssetFiles(assetFolder):
     metaData = None
     assetFile = None
     for f in os.listdir(assetFolder):
+        if f.endswith('.part'): # Unfinished download or metadata write
+            continue
         if f == 'publishDetails.json':
             config.logging.info('Found Publishing Information for Asset')
             publishDetails = assetFolder + f
@@ -262,164 +308,225 @@ def findAssetFiles(assetFolder):
             assetFile = assetFolder + f
     return publishDetails, assetFile, metaData
 
-def importAssets(token, importedStack, folder, exportReport, localAssets, region):
+def importAssets(token, importedStack, folder, exportReport, localAssets, region, mappers=None):
     '''
     Importing Assets
+    mappers: Folders and assets already imported (when resuming an import) - Those are skipped
     '''
+    mappers = mappers or {}
     apiKey = importedStack['uid']
     config.logging.info('Importing All Assets')
     if not localAssets:
         config.logging.info('Assets not present locally - we will need to fetch them from the export stack.')
     '''
     Importing Folders
-    buggy! fix it!
     '''
-    folderMapper = importFolders(folder, apiKey, token, region)
+    folderMapper = importFolders(folder, apiKey, token, region, mappers.get('folders'))
     '''
     Importing Assets
     '''
-    mapDict = {}
+    mapDict = dict(mappers.get('assets') or {})
+    if mapDict:
+        config.logging.info('Skipping {} Assets already imported'.format(len(mapDict)))
+    journal = importStructure.openJournal(apiKey, folder.split('/')[-2], 'assets')
+    assetFolders = []
     for assetFolder in os.listdir(folder + config.folderNames['assets']): # Finding all asset folders
+        if assetFolder in mapDict:
+            continue
         assetFolder = folder + config.folderNames['assets'] + assetFolder + '/'
         if os.path.isdir(assetFolder): # Finding all folders in the asset folder (we also potentially have folders.json there)
-            publishDetails, assetFile, metaData = findAssetFiles(assetFolder)
-            if metaData:
-                importedAsset = importAnAsset(region, token, apiKey, metaData, assetFile, folderMapper)
-                if importedAsset:
-                    importStructure.addToMapper(mapDict, metaData.split('/')[-2], importedAsset['asset']['uid'])
+            assetFolders.append(assetFolder)
+
+    def uploadAsset(assetFolder):
+        publishDetails, assetFile, metaData = findAssetFiles(assetFolder)
+        if metaData:
+            importedAsset = importAnAsset(region, token, apiKey, metaData, assetFile, folderMapper)
+            if importedAsset:
+                importStructure.addToMapper(mapDict, metaData.split('/')[-2], importedAsset['asset']['uid'], journal)
+
+    config.logging.info('Uploading {} Assets'.format(len(assetFolders)))
+    with ThreadPoolExecutor(max_workers=config.uploadWorkers, thread_name_prefix='assetUpload') as executor: # Rate limit is shared (httpClient)
+        list(executor.map(uploadAsset, assetFolders))
+    journal.close()
     return importStructure.createMapperFile(apiKey, folder.split('/')[-2], mapDict, 'assets')
 
-def replaceAssetStrInDict(d, search, value):
-    string = str(search)
-    dString = str(d)
-    dString = dString.replace(string, "'" + value + "'")
-    return ast.literal_eval(dString) # Converting the string back to a dictionary
-
-def replaceReferenceStrInDict(entry, search, importUid):
-    string = str(search)
-    contentType = search['_content_type_uid']
-    dString = str(entry)
-    dString = dString.replace(string, "{'uid': '" + importUid + "', '_content_type_uid': '" + contentType + "'}")
-    return ast.literal_eval(dString) # Converting the string back to a dictionary
-
-
-def replaceAssetFromMapper(d, mapper, msg=''):
-    '''
-    Using benedict to replace old asset uids with new
-    '''
-    config.logging.debug('Running Asset Mapper on {} export'.format(msg))
-    bDict = benedict(d)
-    keys = bDict.keypaths(indexes=True)
-    for key, value in mapper.items():
-        search = bDict.search(key, in_keys=False, in_values=True, exact=True, case_sensitive=True)
-        while search:
-            for k in keys:
-                if bDict[k] == search[0][0]:
-                    d = replaceAssetStrInDict(d, bDict[k], value)
-            search.pop(0)
-    return d
-
-def replaceEntryReference(entry, exportUid, importUid, updateContentstack=False):
-    '''
-    Replacing old uid with new uid in reference
-    '''
-    bDict = benedict(entry)
-    keys = bDict.keypaths(indexes=True)
-    search = bDict.search(exportUid, in_keys=False, in_values=True, exact=True, case_sensitive=True)
-    if search:
-        config.logging.debug('{}UPDATE NEEDED!{}'.format(config.BOLD, config.END))
-        updateContentstack = True
-    while search:
-        for k in keys:
-            if bDict[k] == search[0][0]:
-                entry = replaceReferenceStrInDict(entry, bDict[k], importUid)
-        search.pop(0)
-    return entry, updateContentstack
-
-def fixAssetReferences(entry, assetMapper):
-    '''
-    replace asset fields with only their uid
-    '''
-    bDict = benedict(entry)
-    keys = bDict.keypaths(indexes=True)
-    search = bDict.search('content_type', in_keys=True, in_values=False, exact=True, case_sensitive=True)
-    for found in search:
-        for key in keys:
-            try:
-                if found[0] == bDict[key]:
-                    if ('uid' in bDict[key]) and ('file_size' in bDict[key]) and ('filename' in bDict[key]) and ('created_at' in bDict[key]):
-                        uid = assetMapper[bDict[key + '.uid']]
-                        bDict[key] = uid
-                        break
-            except KeyError:
-                pass
-    entry = dict(bDict)
-    return entry
-
-def updateReferences(contentTypes, mapDict, languages, folder, region, token, apiKey, assetMapper):
-    '''
-    Iterating through all the entries and fixing references.
-    ToDo: I should do this when creating entries (in the first iteration). This was quicker coding for POC.
+def updateReferences(contentTypes, mapDict, languages, folder, region, token, apiKey, assetMapper, rewriters=None, referenceIndex=None):
+    '''
+    Fixing references of imported entries, now that all entries have import uids.
+    Only entries with references to imported entries are rewritten and updated, found in the reference index
+    (entryReferences.addToIndex - from the import plan, or built here in a single pass over the entry files).
+    rewriters: Compiled reference fields by content type (see entryReferences.compileContentTypes)
     '''
     config.logging.info('{}Updating entries references with correct uids{}'.format(config.BOLD, config.END))
     entryFolder = folder + config.folderNames['entries']
+    if rewriters is None:
+        rewriters = entryReferences.compileContentTypes(folder)
+    if referenceIndex is None:
+        referenceIndex = entryReferences.buildIndex(folder, contentTypes, languages, rewriters)
+    for (contentType, language), indexed in referenceIndex.items():
+        toUpdate = set(uid for uid, references in indexed.items() if not references.isdisjoint(mapDict))
+        if not toUpdate:
+            continue
+        config.logging.info('{} Entries need reference updates - {} {}'.format(len(toUpdate), contentType, language))
+        for entry in entryStore.readEntriesOf(entryFolder, contentType, language):
+            if entry['uid'] not in toUpdate or entry['locale'] != language:
+                continue
+            uid = mapDict.get(entry['uid'])
+            if not uid:
+                config.logging.error('{}Unable to update entry - Entry not found in import - From Export: {}{}'.format(config.RED, entry['uid'], config.END))
+                continue
+            entry, _ = entryReferences.rewriteEntry(entry, rewriters.get(contentType, []), assetMapper, mapDict)
+            update = cma.updateEntry(apiKey, token, entry, region, contentType, language, uid)
+            if update:
+                config.logging.info('Updated References - {} {} {}'.format(contentType, language, uid))
+            else:
+                config.logging.error('{}Unable to Update Entry - {} {} {}{}'.format(config.RED, contentType, language, uid, config.END))
+
+def planEntryImport(contentTypes, languages, folder, rewriters):
+    '''
+    Import planner. Reading the exported entries once and building the entry reference graph from them.
+    An entry is created in the first language it is found in (master locale first, see sortLanguages). Other languages are localizations.
+    Only uids are kept in the plan - The entries themselves are read again from the entry files when they are imported.
+    Returns the plan:
+    {
+        'creates': {uid: (contentType, language)},
+        'localizations': {(contentType, language): set of entry uids},
+        'references': {(contentType, language): {uid: set of referenced entry uids}},
+        'order': groups of (contentType, language) entry files to create entries from, groups with referenced entries first.
+                 Files referencing each other (e.g. a content type referencing itself) are in the same group,
+        'cycles': reference cycles (lists of entry uids),
+        'cycleOf': {uid: number of its reference cycle}
+    }
+    '''
+    entryFolder = folder + config.folderNames['entries']
+    plan = {'creates': {}, 'localizations': {}, 'references': {}}
     for contentType in contentTypes:
-        ctFolder = entryFolder + contentType + '/'
+        fields = rewriters.get(contentType, [])
         for language in languages:
-            languageFile = ctFolder + language + '.json'
-            if os.path.isfile(languageFile):
-                entries = config.readFromJsonFile(languageFile)
-                for entry in entries['entries']:
-                    try:
-                        uid = mapDict[entry['uid']]
-                    except KeyError:
-                        config.logging.error('{}Unable to update entry - Entry not found in import - From Export: {}{}'.format(config.RED, entry['uid'], config.END))
-                        uid = None
-                        continue
-                    if entry['locale'] == language:
-                        updateContentstack = False
-                        for exportUid, importUid in mapDict.items():
-                            entry['uid'] = '' # Just replacing uid to prevent it to be found in the search ref function
-                            entry, updateContentstack = replaceEntryReference(entry, exportUid, importUid, updateContentstack)
-                        if updateContentstack:
-                            entry = fixAssetReferences(entry, assetMapper)
-                            update = cma.updateEntry(apiKey, token, entry, region, contentType, language, uid)
-                            if update:
-                                config.logging.info('Updated References - {} {} {}'.format(contentType, language, uid))
-                            else:
-                                config.logging.error('{}Unable to Update Entry - {} {} {}{}'.format(config.RED, contentType, language, uid, config.END))
-
-def importEntries(contentTypes, languages, folder, region, token, apiKey, assetMapper=None):
+            languageFile = entryStore.findEntryFile(entryFolder, contentType, language)
+            if not languageFile:
+                config.logging.debug('No entries in language: {} - {}'.format(contentType, language))
+                continue
+            for entry in entryStore.readEntries(languageFile):
+                if entry['locale'] != language: # Fallback language - Not a localization of its own
+                    continue
+                entryReferences.addToIndex(plan['references'], contentType, language, entry, fields)
+                if entry['uid'] in plan['creates']:
+                    plan['localizations'].setdefault((contentType, language), set()).add(entry['uid'])
+                else:
+                    plan['creates'][entry['uid']] = (contentType, language)
+    graph = {uid: set() for uid in plan['creates']}
+    fileGraph = {unit: set() for unit in plan['creates'].values()}
+    for unit, indexed in plan['references'].items():
+        for uid, references in indexed.items():
+            graph[uid].update(references)
+            if plan['creates'][uid] == unit:
+                fileGraph[unit].update(plan['creates'][r] for r in references if r in plan['creates'])
+    _, plan['cycles'] = dependencyGraph.topologicalOrder(graph)
+    plan['cycleOf'] = {uid: number for number, cycle in enumerate(plan['cycles']) for uid in cycle}
+    plan['order'] = dependencyGraph.stronglyConnectedComponents(fileGraph)
+    config.logging.info('{}Import plan: {} Entries, {} Localizations. {} Entries in {} reference cycles{}'.format(config.BOLD, len(plan['creates']), sum(len(uids) for uids in plan['localizations'].values()), sum(len(c) for c in plan['cycles']), len(plan['cycles']), config.END))
+    return plan
+
+def entriesInReferenceOrder(entryFolder, plan, group, handled):
+    '''
+    Generator yielding (unit, entry) for the entries to create from a group of entry files (see planEntryImport), as the files are read.
+    An entry referencing entries of the group that are not handled yet is held back until they are, so entries come in reference order.
+    References within the entry's own reference cycle are not waited for. Only the entries held back are kept in memory.
+    handled: Set of entry uids created (or attempted) - Uids are added once the caller has handled the entry yielded
+    '''
+    units = set(group)
+    cycleOf = plan['cycleOf']
+    waiting = {} # uid -> (unit, entry)
+    blockers = {} # uid -> uids it waits for
+    dependents = {} # uid -> uids waiting for it
+    for contentType, language in group:
+        for entry in entryStore.readEntriesOf(entryFolder, contentType, language): # One entry at a time, in the order of the file
+            uid = entry['uid']
+            unit = (contentType, language)
+            if entry['locale'] != language or plan['creates'].get(uid) != unit:
+                continue
+            if uid not in handled:
+                references = plan['references'].get(unit, {}).get(uid, ())
+                blocking = set(r for r in references if plan['creates'].get(r) in units and r not in handled and (uid not in cycleOf or cycleOf.get(r) != cycleOf[uid]))
+                if blocking:
+                    waiting[uid] = (unit, entry)
+                    blockers[uid] = blocking
+                    for r in blocking:
+                        dependents.setdefault(r, set()).add(uid)
+                    continue
+            ready = [(unit, entry)]
+            while ready:
+                readyUnit, readyEntry = ready.pop()
+                yield readyUnit, readyEntry
+                handled.add(readyEntry['uid'])
+                for dependent in dependents.pop(readyEntry['uid'], ()):
+                    blockers[dependent].discard(readyEntry['uid'])
+                    if not blockers[dependent]:
+                        del blockers[dependent]
+                        ready.append(waiting.pop(dependent))
+    for unit, entry in list(waiting.values()): # Waiting for entries that were not in the files - Created with the references fixed later
+        yield unit, entry
+        handled.add(entry['uid'])
+
+def importEntries(contentTypes, languages, folder, region, token, apiKey, assetMapper=None, mappers=None):
     '''
     Importing Entries
-    '''
+    Entries are created in reference order (see planEntryImport and entriesInReferenceOrder), so references are correct on create.
+    Then localizations are imported, when all entries exist. Only entries created before an entry they reference (reference cycles)
+    are updated after that.
+    mappers: Entries and entry localizations already imported (when resuming an import) - Those are skipped
+    Every created entry and localization is written to a mapper journal right away
+    '''
+    mappers = mappers or {}
+    mapDict = dict(mappers.get('entries') or {})
+    localized = dict(mappers.get('entryLocalizations') or {}) # '<export uid>:<language>' -> import uid
+    if localized:
+        config.logging.info('Skipping {} Entries/Localizations already imported'.format(len(localized)))
     entryFolder = folder + config.folderNames['entries']
-    mapDict = {}
-    for contentType in contentTypes:
-        ctFolder = entryFolder + contentType + '/'
-        config.logging.info('{}Importing Entries of type: {}{}'.format(config.BOLD, contentType, config.END))
-        for language in languages:
-            languageFile = ctFolder + language + '.json'
-            if os.path.isfile(languageFile):
-                config.logging.info('{}Importing Entries in Language: {}{}'.format(config.BOLD, language, config.END))
-                entries = config.readFromJsonFile(languageFile)
-                for entry in entries['entries']:
-                    if (entry['uid'] not in mapDict) and (entry['locale'] == language):
-                        if assetMapper:
-                            entry = replaceAssetFromMapper(entry, assetMapper, 'entry assets')
-                        create = cma.createEntry(apiKey, token, entry, region, contentType, language)
-                        if create:
-                            config.logging.info('Entry Created - Title: {} - Language: {}'.format(create['entry']['title'], language))
-                            mapDict = importStructure.addToMapper(mapDict, entry['uid'], create['entry']['uid'])
-                    elif (entry['uid'] in mapDict) and (entry['locale'] == language):
-                        if assetMapper:
-                            entry = replaceAssetFromMapper(entry, assetMapper, 'entry assets')#importStructure.replaceFromMapper(assetMapper, entries, 'entries')
-                        update = cma.updateEntry(apiKey, token, entry, region, contentType, language, mapDict[entry['uid']])
-                        if update:
-                            config.logging.debug('Entry Updated - Title: {} - Language: {}'.format(update['entry']['title'], language))
-            else:
-                config.logging.debug('No entries in language: {}'.format(language))
-    updateReferences(contentTypes, mapDict, languages, folder, region, token, apiKey, assetMapper)
+    rewriters = entryReferences.compileContentTypes(folder) # Compiled once - Used to rewrite references of every entry
+    plan = planEntryImport(contentTypes, languages, folder, rewriters)
+    fixUps = {} # Entries created with references to entries not created yet. Same format as the reference index
+    journal = importStructure.openJournal(apiKey, folder.split('/')[-2], 'entries')
+    localizationJournal = importStructure.openJournal(apiKey, folder.split('/')[-2], 'entryLocalizations')
+    handled = set(mapDict)
+    for group in plan['order']:
+        for (contentType, language), entry in entriesInReferenceOrder(entryFolder, plan, group, handled):
+            uid = entry['uid']
+            references = plan['references'].get((contentType, language), {}).get(uid)
+            if uid in mapDict: # Created in a previous run - References might not have been fixed
+                if references:
+                    fixUps.setdefault((contentType, language), {})[uid] = references
+                continue
+            unresolved = references and any((r in plan['creates']) and (r not in mapDict) for r in references)
+            entry, _ = entryReferences.rewriteEntry(entry, rewriters.get(contentType, []), assetMapper, mapDict)
+            create = cma.createEntry(apiKey, token, entry, region, contentType, language)
+            if create:
+                config.logging.info('Entry Created - Title: {} - Language: {}'.format(create['entry']['title'], language))
+                mapDict = importStructure.addToMapper(mapDict, uid, create['entry']['uid'], journal)
+                importStructure.addToMapper(localized, uid + ':' + language, create['entry']['uid'], localizationJournal)
+                if unresolved:
+                    fixUps.setdefault((contentType, language), {})[uid] = references
+    for (contentType, language), uids in plan['localizations'].items():
+        for entry in entryStore.readEntriesOf(entryFolder, contentType, language):
+            if entry['locale'] != language or entry['uid'] not in uids:
+                continue
+            localizationKey = entry['uid'] + ':' + language
+            if localizationKey in localized:
+                continue
+            if entry['uid'] not in mapDict:
+                config.logging.error('{}Unable to import localization - Entry not found in import - From Export: {} ({}){}'.format(config.RED, entry['uid'], language, config.END))
+                continue
+            entry, _ = entryReferences.rewriteEntry(entry, rewriters.get(contentType, []), assetMapper, mapDict)
+            update = cma.updateEntry(apiKey, token, entry, region, contentType, language, mapDict[entry['uid']])
+            if update:
+                config.logging.debug('Entry Updated - Title: {} - Language: {}'.format(update['entry']['title'], language))
+                importStructure.addToMapper(localized, localizationKey, mapDict[entry['uid']], localizationJournal)
+    journal.close()
+    localizationJournal.close()
+    if fixUps:
+        config.logging.info('{}{} Entries were created before entries they reference (reference cycles){}'.format(config.BOLD, sum(len(v) for v in fixUps.values()), config.END))
+        updateReferences(contentTypes, mapDict, languages, folder, region, token, apiKey, assetMapper, rewriters, fixUps)
     return importStructure.createMapperFile(apiKey, folder.split('/')[-2], mapDict, 'entries')
 
 
@@ -440,6 +547,28 @@ def sortLanguages(languages, masterLocale):
 
 
 
+importJournals = ['folders', 'assets', 'entries', 'entryLocalizations'] # Mappers persisted while importing content
+
+def defineImportResume(apiKey, folder):
+    '''
+    Finding what a previous (interrupted) import of this export to the same stack already created.
+    The user can resume it - skipping everything already imported - or start over.
+    Returns the mappers to resume from (empty when starting over)
+    '''
+    exportName = folder.split('/')[-2]
+    mappers = {}
+    for name in importJournals:
+        mappers[name] = importStructure.readJournal(apiKey, exportName, name)
+    if not any(mappers.values()):
+        return mappers
+    config.logging.info('{}Found a previous import of this export to this stack. Already imported: {} Folders, {} Assets and {} Entries{}'.format(config.BOLD, len(mappers['folders']), len(mappers['assets']), len(mappers['entries']), config.END))
+    choice = inquirer.list_input("{}Do you want to resume that import, or start over?{}".format(config.BOLD, config.END), choices=['Resume Import (Skip what is already imported)', 'Start Over (Already imported content will be duplicated)'])
+    if 'Resume' in choice:
+        return mappers
+    for name in importJournals:
+        importStructure.resetJournal(apiKey, exportName, name)
+    return {name: {} for name in importJournals}
+
 def whatToImport(token, folder, importedStack, exportReport, region):
     '''
     Define what to Import
@@ -465,15 +594,16 @@ def whatToImport(token, folder, importedStack, exportReport, region):
             return None
     else: # importAll = ALL
         config.logging.info('{}Importing All Content Available{}'.format(config.BOLD, config.END))
+        mappers = defineImportResume(apiKey, folder)
         assetMapper = None
         if assetNumbers:
-            assetMapper = importAssets(token, importedStack, folder, exportReport, localAssets, region)
+            assetMapper = importAssets(token, importedStack, folder, exportReport, localAssets, region, mappers)
         else:
             config.logging.info('No Assets Available for Import')
         if assetMapper:
             config.logging.info('{}Assets Import Finished{}'.format(config.BOLD, config.END))
         languages = sortLanguages(languages, importedStack['masterLocale'])
-        importEntries(contentTypes, languages, folder, region, token, apiKey, assetMapper)
+        importEntries(contentTypes, languages, folder, region, token, apiKey, assetMapper, mappers)
     endTime = time()
     totalTime = endTime - startTime
     config.logging.info('{}Import Content finished in {} seconds{}'.format(config.BOLD, totalTime, config.END))
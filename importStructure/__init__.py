@@ -7,11 +7,17 @@ Imports stack structure from chosen local folder.
 See Readme for details.
 '''
 import os
+import json
+import re
+import threading
 from time import sleep, time
-import ast
+from concurrent.futures import ThreadPoolExecutor
 import inquirer
 import cma
 import config
+import dependencyGraph
+
+mapperLock = threading.Lock() # Mappers are added to from concurrent imports (e.g. assets)
 
 def noEmptyStr(_, current):
     '''
@@ -22,39 +28,136 @@ def noEmptyStr(_, current):
         return True
     return False
 
+def importConcurrently(function, items):
+    '''
+    Running function(item) for every item of a module on a bounded pool - For items that do not depend on each other
+    '''
+    with ThreadPoolExecutor(max_workers=config.structureImportWorkers, thread_name_prefix='structureItem') as executor:
+        return list(executor.map(function, items))
+
+uidToken = re.compile(r'[\w\-]+') # Uids, locale codes, ... Only whole tokens are replaced, never parts of a word
+
+def compileMapper(*mappers):
+    '''
+    Merging uid mappers (format: exportedUid: importedUid) into a single lookup table
+    Compile once and substitute many documents with it
+    '''
+    mappers = [mapper for mapper in mappers if mapper]
+    if len(mappers) == 1:
+        return mappers[0]
+    table = {}
+    for mapper in mappers:
+        table.update(mapper)
+    return table
+
+def substituteString(value, table):
+    '''
+    Most strings holding a uid are just the uid. Otherwise (e.g. urls, paths) every token is looked up
+    '''
+    if value in table:
+        return table[value]
+    return uidToken.sub(lambda match: table.get(match.group(0), match.group(0)), value)
+
+def substituteUids(document, table):
+    '''
+    Replacing every exported uid in a parsed document (dicts, lists, strings) with its imported uid - keys and values
+    A single pass over the document with dict lookups. Returns a new document
+    '''
+    if not table:
+        return document
+    if isinstance(document, dict):
+        return {(substituteString(key, table) if isinstance(key, str) else key): substituteUids(value, table) for key, value in document.items()}
+    if isinstance(document, list):
+        return [substituteUids(value, table) for value in document]
+    if isinstance(document, str):
+        return substituteString(document, table)
+    return document
+
 def replaceFromMapper(mapper, exportedJson, msg=''):
     '''
     Finding all uids in the export that have new uids in the import
     replacing the uid with correct one reading the dictionary with all the mapping (format: exportedUid: importedUid)
     --> Extensions get a new uid when created on a new stack
     '''
-    exportString = str(exportedJson)
-    config.logging.info('Running mapper on {} export'.format(msg))
-    for key, value in mapper.items():
-        exportString = exportString.replace(key, value)
-    importedDict = ast.literal_eval(exportString)
-    config.logging.info('Finished running mapper on {} export'.format(msg))
-    return importedDict
+    config.logging.debug('Running mapper on {} export'.format(msg))
+    return substituteUids(exportedJson, compileMapper(mapper))
 
-def createMapperFile(apiKey, folder, mapDict, mapperName=''):
+def defineMapperFolder(apiKey, folder):
     '''
-    Reusable function that creates the mapper file between exported and imported uids
+    The folder where mappers of an import job are stored (one job per import stack and export folder)
     '''
-    config.logging.info('Writing {} mapper to file'.format(mapperName))
     mapperFolder = config.dataRootFolder + config.stackRootFolder + config.mapperFolder + 'MAPPER_ImportTo-' + apiKey + '_ExportFrom-' + folder
     config.checkDir(config.dataRootFolder)
     config.checkDir(config.dataRootFolder + config.stackRootFolder)
     config.checkDir(config.dataRootFolder + config.stackRootFolder + config.mapperFolder)
     config.checkDir(mapperFolder)
-    config.writeToJsonFile(mapDict, mapperFolder + '/' + config.fileNames[mapperName], True) # True -> Overwrite
+    return mapperFolder + '/'
+
+def createMapperFile(apiKey, folder, mapDict, mapperName=''):
+    '''
+    Reusable function that creates the mapper file between exported and imported uids
+    '''
+    config.logging.info('Writing {} mapper to file'.format(mapperName))
+    mapperFolder = defineMapperFolder(apiKey, folder)
+    config.writeToJsonFile(mapDict, mapperFolder + config.fileNames[mapperName], True) # True -> Overwrite
     return mapDict
 
-def addToMapper(mapDict, exportedUid, importedUid):
+def defineJournalPath(apiKey, folder, mapperName):
+    '''
+    Mapper journals are next to the mapper file, e.g. entries.journal.jsonl
+    '''
+    return defineMapperFolder(apiKey, folder) + config.fileNames[mapperName].replace('.json', '.journal.jsonl')
+
+def openJournal(apiKey, folder, mapperName):
+    '''
+    Opening the append-only journal of a mapper. Every uid added to the mapper is written to it right away,
+    so an interrupted import knows what it already created
+    '''
+    return open(defineJournalPath(apiKey, folder, mapperName), 'a')
+
+def readJournal(apiKey, folder, mapperName):
+    '''
+    Reading the mapper of a previous import job, from the mapper file and the journal
+    A half written last line (crash while writing) is ignored
+    '''
+    mapperFolder = defineMapperFolder(apiKey, folder)
+    mapDict = {}
+    if os.path.isfile(mapperFolder + config.fileNames[mapperName]):
+        mapDict = config.readFromJsonFile(mapperFolder + config.fileNames[mapperName]) or {}
+    journalPath = defineJournalPath(apiKey, folder, mapperName)
+    if os.path.isfile(journalPath):
+        with open(journalPath) as f:
+            for line in f:
+                try:
+                    exportedUid, importedUid = json.loads(line)
+                    mapDict[exportedUid] = importedUid
+                except ValueError:
+                    config.logging.warning('{}Ignoring broken line in mapper journal: {}{}'.format(config.YELLOW, journalPath, config.END))
+    return mapDict
+
+def resetJournal(apiKey, folder, mapperName):
+    '''
+    Starting an import job over - Forgetting what was imported before
+    '''
+    mapperFolder = defineMapperFolder(apiKey, folder)
+    for f in [mapperFolder + config.fileNames[mapperName], defineJournalPath(apiKey, folder, mapperName)]:
+        if os.path.isfile(f):
+            os.remove(f)
+    return True
+
+def addToMapper(mapDict, exportedUid, importedUid, journal=None):
     '''
     Simple reusable function that adds to mapper dictionary
     The mapDict is used in import, to change export uids to import uids. Also written to file for audit purposed
-    '''
-    mapDict[exportedUid] = importedUid
+    With a journal (see openJournal), the mapping is persisted immediately
+    '''
+    with mapperLock:
+        mapDict[exportedUid] = importedUid
+        if journal:
+            journal.write(json.dumps([exportedUid, importedUid]) + '\n')
+            journal.flush()
+            if config.journalFsync:
+                os.fsync(journal.fileno())
     return mapDict
 
 def createNewStack(authToken, orgUid, region):
@@ -103,55 +206,40 @@ def importLanguage(language, apiKey, authToken, region):
 def importLanguages(apiKey, authToken, region, folder, masterLocale):
     '''
     Imports languages
+    A language can only be created after its fallback locale. Languages are imported level by level down the fallback tree,
+    languages of the same level concurrently
     '''
     config.logging.info('{}Importing languages{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['languages']
-    createdLanguages = [masterLocale]
-    delayedList = []
-    mapDict = {}
+    languages = {}
     for langFile in config.readDirIfExists(f):
         language = config.readFromJsonFile(f + langFile)
         if language:
             if language['code'] != masterLocale:
-                if language['fallback_locale'] not in createdLanguages:# and language['code'] != masterLocale:
-                    config.logging.info('Fallback Locale {} not yet created for locale {}. Delaying import.'.format(language['fallback_locale'], language['code']))
-                    delayedList.append(language)
-                else:
-                    importedLanguage = importLanguage(language, apiKey, authToken, region)
-                    if importedLanguage:
-                        createdLanguages.append(language['code'])
-                        mapDict.update(importedLanguage)
-                    else:
-                        delayedList.append(language)
+                languages[language['code']] = language
         else:
             config.logging.error('{}Unable to read from Language file {}{}'.format(config.RED, langFile, config.END))
-    counter = 1
-    while delayedList and counter <= len(delayedList) * 5: # If we need to try this too often, we stop after len*5 times
-        language = delayedList[0]
-        config.logging.info('Retrying to import locale skipped earlier: {}.'.format(language['code']))
-        if language['fallback_locale'] in createdLanguages:
-            importedLanguage = importLanguage(language, apiKey, authToken, region)
-            if importedLanguage:
-                createdLanguages.append(language['code'])
-                mapDict.update(importedLanguage)
-            else:
-                delayedList.append(language)
-        else:
-            delayedList.append(language)
-        delayedList.pop(0)
-        counter += 1
-
-    # if we still have some languages unimported still, we just add them with the master locale as the fallback
-    if delayedList:
-        config.logging.warning('{}Unable to import languages with correct fallback locale defined: Importing with master locale as fallback: {}{}'.format(config.YELLOW, str(delayedList, config.END)))
-        for language in delayedList:
+    levels, cycles = dependencyGraph.levels({code: [language['fallback_locale']] for code, language in languages.items()})
+    for cycle in cycles:
+        config.logging.warning('{}Circular fallback locales: {}. Importing with master locale as fallback{}'.format(config.YELLOW, ', '.join(cycle), config.END))
+        for code in cycle:
+            languages[code]['fallback_locale'] = masterLocale
+    createdLanguages = set([masterLocale])
+    mapDict = {}
+
+    def importOne(language):
+        if language['fallback_locale'] not in createdLanguages:
+            # Fallback locale not in the export, or not imported - we just add it with the master locale as the fallback
+            config.logging.warning('{}Unable to import language {} with fallback locale {}: Importing with master locale as fallback{}'.format(config.YELLOW, language['code'], language['fallback_locale'], config.END))
             language['fallback_locale'] = masterLocale
-            importedLanguage = importLanguage(language, apiKey, authToken, region)
-            if importedLanguage:
-                createdLanguages.append(language['code'])
-                mapDict.update(importedLanguage)
-            else:
-                delayedList.append(language)
+        importedLanguage = importLanguage(language, apiKey, authToken, region)
+        if importedLanguage:
+            createdLanguages.add(language['code'])
+            for exportedUid, importedUid in importedLanguage.items():
+                addToMapper(mapDict, exportedUid, importedUid)
+
+    for level in levels:
+        importConcurrently(importOne, [languages[code] for code in level])
     return createMapperFile(apiKey, folder, mapDict, 'languages')
 
 def importEnvironments(apiKey, authToken, region, folder):
@@ -161,7 +249,8 @@ def importEnvironments(apiKey, authToken, region, folder):
     config.logging.info('{}Importing environments{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['environments']
     mapDict = {}
-    for envFile in config.readDirIfExists(f):
+
+    def importOne(envFile):
         environment = config.readFromJsonFile(f + envFile)
         if environment:
             body = {
@@ -170,9 +259,11 @@ def importEnvironments(apiKey, authToken, region, folder):
             environmentImport = cma.createEnvironment(apiKey, authToken, body, region)
             if environmentImport:
                 config.logging.info('Environment {} imported'.format(environment['name']))
-                mapDict = addToMapper(mapDict, environment['uid'], environmentImport['environment']['uid'])
+                addToMapper(mapDict, environment['uid'], environmentImport['environment']['uid'])
         else:
             config.logging.error('{}Unable to read from Environments file {}{}'.format(config.RED, envFile, config.END))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return createMapperFile(apiKey, folder, mapDict, 'environments')
 
 def importDeliveryTokens(apiKey, authToken, region, folder):
@@ -181,7 +272,8 @@ def importDeliveryTokens(apiKey, authToken, region, folder):
     '''
     config.logging.info('{}Importing delivery tokens{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['deliveryTokens']
-    for delFile in config.readDirIfExists(f):
+
+    def importOne(delFile):
         deliveryToken = config.readFromJsonFile(f + delFile)
         if deliveryToken:
             body = {
@@ -200,6 +292,8 @@ def importDeliveryTokens(apiKey, authToken, region, folder):
                 config.logging.info('Delivery Token {} imported'.format(deliveryToken['name']))
         else:
             config.logging.error('{}Unable to read from Delivery Token file {}{}'.format(config.RED, delFile, config.END))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return True
 
 def importExtensions(apiKey, authToken, region, folder):
@@ -209,7 +303,8 @@ def importExtensions(apiKey, authToken, region, folder):
     config.logging.info('{}Importing extensions{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['extensions']
     mapDict = {}
-    for extFile in config.readDirIfExists(f):
+
+    def importOne(extFile):
         extension = config.readFromJsonFile(f + extFile)
         if extension:
             body = {
@@ -221,9 +316,11 @@ def importExtensions(apiKey, authToken, region, folder):
             extensionImport = cma.createExtension(apiKey, authToken, body, region)
             if extensionImport:
                 config.logging.info('Extension {} imported'.format(extension['title']))
-                mapDict = addToMapper(mapDict, extension['uid'], extensionImport['extension']['uid'])
+                addToMapper(mapDict, extension['uid'], extensionImport['extension']['uid'])
         else:
             config.logging.error('{}Unable to read from Extension file {}{}'.format(config.RED, extFile, config.END))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return createMapperFile(apiKey, folder, mapDict, 'extensions')
 
 def importLabel(mapDict, apiKey, authToken, label, region):
@@ -239,45 +336,39 @@ def importLabel(mapDict, apiKey, authToken, label, region):
 def importLabels(apiKey, authToken, region, folder):
     '''
     Importing labels
+    A label can only be created after its parents. Labels are imported level by level down the label tree,
+    labels of the same level concurrently
     '''
     config.logging.info('{}Importing labels{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['labels']
-    delayedList = []
-    mapDict = {}
+    labels = {}
     for labFile in config.readDirIfExists(f):
         label = config.readFromJsonFile(f + labFile)
         if label:
-            if label['parent']:
-                delayedList.append(label)
-            else:
-                mapDict = importLabel(mapDict, apiKey, authToken, label, region)
+            labels[label['uid']] = label
         else:
             config.logging.error('{}Unable to read from Label file {}{}'.format(config.RED, labFile, config.END))
-    counter = 1
-    while delayedList and counter <= len(delayedList) * 5: # If we need to try this too often, we stop after len*5 times
-        label = delayedList[0]
-        try:
-            newParents = []
-            for parent in label['parent']:
-                newParents.append(mapDict[parent])
-            label['parent'] = newParents
-            mapDict = importLabel(mapDict, apiKey, authToken, label, region)
-        except KeyError:
+    levels, cycles = dependencyGraph.levels({uid: label['parent'] or [] for uid, label in labels.items()})
+    inCycle = set(uid for cycle in cycles for uid in cycle)
+    topLevel = []
+    mapDict = {}
+
+    def importOne(label):
+        parents = label['parent'] or []
+        if label['uid'] in inCycle or any(parent not in mapDict for parent in parents):
+            # If some parents are missing (or circular), we just import the label without the hierarchy
             config.logging.debug('Unable to find parent label for {}'.format(label['name']))
-            delayedList.append(label)
-        delayedList.pop(0)
-        counter += 1
-    
-    # If some labels are still in that list, we just import them without the hierarchy
-    if delayedList:
-        config.logging.warning('{}Unable to import all labels with correct parents. Importing them in the top level.{}'.format(config.YELLOW, config.END))
-        labelStr = ''
-        for label in delayedList:
             label['parent'] = []
-            labelStr = labelStr + ', ' + label['name']
-            mapDict = importLabel(mapDict, apiKey, authToken, label, region)
+            topLevel.append(label['name'])
+        else:
+            label['parent'] = [mapDict[parent] for parent in parents]
+        importLabel(mapDict, apiKey, authToken, label, region)
 
-        config.logging.warning('{}Labels imported without parents: {}{}'.format(config.YELLOW, labelStr, config.END))
+    for level in levels:
+        importConcurrently(importOne, [labels[uid] for uid in level])
+    if topLevel:
+        config.logging.warning('{}Unable to import all labels with correct parents. Imported them in the top level.{}'.format(config.YELLOW, config.END))
+        config.logging.warning('{}Labels imported without parents: {}{}'.format(config.YELLOW, ', '.join(topLevel), config.END))
 
     return createMapperFile(apiKey, folder, mapDict, 'labels')
 
@@ -329,7 +420,8 @@ def importRoles(apiKey, authToken, region, folder, languageMapper, environmentMa
     #             roleUids['Content Manager'] = role['uid']
 
     mapDict = {}
-    for roleFile in config.readDirIfExists(f):
+
+    def importOne(roleFile):
         if roleFile not in ('Admin.json', 'Content Manager.json', 'Developer.json'): # Skipping update in built-in roles - Because it's buggy
             role = config.readFromJsonFile(f + roleFile)
             if role:
@@ -341,7 +433,7 @@ def importRoles(apiKey, authToken, region, folder, languageMapper, environmentMa
                 roleImport = cma.createRole(apiKey, authToken, {'role': role}, region)
                 if roleImport:
                     try:
-                        mapDict = addToMapper(mapDict, role['uid'], roleImport['role']['uid'])
+                        addToMapper(mapDict, role['uid'], roleImport['role']['uid'])
                     except KeyError:
                         config.logging.debug('Not able to map uid for role {}'.format(role['name']))
                     config.logging.info('{} role imported'.format(role['name']))
@@ -349,6 +441,8 @@ def importRoles(apiKey, authToken, region, folder, languageMapper, environmentMa
                 config.logging.error('{}Unable to read from Role file {}{}'.format(config.RED, roleFile, config.END))
         else:
             config.logging.info('Skipping system role import: {}'.format(roleFile))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return createMapperFile(apiKey, folder, mapDict, 'roles')
 
 def importWorkflows(apiKey, authToken, region, folder, roleMapper):
@@ -358,15 +452,18 @@ def importWorkflows(apiKey, authToken, region, folder, roleMapper):
     config.logging.info('{}Importing workflows{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['workflows']
     mapDict = {}
-    for wfFile in config.readDirIfExists(f):
+
+    def importOne(wfFile):
         workflow = config.readFromJsonFile(f + wfFile)
         if workflow:
             workflowImport = cma.createWorkflow(apiKey, authToken, {'workflow': workflow}, region)
             if workflowImport:
-                mapDict = addToMapper(mapDict, workflow['uid'], workflowImport['workflow']['uid'])
+                addToMapper(mapDict, workflow['uid'], workflowImport['workflow']['uid'])
                 config.logging.info('{} workflow imported'.format(workflow['name']))
         else:
             config.logging.error('{}Unable to read from Workflow file {}{}'.format(config.RED, wfFile, config.END))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return createMapperFile(apiKey, folder, mapDict, 'workflows')
 
 def importPublishingRules(apiKey, authToken, region, folder, mappers):
@@ -375,17 +472,17 @@ def importPublishingRules(apiKey, authToken, region, folder, mappers):
     '''
     config.logging.info('{}Importing publishing rules{}'.format(config.BOLD, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['publishingRules']
-    count = 1
-    for pubFile in config.readDirIfExists(f):
-        publishingRule = config.readFromJsonFile(f + pubFile)
-        for key, value in mappers.items():
-            publishingRule = replaceFromMapper(value, publishingRule, key) # role uids from old and new stack mapped
+    table = compileMapper(*mappers.values()) # role, workflow and environment uids from old and new stack mapped
+
+    def importOne(pubFile):
+        publishingRule = substituteUids(config.readFromJsonFile(f + pubFile), table)
         publishingRuleImport = cma.createPublishingRule(apiKey, authToken, {'publishing_rule': publishingRule}, region)
         if publishingRuleImport:
-            config.logging.info('Publishing Rule {} imported'.format(count))
+            config.logging.info('Publishing Rule {} imported'.format(pubFile))
         else:
             config.logging.error('{}Unable to read from Publishing Rule file {}{}'.format(config.RED, pubFile, config.END))
-        count += 1
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return True
 
 def importWebhooks(apiKey, authToken, region, folder):
@@ -398,7 +495,8 @@ def importWebhooks(apiKey, authToken, region, folder):
     else:
         config.logging.info('{}Webhooks will be enabled on import. Please make sure they do not trigger on live environments{}'.format(config.YELLOW, config.END))
     f = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['webhooks']
-    for whfile in config.readDirIfExists(f):
+
+    def importOne(whfile):
         webhook = config.readFromJsonFile(f + whfile)
         if config.disableWebhooks:
             webhook['disabled'] = True
@@ -407,6 +505,8 @@ def importWebhooks(apiKey, authToken, region, folder):
             config.logging.info('Webhook {} imported'.format(webhook['name']))
         else:
             config.logging.error('{}Unable to read from Webhook file {}{}'.format(config.RED, whfile, config.END))
+
+    importConcurrently(importOne, config.readDirIfExists(f))
     return True
 
 def createContentTypesAndGlobalFields(apiKey, token, region, folder):
@@ -415,7 +515,8 @@ def createContentTypesAndGlobalFields(apiKey, token, region, folder):
     '''
     config.logging.info('{}Creating Content Types{}'.format(config.BOLD, config.END))
     ctFolder = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['contentTypes']
-    for ctFile in config.readDirIfExists(ctFolder):
+
+    def createContentType(ctFile):
         config.logging.info('Creating content type from file: {}'.format(ctFile))
         contentType = config.readFromJsonFile(ctFolder + ctFile)
         if contentType:
@@ -436,10 +537,13 @@ def createContentTypesAndGlobalFields(apiKey, token, region, folder):
                 config.logging.info('Content Type {} created'.format(contentType['title']))
             else:
                 config.logging.critical('{}Content Type {} NOT created!{}'.format(config.RED, contentType['title'], config.END))
+
+    importConcurrently(createContentType, config.readDirIfExists(ctFolder))
     config.logging.info('{}Finished creating all Content Types{}'.format(config.BOLD, config.END))
     config.logging.info('{}Creating Global Fields{}'.format(config.BOLD, config.END))
     gfFolder = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['globalFields']
-    for gfFile in config.readDirIfExists(gfFolder):
+
+    def createGlobalField(gfFile):
         globalField = config.readFromJsonFile(gfFolder + gfFile)
         if globalField:
             body = {
@@ -454,6 +558,8 @@ def createContentTypesAndGlobalFields(apiKey, token, region, folder):
                 config.logging.info('Global Field {} created'.format(globalField['title']))
             else:
                 config.logging.critical('{}Global Field {} NOT created!{}'.format(config.RED, globalField['title'], config.END))
+
+    importConcurrently(createGlobalField, config.readDirIfExists(gfFolder))
     config.logging.info('{}Finished creating all Global Fields{}'.format(config.BOLD, config.END))
 
 def updateContentTypesAndGlobalFields(apiKey, token, region, folder, extensionMapper):
@@ -462,10 +568,12 @@ def updateContentTypesAndGlobalFields(apiKey, token, region, folder, extensionMa
     '''
     config.logging.info('{}Updating Content Types with correct schema{}'.format(config.BOLD, config.END))
     ctFolder = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['contentTypes']
-    for ctFile in config.readDirIfExists(ctFolder):
+    table = compileMapper(extensionMapper)
+
+    def updateContentType(ctFile):
         contentType = config.readFromJsonFile(ctFolder + ctFile)
         if contentType:
-            contentType = replaceFromMapper(extensionMapper, contentType, 'content types')
+            contentType = substituteUids(contentType, table)
             body = {'content_type': contentType}
             # cma.deleteContentType(apiKey, token, region, contentType['uid'])
             # ctUpdate = cma.createContentType(apiKey, token, body, region)
@@ -474,13 +582,16 @@ def updateContentTypesAndGlobalFields(apiKey, token, region, folder, extensionMa
                 config.logging.info('Content Type {} updated'.format(contentType['title']))
             else:
                 config.logging.critical('{}Content Type {} NOT updated!{}'.format(config.RED, contentType['title'], config.END))
+
+    importConcurrently(updateContentType, config.readDirIfExists(ctFolder))
     config.logging.info('{}Finished updating Content Types{}'.format(config.BOLD, config.END))
     config.logging.info('{}Updating Global Fields with correct schema{}'.format(config.BOLD, config.END))
     gfFolder = config.dataRootFolder + config.stackRootFolder + folder + config.folderNames['globalFields']
-    for gfFile in config.readDirIfExists(gfFolder):
+
+    def updateGlobalField(gfFile):
         globalField = config.readFromJsonFile(gfFolder + gfFile)
         if globalField:
-            globalField = replaceFromMapper(extensionMapper, globalField, 'global fields')
+            globalField = substituteUids(globalField, table)
             body = {'global_field': globalField}
             # cma.deleteGlobalField(apiKey, token, region, globalField['uid'])
             # gfUpdate = cma.createGlobalField(apiKey, token, body, region)
@@ -489,41 +600,54 @@ def updateContentTypesAndGlobalFields(apiKey, token, region, folder, extensionMa
                 config.logging.info('Global Field {} updated'.format(globalField['title']))
             else:
                 config.logging.critical('{}Global Field {} NOT updated!{}'.format(config.RED, globalField['title'], config.END))
+
+    importConcurrently(updateGlobalField, config.readDirIfExists(gfFolder))
     config.logging.info('{}Finished updating Global Fields{}'.format(config.BOLD, config.END))
 
+def structureModules(apiKey, token, region, folder, masterLocale):
+    '''
+    The structure import as a dependency graph of modules: {module: ([modules it depends on], function(mappers))}
+    A module can start when the modules it depends on are finished - mappers has their results (uid mappers)
+    Content types are created empty first, so everything referring to content types depends on that
+    '''
+    return {
+        'createContentTypes': ([], lambda mappers: createContentTypesAndGlobalFields(apiKey, token, region, folder)),
+        'languages': ([], lambda mappers: importLanguages(apiKey, token, region, folder, masterLocale)),
+        'environments': ([], lambda mappers: importEnvironments(apiKey, token, region, folder)),
+        'deliveryTokens': (['environments'], lambda mappers: importDeliveryTokens(apiKey, token, region, folder)),
+        'extensions': (['createContentTypes'], lambda mappers: importExtensions(apiKey, token, region, folder)), # Need to map extension uids from export to import. Can be scoped to content types
+        'labels': (['createContentTypes'], lambda mappers: importLabels(apiKey, token, region, folder)),
+        'roles': (['createContentTypes', 'languages', 'environments'], lambda mappers: importRoles(apiKey, token, region, folder, mappers['languages'], mappers['environments'])),
+        'workflows': (['createContentTypes', 'roles'], lambda mappers: importWorkflows(apiKey, token, region, folder, mappers['roles'])),
+        'publishingRules': (['environments', 'roles', 'workflows'], lambda mappers: importPublishingRules(apiKey, token, region, folder, {key: mappers[key] for key in ('environments', 'workflows', 'roles')})),
+        'webhooks': (['createContentTypes', 'environments'], lambda mappers: importWebhooks(apiKey, token, region, folder)), # Can be on content types and environments
+        'updateContentTypes': (['createContentTypes', 'extensions'], lambda mappers: updateContentTypesAndGlobalFields(apiKey, token, region, folder, mappers['extensions'])),
+    }
+
 def importStack(importedStack, token, region, folder):
     '''
     Import stack function
+    Modules run as soon as the modules they depend on are finished (see structureModules)
     '''
     apiKey = importedStack['uid']
     config.logging.info('{}Starting structure import{}'.format(config.BOLD, config.END))
     startTime = time()
-    createContentTypesAndGlobalFields(apiKey, token, region, folder)
-    languageMapper = importLanguages(apiKey, token, region, folder, importedStack['masterLocale'])
-    environmentMapper = importEnvironments(apiKey, token, region, folder)
-    if not environmentMapper:
-        config.logging.info('{}No Environmentsmapper present. Were there any environments in the export?{}'.format(config.YELLOW, config.END))
-    importDeliveryTokens(apiKey, token, region, folder)
-    extensionMapper = importExtensions(apiKey, token, region, folder) # Need to map extension uids from export to import
-    if not extensionMapper:
-        config.logging.info('{}No Extensionmapper present. Were there any extensions in the export?{}'.format(config.YELLOW, config.END))
-    # globalFields = importGlobalFields(apiKey, token, region, folder, extensionMapper)
-    # importContentTypes(apiKey, token, region, folder, extensionMapper, globalFields) # Using global fields to differentiate them from other references
-    importLabels(apiKey, token, region, folder)
-    roleMapper = importRoles(apiKey, token, region, folder, languageMapper, environmentMapper) # Need to map role uids from export to import
-    if not roleMapper:
-        config.logging.info('{}No Rolemapper present. Were there any custom roles in the export?{}'.format(config.YELLOW, config.END))
-    workflowMapper = importWorkflows(apiKey, token, region, folder, roleMapper) # Need to map workflow uids from export to import
-    if not workflowMapper:
-        config.logging.info('{}No Workflowmapper present. Were there any workflows in the export?{}'.format(config.YELLOW, config.END))
-    mappers = {
-        'environments': environmentMapper,
-        'workflows': workflowMapper,
-        'roles': roleMapper
-    }
-    importPublishingRules(apiKey, token, region, folder, mappers)
-    importWebhooks(apiKey, token, region, folder)
-    updateContentTypesAndGlobalFields(apiKey, token, region, folder, extensionMapper)
+    modules = structureModules(apiKey, token, region, folder, importedStack['masterLocale'])
+    graph = {module: dependencies for module, (dependencies, _) in modules.items()}
+    mappers = {}
+
+    def runModule(module):
+        mappers[module] = modules[module][1](mappers)
+        return mappers[module]
+
+    _, durations = dependencyGraph.runGraph(graph, runModule, config.structureImportWorkers, 'structureImport')
+    for module, name in (('environments', 'Environments'), ('extensions', 'Extension'), ('roles', 'Role'), ('workflows', 'Workflow')):
+        if not mappers.get(module):
+            config.logging.info('{}No {}mapper present. Were there any {} in the export?{}'.format(config.YELLOW, name, module, config.END))
+    for module in sorted(durations, key=durations.get, reverse=True):
+        config.logging.info('Module {} imported in {:.2f} seconds'.format(module, durations[module]))
+    path, pathTime = dependencyGraph.criticalPath(graph, durations)
+    config.logging.info('{}Critical path: {} ({:.2f} seconds){}'.format(config.BOLD, ' -> '.join(path), pathTime, config.END))
     endTime = time()
     totalTime = endTime - startTime
     config.logging.info('{}Import finished in {} seconds{}'.format(config.BOLD, totalTime, config.END))
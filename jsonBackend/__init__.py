@@ -0,0 +1,119 @@
+'''
+Pluggable JSON serialization used for HTTP bodies and the export/import files.
+Uses the fastest backend installed - orjson, then msgspec - and falls back to the standard library json module.
+Set the environment variable CS_JSON_BACKEND (orjson, msgspec or json) to pick one, or call useBackend().
+
+loads() takes bytes (or str) and always raises ValueError on invalid JSON, whatever the backend.
+dumps() returns UTF-8 bytes, so they can be written to files and request bodies as they are.
+Compare the backends on an export with: python -m jsonBackend data/stacks/<export folder>/
+'''
+import os
+import re
+import json
+
+def stdlibBackend():
+    def dumps(payload):
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return json.loads, dumps
+
+def orjsonBackend():
+    import orjson
+    def dumps(payload):
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return orjson.loads, dumps # orjson.JSONDecodeError is a ValueError
+
+def msgspecBackend():
+    import msgspec
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return loads, encoder.encode
+
+backends = { # In order of preference
+    'orjson': orjsonBackend,
+    'msgspec': msgspecBackend,
+    'json': stdlibBackend
+}
+
+name = None
+loads = None
+dumps = None
+
+def available():
+    '''
+    Names of the backends that are installed
+    '''
+    names = []
+    for backendName, backend in backends.items():
+        try:
+            backend()
+        except ImportError:
+            continue
+        names.append(backendName)
+    return names
+
+scanToken = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|(?P<cut>"[^"\\]*(?:\\.[^"\\]*)*\\?\Z)|[{}\[\]]', re.S) # A string, a string cut off by the end of the chunk, or a bracket
+
+def countItems(filePath, chunkSize=1024 * 1024):
+    '''
+    Counting the items of the array in a document like {"entries": [{...}, {...}]} without parsing it.
+    The file is scanned in chunks for brackets (skipping strings), and objects opening inside the top level array are counted.
+    Constant memory, whatever the size of the file
+    '''
+    count = 0
+    depth = 0
+    leftover = b''
+    with open(filePath, 'rb') as f:
+        while True:
+            chunk = f.read(chunkSize)
+            data = leftover + chunk
+            leftover = b''
+            for match in scanToken.finditer(data):
+                token = match.group()
+                if match.group('cut') is not None:
+                    if chunk: # Scanned again with the next chunk
+                        leftover = data[match.start():]
+                elif token == b'{':
+                    if depth == 2:
+                        count += 1
+                    depth += 1
+                elif token == b'[':
+                    depth += 1
+                elif token in (b'}', b']'):
+                    depth -= 1
+            if not chunk:
+                return count
+
+def useBackend(backendName=None):
+    '''
+    Switching backend. The fastest installed one if no name is given. Returns the name of the backend in use
+    '''
+    global name, loads, dumps
+    for candidate in ([backendName] if backendName else backends):
+        try:
+            loads, dumps = backends[candidate]()
+        except ImportError:
+            continue
+        name = candidate
+        return name
+    raise ValueError('JSON backend not installed: {}'.format(backendName))
+
+def decodeResponse(res):
+    '''
+    Parsing a HTTP response body (requests.Response). Read once from the raw bytes, not decoded to text first
+    '''
+    return loads(res.content)
+
+def readFile(filePath):
+    with open(filePath, 'rb') as f:
+        return loads(f.read())
+
+def writeFile(payload, filePath):
+    with open(filePath, 'wb') as f:
+        f.write(dumps(payload))
+
+useBackend(os.environ.get('CS_JSON_BACKEND'))
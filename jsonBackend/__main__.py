@@ -0,0 +1,71 @@
+'''
+Micro-benchmark of the JSON backends on the entry files of a real export:
+    python -m jsonBackend data/stacks/<export folder>/ --repeat 5
+Every installed backend decodes all the entry records and encodes them again. The best of the repeats is reported.
+'''
+import gzip
+import argparse
+from time import perf_counter
+import config
+import entryStore
+import jsonBackend
+
+def readRecords(folder):
+    '''
+    The raw bytes of every entry in the export. Legacy entry files are a single record each
+    '''
+    records = []
+    entryFolder = folder + config.folderNames['entries']
+    for contentType in sorted(config.readDirIfExists(entryFolder)):
+        for filePath in entryStore.listEntryFiles(entryFolder + contentType + '/').values():
+            opener = gzip.open if filePath.endswith('.gz') else open
+            with opener(filePath, 'rb') as f:
+                if filePath.endswith('.json'):
+                    records.append(f.read())
+                else:
+                    records.extend(line for line in f if line.strip())
+    return records
+
+def bestOf(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        startTime = perf_counter()
+        function(*args)
+        seconds = perf_counter() - startTime
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def measure(backendName, records, repeat):
+    jsonBackend.useBackend(backendName)
+    loads, dumps = jsonBackend.loads, jsonBackend.dumps
+    documents = [loads(record) for record in records]
+    decodeSeconds = bestOf(repeat, lambda: [loads(record) for record in records])
+    encodeSeconds = bestOf(repeat, lambda: [dumps(document) for document in documents])
+    return {
+        'decodeSeconds': round(decodeSeconds, 4),
+        'encodeSeconds': round(encodeSeconds, 4),
+        'encodedBytes': sum(len(dumps(document)) for document in documents)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m jsonBackend', description='Compare the JSON backends on the entry files of an export')
+    parser.add_argument('folder', help='Export folder, e.g. data/stacks/<export folder>/')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    folder = args.folder if args.folder.endswith('/') else args.folder + '/'
+    records = readRecords(folder)
+    if not records:
+        config.logging.error('{}No entry files found in {}{}'.format(config.RED, folder, config.END))
+        return
+    size = sum(len(record) for record in records)
+    config.logging.info('{}{} entry records, {} MB{}'.format(config.BOLD, len(records), round(size / 1024 / 1024, 2), config.END))
+    inUse = jsonBackend.name
+    for backendName in jsonBackend.available():
+        result = measure(backendName, records, args.repeat)
+        decodeRate = round(size / 1024 / 1024 / result['decodeSeconds'], 1) if result['decodeSeconds'] else None
+        encodeRate = round(result['encodedBytes'] / 1024 / 1024 / result['encodeSeconds'], 1) if result['encodeSeconds'] else None
+        config.logging.info('{}{:8}{} decode: {}s ({} MB/s) - encode: {}s ({} MB/s)'.format(config.CYAN, backendName, config.END, result['decodeSeconds'], decodeRate, result['encodeSeconds'], encodeRate))
+    jsonBackend.useBackend(inUse)
+
+if __name__ == '__main__':
+    main()
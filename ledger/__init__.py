@@ -0,0 +1,118 @@
+'''
+Durable ledger of export work units and their states.
+Makes it possible to resume an interrupted export, redoing only the units that are not done.
+
+Units are strings, e.g. 'structure:contentTypes', 'entries:<content type>:<language>', 'asset:<uid>' and 'export' (the whole export).
+The ledger is an append-only file in the export folder. One line per state change, the last line of a unit wins.
+Every line is flushed when written, so the ledger survives the application crashing (and the machine as well if config.ledgerFsync is TRUE).
+'''
+import os
+import json
+import threading
+import config
+
+ledgerFile = 'ledger.jsonl' # Placed in the stack export root folder
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+ledgers = {} # export folder -> {'units': {unit: state}, 'file': open ledger file}
+ledgerLock = threading.Lock()
+
+def exists(folder):
+    return os.path.isfile(folder + ledgerFile)
+
+def readLedger(folder):
+    '''
+    Reading the states of all units from the ledger file
+    A half written last line (crash while writing) is ignored
+    '''
+    units = {}
+    if not exists(folder):
+        return units
+    with open(folder + ledgerFile) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                units[record['unit']] = record['state']
+            except (ValueError, KeyError):
+                config.logging.warning('{}Ignoring broken line in ledger: {}{}'.format(config.YELLOW, folder + ledgerFile, config.END))
+    return units
+
+def openLedger(folder):
+    '''
+    Returns the ledger of an export folder. Read from disk on first use
+    '''
+    with ledgerLock:
+        if folder not in ledgers:
+            config.checkDir(folder)
+            ledgers[folder] = {
+                'units': readLedger(folder),
+                'file': open(folder + ledgerFile, 'a')
+            }
+        return ledgers[folder]
+
+def state(folder, unit):
+    return openLedger(folder)['units'].get(unit)
+
+def isDone(folder, unit):
+    return state(folder, unit) == DONE
+
+def wasStarted(folder, unit):
+    '''
+    True if a previous run started the unit but did not finish it. Files it left behind should be overwritten
+    '''
+    return state(folder, unit) in (PENDING, FAILED)
+
+def mark(folder, unit, unitState):
+    '''
+    Recording a new state of a unit
+    '''
+    ledger = openLedger(folder)
+    with ledgerLock:
+        ledger['units'][unit] = unitState
+        ledger['file'].write(json.dumps({'unit': unit, 'state': unitState, 'at': config.getTimestamp()}) + '\n')
+        ledger['file'].flush()
+        if config.ledgerFsync:
+            os.fsync(ledger['file'].fileno())
+    return True
+
+def unfinishedUnits(folder):
+    '''
+    Units that are pending or failed
+    '''
+    return [unit for unit, unitState in openLedger(folder)['units'].items() if unitState != DONE]
+
+def isResumable(folder):
+    '''
+    An export with a ledger where the whole export was never marked as done
+    '''
+    return exists(folder) and readLedger(folder).get('export') != DONE
+
+def runUnit(folder, unit, function, *args):
+    '''
+    Runs a unit of work, unless it is already done, and records its state.
+    The function failing (exception, or returning None or False) marks the unit as failed.
+    Returns what the function returned, True if the unit was already done, or None if it failed
+    '''
+    if isDone(folder, unit):
+        config.logging.info('Already done, skipping: {}'.format(unit))
+        return True
+    mark(folder, unit, PENDING)
+    try:
+        result = function(*args)
+    except Exception as e:
+        config.logging.error('{}Failed: {} - Error Message: {}{}'.format(config.RED, unit, e, config.END))
+        mark(folder, unit, FAILED)
+        return None
+    if result is None or result is False:
+        mark(folder, unit, FAILED)
+        return None
+    mark(folder, unit, DONE)
+    return result
+
+def closeLedger(folder):
+    with ledgerLock:
+        if folder in ledgers:
+            ledgers[folder]['file'].close()
+            del ledgers[folder]
@@ -0,0 +1,673 @@
+'''
+A local stand-in for the Contentstack APIs this project talks to - Content Management API, Content Delivery API (with the Sync API)
+and asset files - for offline testing and benchmarking. Everything is kept in memory.
+Only what this project uses is implemented, and only roughly the way Contentstack does it.
+
+Latency, rate limiting (429) and errors can be injected, to see how the export and import behave against a slow or busy API.
+
+    server = mockStack.startServer(latency=0.05, rateLimit=10, errorRate=0.01)
+    mockStack.pointRegions(server.url) # cma and cda talk to the local server from now on
+    ...
+    mockStack.stopServer(server)
+
+Or from the command line: python -m mockStack --port 8000
+and run the CLI with the environment variable CS_REGION_URL=http://127.0.0.1:8000/
+'''
+import re
+import json
+import socket
+import random
+import threading
+from uuid import uuid4
+from time import sleep, monotonic
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import config
+import cma
+import cda
+import httpClient
+
+pageSize = 100 # Maximum number of items per page, like Contentstack
+
+modules = { # Path (after v3/): (key of the list, key of a single item)
+    'content_types': ('content_types', 'content_type'),
+    'global_fields': ('global_fields', 'global_field'),
+    'extensions': ('extensions', 'extension'),
+    'workflows/publishing_rules': ('publishing_rules', 'publishing_rule'),
+    'workflows': ('workflows', 'workflow'),
+    'labels': ('labels', 'label'),
+    'locales': ('locales', 'locale'),
+    'environments': ('environments', 'environment'),
+    'stacks/delivery_tokens': ('tokens', 'token'),
+    'roles': ('roles', 'role'),
+    'webhooks': ('webhooks', 'webhook')
+}
+keepUid = ('content_types', 'global_fields') # Created with the uid in the body. Everything else gets a new uid
+
+def newUid():
+    return 'blt' + uuid4().hex[:16]
+
+class ApiError(Exception):
+    '''
+    Turned into an error response: {'error_message': message, 'error_code': code}
+    '''
+    def __init__(self, status, message, code=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.code = code
+
+class Store:
+    '''
+    The content of the fake Contentstack: organizations, stacks and everything in them.
+    Used by the request handler, and directly to seed stacks (e.g. for benchmarks)
+    '''
+    def __init__(self, url=''):
+        self.lock = threading.RLock()
+        self.url = url
+        self.organization = {'uid': 'mockOrg', 'name': 'Mock Organization', 'enabled': True, 'is_owner': True}
+        self.stacks = {}
+        self.files = {} # (apiKey, asset uid) -> bytes
+        self.sequence = 0 # Sync API change counter
+
+    def getStack(self, apiKey):
+        if apiKey not in self.stacks:
+            raise ApiError(422, 'Stack with api_key {} not found.'.format(apiKey), 109)
+        return self.stacks[apiKey]
+
+    def createStack(self, name, masterLocale='en-us', apiKey=None):
+        '''
+        An empty stack with the master locale
+        '''
+        with self.lock:
+            apiKey = apiKey or newUid()
+            stack = {
+                'api_key': apiKey,
+                'name': name,
+                'master_locale': masterLocale,
+                'org_uid': self.organization['uid'],
+                'created_at': config.getTimestamp(),
+                'modules': {path: {} for path in modules},
+                'entries': {}, # content type uid -> entry uid -> locale -> entry
+                'assets': {}, # uid -> asset (folders are assets with is_dir)
+                'changes': [] # (sequence, type, content type uid, data) for the Sync API
+            }
+            self.stacks[apiKey] = stack
+            self.addItem(apiKey, 'locales', {'code': masterLocale, 'name': masterLocale, 'fallback_locale': None})
+            return stack
+
+    def addItem(self, apiKey, path, item):
+        '''
+        Creating an item of a module (content type, role, label...)
+        '''
+        with self.lock:
+            items = self.getStack(apiKey)['modules'][path]
+            item = dict(item)
+            if path not in keepUid or not item.get('uid'):
+                item['uid'] = newUid()
+            if item['uid'] in items:
+                raise ApiError(422, '{} {} is not unique.'.format(modules[path][1], item['uid']), 119)
+            if path == 'locales' and any(locale['code'] == item.get('code') for locale in items.values()):
+                raise ApiError(422, 'Language {} already exists.'.format(item.get('code')), 247)
+            item['created_at'] = item['updated_at'] = config.getTimestamp()
+            items[item['uid']] = item
+            if path == 'content_types':
+                self.getStack(apiKey)['entries'].setdefault(item['uid'], {})
+            return item
+
+    def updateItem(self, apiKey, path, uid, item):
+        with self.lock:
+            items = self.getStack(apiKey)['modules'][path]
+            if uid not in items:
+                raise ApiError(422, '{} {} was not found.'.format(modules[path][1], uid), 118)
+            items[uid] = dict(items[uid], **item)
+            items[uid]['uid'] = uid
+            items[uid]['updated_at'] = config.getTimestamp()
+            return items[uid]
+
+    def deleteItem(self, apiKey, path, uid):
+        with self.lock:
+            items = self.getStack(apiKey)['modules'][path]
+            if uid not in items:
+                raise ApiError(422, '{} {} was not found.'.format(modules[path][1], uid), 118)
+            del items[uid]
+            if path == 'content_types':
+                self.getStack(apiKey)['entries'].pop(uid, None)
+                self.addChange(apiKey, 'content_type_deleted', uid, {'uid': uid})
+
+    def addChange(self, apiKey, changeType, contentType, data):
+        self.sequence += 1
+        self.getStack(apiKey)['changes'].append((self.sequence, changeType, contentType, data))
+
+    def contentTypeEntries(self, apiKey, contentType):
+        entries = self.getStack(apiKey)['entries']
+        if contentType not in entries:
+            raise ApiError(422, 'The Content Type {} was not found. Please try again.'.format(contentType), 118)
+        return entries[contentType]
+
+    def addEntry(self, apiKey, contentType, locale, entry, uid=None):
+        '''
+        Creating an entry - or localizing an existing entry (uid) in another locale
+        '''
+        with self.lock:
+            entries = self.contentTypeEntries(apiKey, contentType)
+            entry = dict(entry)
+            entry['uid'] = uid or newUid()
+            entry['locale'] = locale
+            previous = entries.get(entry['uid'], {}).get(locale)
+            entry['_version'] = previous['_version'] + 1 if previous else 1
+            entry['created_at'] = previous['created_at'] if previous else config.getTimestamp()
+            entry['updated_at'] = config.getTimestamp()
+            entry.setdefault('publish_details', [])
+            entries.setdefault(entry['uid'], {})[locale] = entry
+            self.addChange(apiKey, 'entry_published', contentType, entry)
+            return entry
+
+    def updateEntry(self, apiKey, contentType, locale, uid, entry):
+        with self.lock:
+            if uid not in self.contentTypeEntries(apiKey, contentType):
+                raise ApiError(422, 'Entry {} was not found.'.format(uid), 141)
+            return self.addEntry(apiKey, contentType, locale, entry, uid)
+
+    def deleteEntry(self, apiKey, contentType, uid, locale=None):
+        with self.lock:
+            entries = self.contentTypeEntries(apiKey, contentType)
+            if uid not in entries:
+                raise ApiError(422, 'Entry {} was not found.'.format(uid), 141)
+            if locale:
+                entries[uid].pop(locale, None)
+            if not locale or not entries[uid]:
+                del entries[uid]
+            self.addChange(apiKey, 'entry_deleted', contentType, {'uid': uid, 'locale': locale})
+
+    def entriesIn(self, apiKey, contentType, locale):
+        '''
+        Entries as they are in a locale - Entries not localized in it fall back to the master locale version
+        '''
+        masterLocale = self.getStack(apiKey)['master_locale']
+        result = []
+        for versions in self.contentTypeEntries(apiKey, contentType).values():
+            entry = versions.get(locale) or versions.get(masterLocale)
+            if entry:
+                result.append(entry)
+        return result
+
+    def addFolder(self, apiKey, name, parentUid=None):
+        with self.lock:
+            folder = {
+                'uid': newUid(),
+                'name': name,
+                'parent_uid': parentUid,
+                'is_dir': True,
+                'created_at': config.getTimestamp(),
+                'updated_at': config.getTimestamp()
+            }
+            self.getStack(apiKey)['assets'][folder['uid']] = folder
+            return folder
+
+    def addAsset(self, apiKey, fileName, data, contentType='application/octet-stream', fields=None):
+        '''
+        Creating an asset from the file content (bytes). fields are other asset fields, e.g. parent_uid, title, tags, publish_details
+        '''
+        with self.lock:
+            asset = {
+                'uid': newUid(),
+                'filename': fileName,
+                'content_type': contentType,
+                'file_size': str(len(data)),
+                'title': fileName,
+                'parent_uid': None,
+                'tags': [],
+                'is_dir': False,
+                'publish_details': [],
+                '_version': 1,
+                'created_at': config.getTimestamp(),
+                'updated_at': config.getTimestamp()
+            }
+            asset.update(fields or {})
+            asset['url'] = '{}files/{}/{}/{}'.format(self.url, apiKey, asset['uid'], fileName)
+            self.getStack(apiKey)['assets'][asset['uid']] = asset
+            self.files[(apiKey, asset['uid'])] = data
+            self.addChange(apiKey, 'asset_published', None, asset)
+            return asset
+
+def isPublished(item, environment, locale=None):
+    '''
+    Published on the environment (name or uid) - in the locale, if given
+    '''
+    details = item.get('publish_details') or []
+    if isinstance(details, dict):
+        details = [details]
+    for detail in details:
+        if detail.get('environment') in environment and (locale is None or detail.get('locale') in (None, locale)):
+            return True
+    return False
+
+def matchesQuery(item, query):
+    '''
+    The few query operators this project uses: equality, $gt, $in
+    '''
+    for key, condition in query.items():
+        value = item.get(key)
+        if isinstance(condition, dict):
+            if '$gt' in condition and not (value is not None and value > condition['$gt']):
+                return False
+            if '$in' in condition and value not in condition['$in']:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+def onlyFields(item, fields):
+    return {key: value for key, value in item.items() if key in fields}
+
+def encodeToken(payload):
+    return urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decodeToken(token):
+    try:
+        return json.loads(urlsafe_b64decode(token.encode('ascii')))
+    except ValueError:
+        raise ApiError(422, 'Invalid sync or pagination token.', 141)
+
+def parseMultipart(contentType, body):
+    '''
+    Returns the form fields {name: [values]} and the uploaded file (fileName, content type, bytes) of a multipart/form-data body
+    '''
+    message = BytesParser(policy=HTTP).parsebytes(b'Content-Type: ' + contentType.encode('latin-1') + b'\r\n\r\n' + body)
+    fields = {}
+    upload = None
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if part.get_filename():
+            upload = (part.get_filename(), part.get_content_type(), part.get_payload(decode=True))
+        else:
+            fields.setdefault(name, []).append(part.get_payload(decode=True).decode('utf-8'))
+    return fields, upload
+
+class Faults:
+    '''
+    What the server does to make life hard: latency, rate limiting (429) and random errors
+    '''
+    def __init__(self, latency=0, jitter=0, rateLimit=None, errorRate=0, errorStatuses=(500, 502, 503), seed=None):
+        self.latency = latency # Seconds added to every response
+        self.jitter = jitter # Up to this many seconds more, random
+        self.rateLimit = rateLimit # API requests per second, None for no limit
+        self.errorRate = errorRate # Share of requests (0-1) answered with one of errorStatuses
+        self.errorStatuses = errorStatuses
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window = 0
+        self.windowCount = 0
+
+    def delay(self):
+        with self.lock:
+            wait = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if wait:
+            sleep(wait)
+
+    def rateLimited(self):
+        '''
+        Fixed one second windows. Returns the number of requests left in the window, or None when over the limit
+        '''
+        if not self.rateLimit:
+            return True
+        with self.lock:
+            window = int(monotonic())
+            if window != self.window:
+                self.window = window
+                self.windowCount = 0
+            self.windowCount += 1
+            if self.windowCount > self.rateLimit:
+                return None
+            return self.rateLimit - self.windowCount
+
+    def error(self):
+        if not self.errorRate:
+            return None
+        with self.lock:
+            if self.random.random() < self.errorRate:
+                return self.random.choice(self.errorStatuses)
+        return None
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Routes requests to the store. self.server has the store, faults and stats
+    '''
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real thing
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Headers and body are written separately - No waiting for delayed ACKs
+
+    def log_message(self, format, *args):
+        config.logging.debug('mockStack: ' + format % args)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def readBody(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send(self, status, body=b'', contentType='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count(status, len(body))
+
+    def handle_request(self, method):
+        body = self.readBody()
+        self.server.countIn(len(body))
+        faults = self.server.faults
+        faults.delay()
+        url = urlsplit(self.path)
+        path = unquote(url.path).strip('/')
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        params['only'] = parse_qs(url.query).get('only[BASE][]')
+        headers = {}
+        if path.startswith('v3/'):
+            remaining = faults.rateLimited()
+            if remaining is None:
+                return self.send(429, {'error_message': 'Too many requests. Try again later.', 'error_code': 429}, headers={'Retry-After': '1', 'X-RateLimit-Limit': str(faults.rateLimit), 'X-RateLimit-Remaining': '0'})
+            if faults.rateLimit:
+                headers = {'X-RateLimit-Limit': str(faults.rateLimit), 'X-RateLimit-Remaining': str(remaining)}
+        errorStatus = faults.error()
+        if errorStatus:
+            return self.send(errorStatus, {'error_message': 'Injected error.', 'error_code': errorStatus}, headers=headers)
+        try:
+            if path.startswith('files/'):
+                return self.sendFile(path)
+            if not path.startswith('v3/'):
+                raise ApiError(404, 'Not found.')
+            status, payload = route(self.server.store, method, path[3:], params, self.headers, body)
+        except ApiError as e:
+            status, payload = e.status, {'error_message': e.message, 'error_code': e.code}
+        except (ValueError, KeyError, TypeError) as e:
+            status, payload = 400, {'error_message': 'Bad request: {}'.format(e), 'error_code': 400}
+        self.send(status, payload, headers=headers)
+
+    def sendFile(self, path):
+        '''
+        Asset files: files/{apiKey}/{uid}/{filename} - with Range requests (resumed downloads)
+        '''
+        parts = path.split('/')
+        data = self.server.store.files.get((parts[1], parts[2])) if len(parts) >= 4 else None
+        if data is None:
+            return self.send(404, b'Not found', 'text/plain')
+        asset = self.server.store.stacks[parts[1]]['assets'][parts[2]]
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if not match:
+            return self.send(200, data, asset['content_type'], {'Accept-Ranges': 'bytes'})
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        if start >= len(data):
+            return self.send(416, b'', asset['content_type'], {'Content-Range': 'bytes */{}'.format(len(data))})
+        end = min(end, len(data) - 1)
+        return self.send(206, data[start:end + 1], asset['content_type'], {'Content-Range': 'bytes {}-{}/{}'.format(start, end, len(data)), 'Accept-Ranges': 'bytes'})
+
+def page(items, params, listKey):
+    '''
+    A page of a listing (skip/limit) - with the count if asked for
+    '''
+    if params.get('query'):
+        query = json.loads(params['query'])
+        items = [item for item in items if matchesQuery(item, query)]
+    skip = int(params.get('skip', 0))
+    limit = min(int(params.get('limit', pageSize)), pageSize)
+    result = items[skip:skip + limit]
+    if params.get('only'):
+        result = [onlyFields(item, params['only']) for item in result]
+    payload = {listKey: result}
+    if params.get('include_count') == 'true':
+        payload['count'] = len(items)
+    return payload
+
+def route(store, method, path, params, headers, body):
+    '''
+    Returns the status code and payload of an API call. path is after v3/
+    '''
+    delivery = 'access_token' in headers
+    if not delivery and not headers.get('authtoken') and path != 'user-session':
+        raise ApiError(401, 'You\'re not allowed in here unless you\'re logged in.', 105)
+    data = json.loads(body) if body and headers.get('Content-Type', '').startswith('application/json') else {}
+    user = {'uid': 'mockUser', 'email': 'mock@localhost', 'authtoken': 'mockAuthToken', 'organizations': [store.organization]}
+    if path == 'user-session' and method == 'POST':
+        return 200, {'notice': 'Login Successful.', 'user': user}
+    if path == 'user' and method == 'GET':
+        return 200, {'user': user}
+    if path == 'stacks' and method == 'GET':
+        return 200, {'stacks': [{key: stack[key] for key in ('api_key', 'name', 'master_locale', 'org_uid')} for stack in store.stacks.values()]}
+    if path == 'stacks' and method == 'POST':
+        stack = store.createStack(data['stack']['name'], data['stack'].get('master_locale', 'en-us'))
+        return 201, {'notice': 'Stack created successfully.', 'stack': {key: stack[key] for key in ('api_key', 'name', 'master_locale', 'org_uid')}}
+    apiKey = headers.get('api_key')
+    stack = store.getStack(apiKey)
+    if path == 'stacks/sync':
+        return 200, sync(store, apiKey, params)
+    parts = path.split('/')
+    if parts[0] == 'content_types' and len(parts) >= 3 and parts[2] == 'entries':
+        return entries(store, apiKey, method, parts, params, data, delivery)
+    if parts[0] == 'assets':
+        return assets(store, apiKey, method, parts, params, headers, body, delivery)
+    for modulePath, (listKey, itemKey) in modules.items():
+        if path == modulePath or path.startswith(modulePath + '/'):
+            uid = path[len(modulePath) + 1:]
+            items = stack['modules'][modulePath]
+            if method == 'GET' and not uid:
+                return 200, page(list(items.values()), params, listKey)
+            if method == 'GET' and uid in items:
+                return 200, {itemKey: items[uid]}
+            if method == 'POST' and not uid:
+                return 201, {'notice': '{} created successfully.'.format(itemKey), itemKey: store.addItem(apiKey, modulePath, data[itemKey])}
+            if method == 'PUT' and uid:
+                return 200, {'notice': '{} updated successfully.'.format(itemKey), itemKey: store.updateItem(apiKey, modulePath, uid, data[itemKey])}
+            if method == 'DELETE' and uid:
+                store.deleteItem(apiKey, modulePath, uid)
+                return 200, {'notice': '{} deleted successfully.'.format(itemKey)}
+            raise ApiError(404, '{} {} was not found.'.format(itemKey, uid), 118)
+    raise ApiError(404, 'Not found.')
+
+def entries(store, apiKey, method, parts, params, data, delivery):
+    '''
+    content_types/{content type}/entries[/{uid}[/locales]]
+    '''
+    contentType = parts[1]
+    locale = params.get('locale') or store.getStack(apiKey)['master_locale']
+    uid = parts[3] if len(parts) > 3 else None
+    if method == 'GET' and not uid:
+        items = store.entriesIn(apiKey, contentType, locale)
+        if delivery:
+            items = [item for item in items if isPublished(item, environmentKeys(store, apiKey, params.get('environment')), locale)]
+        return 200, page(items, params, 'entries')
+    if method == 'POST' and not uid:
+        return 201, {'notice': 'Entry created successfully.', 'entry': store.addEntry(apiKey, contentType, locale, data['entry'])}
+    versions = store.contentTypeEntries(apiKey, contentType).get(uid)
+    if versions is None:
+        raise ApiError(422, 'Entry {} was not found.'.format(uid), 141)
+    if method == 'GET' and len(parts) > 4 and parts[4] == 'locales':
+        masterLocale = store.getStack(apiKey)['master_locale']
+        codes = [item['code'] for item in store.getStack(apiKey)['modules']['locales'].values()]
+        return 200, {'locales': [dict({'code': code}, **({'localized': True} if code in versions and code != masterLocale else {})) for code in codes]}
+    if method == 'GET':
+        entry = versions.get(locale) or versions.get(store.getStack(apiKey)['master_locale'])
+        return 200, {'entry': entry}
+    if method == 'PUT':
+        return 200, {'notice': 'Entry updated successfully.', 'entry': store.updateEntry(apiKey, contentType, locale, uid, data['entry'])}
+    if method == 'DELETE':
+        store.deleteEntry(apiKey, contentType, uid, params.get('locale'))
+        return 200, {'notice': 'Entry deleted successfully.'}
+    raise ApiError(404, 'Not found.')
+
+def assets(store, apiKey, method, parts, params, headers, body, delivery):
+    '''
+    assets, assets/folders and assets/{uid}
+    '''
+    items = store.getStack(apiKey)['assets']
+    if method == 'GET' and len(parts) == 1:
+        result = list(items.values())
+        if delivery:
+            environment = environmentKeys(store, apiKey, params.get('environment'))
+            result = [item for item in result if not item['is_dir'] and isPublished(item, environment)]
+        return 200, page(result, params, 'assets')
+    if method == 'POST' and parts[1:] == ['folders']:
+        folder = json.loads(body)['asset']
+        return 201, {'notice': 'Folder created successfully.', 'asset': store.addFolder(apiKey, folder['name'], folder.get('parent_uid'))}
+    if method == 'POST' and len(parts) == 1:
+        fields, upload = parseMultipart(headers.get('Content-Type', ''), body)
+        if not upload:
+            raise ApiError(422, 'Please upload a file.', 200)
+        assetFields = {}
+        for key in ('parent_uid', 'description', 'title'):
+            if 'asset[{}]'.format(key) in fields:
+                assetFields[key] = fields['asset[{}]'.format(key)][0]
+        if 'asset[tags]' in fields:
+            assetFields['tags'] = fields['asset[tags]']
+        return 201, {'notice': 'Asset created successfully.', 'asset': store.addAsset(apiKey, upload[0], upload[2], upload[1], assetFields)}
+    if method == 'GET' and len(parts) == 2 and parts[1] in items:
+        return 200, {'asset': items[parts[1]]}
+    raise ApiError(404, 'Not found.')
+
+def environmentKeys(store, apiKey, environment):
+    '''
+    Publish details can have the environment name or uid
+    '''
+    keys = set([environment])
+    for item in store.getStack(apiKey)['modules']['environments'].values():
+        if environment in (item.get('name'), item['uid']):
+            keys.update([item.get('name'), item['uid']])
+    return keys
+
+def sync(store, apiKey, params):
+    '''
+    Sync API. Initial sync: every published entry and asset on the environment. With a sync token: what has changed since.
+    Pages of 100 items with a pagination token, the last page has the sync token for the next sync
+    '''
+    if params.get('pagination_token'):
+        state = decodeToken(params['pagination_token'])
+    elif params.get('sync_token'):
+        state = dict(decodeToken(params['sync_token']), skip=0, init=False)
+    else:
+        state = {'environment': params.get('environment'), 'sequence': 0, 'skip': 0, 'init': True}
+    stack = store.getStack(apiKey)
+    with store.lock:
+        environment = environmentKeys(store, apiKey, state['environment'])
+        until = store.sequence
+        if state['init']:
+            items = []
+            for contentType, contentTypeEntries in stack['entries'].items():
+                for versions in contentTypeEntries.values():
+                    for locale, entry in versions.items():
+                        if isPublished(entry, environment, locale):
+                            items.append({'type': 'entry_published', 'content_type_uid': contentType, 'data': entry})
+            items.extend({'type': 'asset_published', 'data': asset} for asset in stack['assets'].values() if not asset['is_dir'] and isPublished(asset, environment))
+        else:
+            items = []
+            for sequence, changeType, contentType, data in stack['changes']:
+                if sequence <= state['sequence'] or sequence > state.get('until', until):
+                    continue
+                if changeType in ('entry_published', 'asset_published') and not isPublished(data, environment, data.get('locale') if changeType == 'entry_published' else None):
+                    continue
+                item = {'type': changeType, 'data': data}
+                if contentType and changeType != 'content_type_deleted':
+                    item['content_type_uid'] = contentType
+                items.append(item)
+    until = state.get('until', until)
+    result = {'items': items[state['skip']:state['skip'] + pageSize], 'skip': state['skip'], 'limit': pageSize, 'total_count': len(items)}
+    if state['skip'] + pageSize < len(items):
+        result['pagination_token'] = encodeToken(dict(state, skip=state['skip'] + pageSize, until=until))
+    else:
+        result['sync_token'] = encodeToken({'environment': state['environment'], 'sequence': until})
+    return result
+
+class Server(ThreadingHTTPServer):
+    '''
+    The HTTP server, with the store, the faults and counters of what went through it
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, faults):
+        super().__init__(address, Handler)
+        self.url = 'http://{}:{}/'.format(self.server_address[0], self.server_address[1])
+        self.store = Store(self.url)
+        self.faults = faults
+        self.statsLock = threading.Lock()
+        self.stats = newStats()
+
+    def countIn(self, length):
+        with self.statsLock:
+            self.stats['bytesReceived'] += length
+
+    def count(self, status, length):
+        with self.statsLock:
+            self.stats['requests'] += 1
+            self.stats['bytesSent'] += length
+            self.stats['statuses'][str(status)] = self.stats['statuses'].get(str(status), 0) + 1
+
+def newStats():
+    return {'requests': 0, 'bytesReceived': 0, 'bytesSent': 0, 'statuses': {}}
+
+def startServer(host='127.0.0.1', port=0, latency=0, jitter=0, rateLimit=None, errorRate=0, errorStatuses=(500, 502, 503), seed=None):
+    '''
+    Starts the server in a background thread. Port 0 picks a free port - the address is in server.url
+    '''
+    faults = Faults(latency, jitter, rateLimit, errorRate, errorStatuses, seed)
+    server = Server((host, port), faults)
+    thread = threading.Thread(target=server.serve_forever, name='mockStack', daemon=True)
+    thread.start()
+    config.logging.info('{}Mock Contentstack running on {}{}'.format(config.BOLD, server.url, config.END))
+    return server
+
+def stopServer(server):
+    server.shutdown()
+    server.server_close()
+    return True
+
+def takeStats(server):
+    '''
+    What went through the server since the last time (requests, bytes, status codes) - and resetting the counters
+    '''
+    with server.statsLock:
+        stats = server.stats
+        server.stats = newStats()
+    return stats
+
+def pointRegions(url, rateLimit=None):
+    '''
+    Pointing every region of the cma and cda wrappers at url (e.g. server.url)
+    With rateLimit (requests per second), the client side rate limit governor is used for the local host as well
+    '''
+    for regionMap in (cma.regionMap, cda.regionMap):
+        for key in regionMap:
+            regionMap[key] = url
+    if rateLimit:
+        config.rateLimits[httpClient.hostOf(url)] = rateLimit
+    return url
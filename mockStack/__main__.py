@@ -0,0 +1,34 @@
+'''
+Running the mock Contentstack from the command line:
+    python -m mockStack --port 8000 --latency 0.05 --rate-limit 10 --error-rate 0.01
+Point the CLI at it with the environment variable CS_REGION_URL=http://127.0.0.1:8000/
+'''
+import argparse
+from time import sleep
+import config
+import mockStack
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m mockStack', description='Local stand-in for the Contentstack APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many seconds more, random')
+    parser.add_argument('--rate-limit', type=float, default=None, help='API requests per second before 429 responses')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests (0-1) answered with a 5xx error')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable error injection')
+    parser.add_argument('--stack', action='append', default=[], help='Name of an empty stack to create (can be repeated)')
+    args = parser.parse_args()
+    server = mockStack.startServer(args.host, args.port, args.latency, args.jitter, args.rate_limit, args.error_rate, seed=args.seed)
+    for name in args.stack:
+        stack = server.store.createStack(name)
+        config.logging.info('Stack {} created. api_key: {}'.format(name, stack['api_key']))
+    config.logging.info('{}Run the CLI with CS_REGION_URL={} - Ctrl+C to stop{}'.format(config.BOLD, server.url, config.END))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        mockStack.stopServer(server)
+
+if __name__ == '__main__':
+    main()